@@ -0,0 +1,132 @@
+import numpy
+import pandas
+
+
+CUBE_KEYS = ['database', 'query_id', 'name', 'category', 'table_size_category', 'concurrency_factor', 'cache_state']
+INDEX_COLUMNS = ['concurrency_factor', 'database', 'query_id', 'cache_state']  # widget filters matched by equality
+RANGE_COLUMNS = ['time', 'rows']  # widget filters matched by range
+MAX_POINTS = 2000  # maximum number of points of a scatter plot sent to the browser
+MAX_TABLE_ROWS = 10000  # maximum number of rows of the data table sent to the browser
+
+
+def aggregate(dataframe):
+    """
+    Returns the count and sums of the execution time and rows of the result rows, indexed by the CUBE_KEYS.
+    """
+    keys = dataframe[CUBE_KEYS].copy()
+    for column in ['name', 'category', 'table_size_category', 'cache_state']:
+        keys[column] = keys[column].astype(str)
+    grouped = dataframe[RANGE_COLUMNS].astype(float).groupby([keys[column] for column in CUBE_KEYS])
+    aggregated = grouped.sum()
+    aggregated.columns = ['sum_' + column for column in RANGE_COLUMNS]
+    aggregated['count'] = grouped['time'].count()
+    return aggregated
+
+
+class Cube:
+    """
+    Pre-aggregated data layer of the dashboard.  The result rows are rolled up once into a cube of the count and sums
+    of the execution time and rows for every combination of the CUBE_KEYS, so the charts aggregate the small cube
+    instead of the result rows.  The widget filters are served from indexes built once: positions of the rows by value
+    of the INDEX_COLUMNS and the rows sorted by each of the RANGE_COLUMNS.
+    """
+    def __init__(self, dataframe):
+        self.dataframe = dataframe.reset_index(drop=True)
+        self.cube = aggregate(self.dataframe).reset_index()
+        self.indexes = {column: {str(value): positions for value, positions in
+                                 self.dataframe.groupby(self.dataframe[column].astype(str)).indices.items()}
+                        for column in INDEX_COLUMNS}
+        self.sorted = {}
+        for column in RANGE_COLUMNS:
+            order = numpy.argsort(self.dataframe[column].values, kind='mergesort')
+            self.sorted[column] = (order, self.dataframe[column].values[order])
+
+    def append(self, dataframe):
+        """
+        Appends new result rows, adding their aggregates to the cube and merging their positions into the indexes
+        without rebuilding them.  Returns the appended rows with their positions as index.
+        """
+        offset = len(self.dataframe.index)
+        dataframe = dataframe.reindex(columns=self.dataframe.columns)
+        dataframe.index = numpy.arange(offset, offset + len(dataframe.index))
+        self.dataframe = pandas.concat([self.dataframe, dataframe])
+        self.cube = self.cube.set_index(CUBE_KEYS).add(aggregate(dataframe), fill_value=0).reset_index()
+        for column in INDEX_COLUMNS:
+            index = self.indexes[column]
+            for value, positions in dataframe.groupby(dataframe[column].astype(str)).indices.items():
+                index[str(value)] = numpy.concatenate([index.get(str(value), numpy.array([], dtype=int)),
+                                                       positions + offset])
+        for column in RANGE_COLUMNS:
+            order, values = self.sorted[column]
+            new_order = numpy.argsort(dataframe[column].values, kind='mergesort')
+            new_values = dataframe[column].values[new_order]
+            insert_at = numpy.searchsorted(values, new_values, side='right')
+            self.sorted[column] = (numpy.insert(order, insert_at, new_order + offset), numpy.insert(values, insert_at, new_values))
+        return dataframe
+
+    def rollup(self, by, where=None):
+        """
+        Returns the mean execution time and rows for every combination of the 'by' columns, computed from the cube
+        sums so that every result row is weighted equally.  The optional 'where' dictionary restricts the cube to the
+        given column values.
+        """
+        cube = self.cube
+        for column, value in (where or {}).items():
+            cube = cube[cube[column] == value]
+        rolled = cube.groupby(by)[['sum_' + column for column in RANGE_COLUMNS] + ['count']].sum().reset_index()
+        for column in RANGE_COLUMNS:
+            rolled[column] = rolled['sum_' + column] / rolled['count']
+        return rolled
+
+    def positions(self, column, values):
+        """
+        Returns the sorted positions of the rows having any of the given values in an index column.
+        """
+        index = self.indexes[column]
+        arrays = [index[str(value)] for value in values if str(value) in index]
+        return numpy.unique(numpy.concatenate(arrays)) if arrays else numpy.array([], dtype=int)
+
+    def between(self, column, low, high):
+        """
+        Returns the sorted positions of the rows having a value within the closed range of a range column.
+        """
+        order, values = self.sorted[column]
+        return numpy.sort(order[numpy.searchsorted(values, low, side='left'):numpy.searchsorted(values, high, side='right')])
+
+    def filter(self, concurrency_factors, databases, query_ids, time_range, rows_range, cache_states, positions=None):
+        """
+        Returns the result rows matching the widget filters by intersecting the positions from the indexes, only among
+        the rows at the optional 'positions', such as the rows just appended.
+        """
+        candidates_list = [self.positions('database', databases), self.positions('query_id', query_ids),
+                           self.between('time', *time_range), self.between('rows', *rows_range),
+                           self.positions('cache_state', cache_states)]
+        if positions is not None:
+            candidates_list.append(numpy.asarray(positions, dtype=int))
+        positions = self.positions('concurrency_factor', concurrency_factors)
+        for candidates in candidates_list:
+            positions = numpy.intersect1d(positions, candidates, assume_unique=True)
+        return self.dataframe.iloc[positions]
+
+    def rows(self, concurrency_factor):
+        return self.dataframe.iloc[self.positions('concurrency_factor', [concurrency_factor])]
+
+
+def downsample(dataframe, max_points=MAX_POINTS, by='database', tail_fraction=0.1, seed=0):
+    """
+    Returns at most 'max_points' rows of a DataFrame for plotting.  Each 'by' group gets an equal share of the points,
+    made of its slowest executions, so the tail latency stays visible, and a uniform random sample of the rest.
+    """
+    if len(dataframe.index) <= max_points:
+        return dataframe
+    groups = dataframe.groupby(by)
+    share = max(max_points // max(len(groups), 1), 1)
+    sampled = []
+    for name, group in groups:
+        if len(group.index) <= share:
+            sampled.append(group)
+            continue
+        tail = group.nlargest(int(share * tail_fraction), 'time')
+        rest = group.drop(tail.index)
+        sampled.append(pandas.concat([tail, rest.sample(n=share - len(tail.index), random_state=seed)]))
+    return pandas.concat(sampled)
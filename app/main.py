@@ -1,12 +1,15 @@
 import os
+import sys
 import logging
 import random
+import argparse
 import pandas
 from collections import defaultdict
 from bokeh.charts import Bar, Scatter, Line
 from bokeh.layouts import widgetbox, row, column
+from bokeh.plotting import figure
 import bokeh.palettes
-from bokeh.models import Button, Select, RangeSlider, DataTable, ColumnDataSource, CustomJS, TableColumn, Div, CheckboxGroup, MultiSelect
+from bokeh.models import Button, Select, RangeSlider, DataTable, ColumnDataSource, CustomJS, TableColumn, Div, CheckboxGroup, MultiSelect, HoverTool
 from bokeh.io import curdoc
 
 
@@ -42,6 +45,15 @@ bootstrap_css = '''
 '''
 
 
+def filters():
+    """
+    Returns the arguments of the Cube filter method from the current values of the widgets.
+    """
+    return ([select_concurrency.value], [checkbox_database.labels[index] for index in checkbox_database.active],
+            multiselect_query_id.value, slider_time.range, slider_rows.range,
+            [checkbox_cache_state.labels[index] for index in checkbox_cache_state.active])
+
+
 def update(attrname, old, new):
     # print(str(attrname) + ':  ' + str(old) + ' -> ' + str(new))
     # print("concurrency_factor:  " + str(select_concurrency.value))
@@ -49,51 +61,216 @@ def update(attrname, old, new):
     # print("database:  " + str([checkbox_database.labels[index] for index in checkbox_database.active]))
     # print("query_id:  " + str(multiselect_query_id.value))
     # print("rows:  " + str(slider_rows.range[0]) + " - " + str(slider_rows.range[1]))
-    current = dataframe[(dataframe['concurrency_factor'].astype(str) == select_concurrency.value)
-                        & (dataframe['time'] >= slider_time.range[0])
-                        & (dataframe['time'] <= slider_time.range[1])
-                        & (dataframe['database'].astype(str).isin([checkbox_database.labels[index] for index in checkbox_database.active]))
-                        & (dataframe['query_id'].astype(str).isin(multiselect_query_id.value))
-                        & (dataframe['rows'] >= slider_rows.range[0])
-                        & (dataframe['rows'] <= slider_rows.range[1])]
-    source.data = ColumnDataSource(data=current).data
+    current = data.filter(*filters())
+    source.data = ColumnDataSource(data=current.head(cube.MAX_TABLE_ROWS)).data
+
+
+def extend_widgets(new_dataframe):
+    """
+    Adds the values of the new results missing from the widgets, so the results of a database, query or cache state
+    appearing during a live run are shown.  New values are selected when every value of their widget is selected, and
+    a slider covering its whole range is stretched to the new maximum.
+    """
+    for checkbox, column in [(checkbox_database, 'database'), (checkbox_cache_state, 'cache_state')]:
+        labels = [label for label in new_dataframe[column].sort_values().apply(str).unique() if label not in checkbox.labels]
+        if labels:
+            everything = len(checkbox.active) == len(checkbox.labels)
+            checkbox.labels = checkbox.labels + labels
+            if everything:
+                checkbox.active = list(range(len(checkbox.labels)))
+    options = [option for option in new_dataframe['concurrency_factor'].sort_values().apply(str).unique()
+               if option not in select_concurrency.options]
+    if options:
+        select_concurrency.options = select_concurrency.options + options
+    options = [option for option in new_dataframe['query_id'].sort_values().apply(str).unique()
+               if option not in [value for value, label in multiselect_query_id.options]]
+    if options:
+        everything = len(multiselect_query_id.value) == len(multiselect_query_id.options)
+        multiselect_query_id.options = multiselect_query_id.options + list(zip(options, options))
+        if everything:
+            multiselect_query_id.value = multiselect_query_id.value + options
+    for slider, column in [(slider_rows, 'rows'), (slider_time, 'time')]:
+        end = new_dataframe[column].max()
+        if end > slider.end and slider.range[1] >= slider.end:
+            slider.end = end
+            slider.step = end//100
+            slider.range = (slider.range[0], end)
+
+
+def poll():
+    """
+    Reads the results published since the last poll to the live feed file, at most LIVE_MAX_ROWS at a time, appends
+    them to the cube, streams the results matching the widget filters to the data table and patches the live averages
+    and the rolled up charts.
+    """
+    global live_offset
+    new_dataframe, live_offset = results.tail(live_filepath, live_offset, max_rows=LIVE_MAX_ROWS)
+    new_dataframe = results.succeeded(new_dataframe, app_args['mixed'], app_args['mixed'])
+    if new_dataframe.empty:
+        return
+    new_dataframe['cache_state'] = new_dataframe.reindex(columns=['cache_state'])['cache_state'].fillna(UNCONTROLLED)
+    extend_widgets(new_dataframe)  # before appending, as a widget change refreshes the data table from the cube
+    appended = data.append(new_dataframe.reindex(columns=dataframe.columns))
+    appended = data.filter(*filters(), positions=appended.index).fillna('')
+    if not appended.empty:
+        appended['index'] = appended.index
+        source.stream({c: appended[c].tolist() for c in source.data}, rollover=cube.MAX_TABLE_ROWS)
+    for bars in [bar_concurrency_by_database, bar_cache_state_by_database]:
+        bars.update()
+
+    averages = data.rollup(['concurrency_factor', 'database'])
+    positions = {key: position for position, key in
+                 enumerate(zip(live_source.data['concurrency_factor'], live_source.data['database']))}
+    patches = defaultdict(list)
+    new_averages = []
+    for average_index, average_row in averages.iterrows():
+        position = positions.get((average_row['concurrency_factor'], average_row['database']))
+        if position is None:
+            new_averages.append(average_row)
+            continue
+        for c in ['count', 'time', 'rows']:
+            patches[c].append((position, average_row[c]))
+    live_source.patch(dict(patches))
+    if new_averages:
+        new_averages = pandas.DataFrame(new_averages).reset_index()  # the 'index' column of the source
+        live_source.stream({c: new_averages[c].tolist() for c in live_source.data})
+
+
+class RollupBars:
+    """
+    A grouped bar chart of the average query execution time of every 'label' and 'group' of the cube.  Unlike the
+    bokeh.charts Bar, which aggregates its data once when it is built, the bars of every group are drawn from a
+    ColumnDataSource of their own, so the averages of new results are patched in place and new bars are streamed.
+    """
+    def __init__(self, label, group, title, xlabel, tooltips):
+        self.label = label
+        self.group = group
+        self.sources = {}
+        rolled = data.rollup([label, group])
+        self.figure = figure(x_range=self.factors(rolled), title=title, x_axis_label=xlabel,
+                             y_axis_label='Time in seconds', width=1800, height=400, tools='pan,wheel_zoom,reset,save')
+        self.figure.add_tools(HoverTool(tooltips=tooltips))
+        self.figure.xaxis.major_label_orientation = 0.8
+        self.figure.title.text_font_size = '12pt'
+        self.update(rolled)
+        self.figure.legend.location = 'top_right'
+
+    def factors(self, rolled):
+        """
+        Returns the x axis factors of the bars, one for every label and group, sorted by label then group.
+        """
+        return [str(label) + ' / ' + str(group) for label, group in
+                sorted(set(zip(rolled[self.label], rolled[self.group])))]
+
+    def update(self, rolled=None):
+        """
+        Patches the average time and count of the existing bars from the cube, and streams the bars of new labels
+        and groups, adding a glyph for every new group.
+        """
+        rolled = data.rollup([self.label, self.group]) if rolled is None else rolled
+        rolled['x'] = [str(label) + ' / ' + str(group) for label, group in zip(rolled[self.label], rolled[self.group])]
+        factors = self.factors(rolled)
+        if factors != self.figure.x_range.factors:
+            self.figure.x_range.factors = factors
+        for group, group_rolled in rolled.groupby(self.group):
+            group_rolled = group_rolled[['x', self.label, self.group, 'time', 'count']]
+            if group not in self.sources:
+                self.sources[group] = ColumnDataSource(data=group_rolled.to_dict(orient='list'))
+                self.figure.vbar(x='x', top='time', width=0.8, source=self.sources[group], legend=str(group),
+                                 color=palette[len(self.sources) % len(palette)])
+                continue
+            bar_source = self.sources[group]
+            positions = {x: position for position, x in enumerate(bar_source.data['x'])}
+            patches = defaultdict(list)
+            new_bars = []
+            for bar_index, bar_row in group_rolled.iterrows():
+                position = positions.get(bar_row['x'])
+                if position is None:
+                    new_bars.append(bar_row)
+                    continue
+                for c in ['time', 'count']:
+                    if bar_source.data[c][position] != bar_row[c]:
+                        patches[c].append((position, bar_row[c]))
+            if patches:
+                bar_source.patch(dict(patches))
+            if new_bars:
+                new_bars = pandas.DataFrame(new_bars)
+                bar_source.stream({c: new_bars[c].tolist() for c in bar_source.data})
 
 
 # Load source data
 package_dirpath = os.path.abspath(os.path.join(__file__, "../.."))
+sys.path.insert(0, package_dirpath)
+sys.path.insert(0, os.path.dirname(__file__))
+import results
+import cube
+
+# Select runs from the results store with:  bokeh serve app --args --run-id RUN_ID [RUN_ID ...]
+# Follow a running benchmark started with --live with:  bokeh serve app --args --live
+# Include the writes and the reads under writes of the mixed mode with:  bokeh serve app --args --mixed
+parser = argparse.ArgumentParser()
+parser.add_argument('--run-id', dest='run_ids', nargs='*', default=None)
+parser.add_argument('--live', action='store_true')
+parser.add_argument('--mixed', action='store_true')
+app_args = vars(parser.parse_known_args()[0])
+LIVE_INTERVAL_MS = 2000  # milliseconds between two polls of the live feed file
+LIVE_MAX_ROWS = 1000  # maximum number of results sent to the browser per poll
+UNCONTROLLED = 'uncontrolled'  # cache state of the results benchmarked without '--cache-state'
+
 example_csv_filepath = os.path.join(package_dirpath, 'csv/big_data_benchmarking.csv.example')
 csv_filepath = os.path.join(package_dirpath, 'csv/big_data_benchmarking.csv')
+results_path = os.path.join(package_dirpath, 'csv/big_data_benchmarking_results')
+live_filepath = os.path.join(package_dirpath, 'csv/big_data_benchmarking_live.jsonl')
+live_offset = os.path.getsize(live_filepath) if os.path.isfile(live_filepath) else 0  # results published so far are already in the store
 
-if os.path.isfile(csv_filepath):
-    pass
-elif os.path.isfile(example_csv_filepath):
-    logging.warning("CSV file: " + csv_filepath + " does NOT exist!")
-    logging.info("Using example CSV file: " + example_csv_filepath)
-    csv_filepath = example_csv_filepath
+if results.runs(results_path):
+    logging.info("Reading results store: " + results_path + "...")
+    dataframe = results.read(results_path, columns=results.CSV_COLUMNS + ['status'], run_ids=app_args['run_ids'])
+    dataframe = results.succeeded(dataframe, app_args['mixed'], app_args['mixed']).reindex(columns=results.CSV_COLUMNS)
 else:
-    logging.error("CSV file: " + csv_filepath + " does NOT  exist!")
-    os._exit(1)
+    if os.path.isfile(csv_filepath):
+        pass
+    elif os.path.isfile(example_csv_filepath):
+        logging.warning("CSV file: " + csv_filepath + " does NOT exist!")
+        logging.info("Using example CSV file: " + example_csv_filepath)
+        csv_filepath = example_csv_filepath
+    else:
+        logging.error("CSV file: " + csv_filepath + " does NOT  exist!")
+        os._exit(1)
 
-logging.info("Reading CSV file: " + csv_filepath + "...")
-dataframe = pandas.read_csv(csv_filepath, low_memory=False)
-source = ColumnDataSource(data=dataframe)
+    logging.info("Reading CSV file: " + csv_filepath + "...")
+    dataframe = results.succeeded(pandas.read_csv(csv_filepath, low_memory=False), app_args['mixed'],
+                                  app_args['mixed'])
+dataframe['cache_state'] = dataframe.reindex(columns=['cache_state'])['cache_state'].fillna(UNCONTROLLED)
+data = cube.Cube(dataframe)
+source = ColumnDataSource(data=data.dataframe.head(cube.MAX_TABLE_ROWS))
 
 # DataTable displays the raw output from the CSV file.
 columns = [TableColumn(field=c, title=c) for c in dataframe.columns]
 data_table = DataTable(source=source, columns=columns, editable=False, width=1480, height=500)
 
-# BarChart displaying the average query execution time for each database based on the concurrency factor.
-bar_concurrency_by_database = Bar(source.to_df(), values='time', label='concurrency_factor', group='database',
-                                  legend='top_right', xlabel='Concurrency factor', ylabel='Time in seconds',
-                                  title="Average query execution time by concurrency factor", agg='mean', width=1800,
-                                  tooltips=[('Database', '@database'), ('Time', '$y{0.000}'),
-                                            ('Concurrency Factor', '@concurrency_factor')], palette=palette)
-bar_concurrency_by_database.title.text_font_size = '12pt'
+# DataTable displaying the live average query execution time for each database based on the concurrency factor.
+live_source = ColumnDataSource(data=data.rollup(['concurrency_factor', 'database'])[['concurrency_factor', 'database', 'count', 'time', 'rows']])
+live_table = DataTable(source=live_source, columns=[TableColumn(field=c, title=c) for c in ['concurrency_factor', 'database', 'count', 'time', 'rows']],
+                       editable=False, width=1480, height=200)
+
+# BarChart displaying the average query execution time for each database based on the concurrency factor, patched
+# with the results of a live run.
+bar_concurrency_by_database = RollupBars('concurrency_factor', 'database',
+                                         "Average query execution time by concurrency factor", 'Concurrency factor',
+                                         tooltips=[('Database', '@database'), ('Time', '@time{0.000}'),
+                                                   ('Concurrency Factor', '@concurrency_factor')])
+
+# BarChart comparing the average query execution time of each database with cold and warm caches, patched with the
+# results of a live run.
+bar_cache_state_by_database = RollupBars('database', 'cache_state', "Average query execution time by cache state",
+                                         'Database', tooltips=[('Database', '@database'), ('Time', '@time{0.000}'),
+                                                               ('Cache State', '@cache_state')])
 
 plots = defaultdict(list)
 for i in dataframe['concurrency_factor'].sort_values().unique():
     # ScatterChart displays a point for every query comparing the execution time vs the number of rows returned from the query.
-    scatter_plot = Scatter(dataframe[dataframe['concurrency_factor'] == i], x='rows', y='time', color='database',
+    scatter_plot = Scatter(cube.downsample(data.rows(i)), x='rows', y='time', color='database',
                            title="Concurrency " + str(i) + "  |  Individual query execution time", legend='top_left',
                            legend_sort_field='color', legend_sort_direction='ascending', xlabel='Number of rows',
                            ylabel='Time in seconds', tooltips=[('Database', '@database'), ('Rows', '@rows'),
@@ -105,7 +282,7 @@ for i in dataframe['concurrency_factor'].sort_values().unique():
     plots['scatter_plot'].append(scatter_plot)
 
     # BarChart displaying the average query execution time for each database based on the query category.
-    bar_database_by_query_category = Bar(dataframe[dataframe['concurrency_factor'] == i], values='time',
+    bar_database_by_query_category = Bar(data.rollup(['database', 'category'], {'concurrency_factor': i}), values='time',
                                          label='database', stack='category', legend='top_right', xlabel='Database',
                                          ylabel='Time in seconds',
                                          title="Concurrency " + str(i) + " | Average query execution time by database",
@@ -116,7 +293,8 @@ for i in dataframe['concurrency_factor'].sort_values().unique():
     plots['bar_database_by_query_category'].append(bar_database_by_query_category)
 
     # BarChart displaying the average query execution time for each database based on the table size.
-    bar_database_by_table_size = Bar(dataframe[dataframe['concurrency_factor'] == i], values='time', label='database',
+    bar_database_by_table_size = Bar(data.rollup(['database', 'table_size_category'], {'concurrency_factor': i}),
+                                     values='time', label='database',
                                      stack='table_size_category', legend='top_right', xlabel='Database',
                                      ylabel='Time in seconds',
                                      title="Concurrency " + str(i) + " | Average query execution time by table size",
@@ -126,7 +304,8 @@ for i in dataframe['concurrency_factor'].sort_values().unique():
     plots['bar_database_by_table_size'].append(bar_database_by_table_size)
 
     # BarChart displaying the average query execution time for each query based on the database.
-    bar_query_id_by_database = Bar(dataframe[dataframe['concurrency_factor'] == i], label='query_id', values='time',
+    bar_query_id_by_database = Bar(data.rollup(['query_id', 'database'], {'concurrency_factor': i}), label='query_id',
+                                   values='time',
                                    group='database', legend='top_right', xlabel='Query ID', ylabel='Time in seconds',
                                    title="Concurrency " + str(i) + " | Average execution time by query id", agg='mean',
                                    tooltips=[('Database', '@database'), ('Time', '$y{0.000}'),
@@ -135,7 +314,7 @@ for i in dataframe['concurrency_factor'].sort_values().unique():
     plots['bar_query_id_by_database'].append(bar_query_id_by_database)
 
     # LineChart displaying the average query execution time for each query based on the database.
-    avg_query_time_dataframe = dataframe[dataframe['concurrency_factor'] == i].pivot_table(
+    avg_query_time_dataframe = data.rollup(['query_id', 'name', 'database'], {'concurrency_factor': i}).pivot_table(
         index=['query_id', 'name'], columns='database', values='time', aggfunc='mean').fillna('')
     database_columns = avg_query_time_dataframe.columns
     avg_query_time_dataframe.reset_index(inplace=True)
@@ -149,7 +328,7 @@ for i in dataframe['concurrency_factor'].sort_values().unique():
     plots['line_query_id_by_database'].append(line_query_id_by_database)
 
     # DataTable summarizing the average query execution times per database.
-    avg_query_time_dataframe = dataframe[dataframe['concurrency_factor'] == i].pivot_table(
+    avg_query_time_dataframe = data.rollup(['query_id', 'name', 'database'], {'concurrency_factor': i}).pivot_table(
         index=['query_id', 'name'], columns='database', values='time', aggfunc='mean').fillna('')
     avg_query_time_html = avg_query_time_dataframe.style \
         .set_table_attributes('class="table table-sm table-hover table-striped"') \
@@ -196,16 +375,25 @@ end = dataframe['time'].max()
 slider_time = RangeSlider(start=0, end=end, range=(0, end), step=end//100, title="Time")
 slider_time.on_change('range', update)
 
+labels = list(dataframe['cache_state'].sort_values().apply(str).unique())
+checkbox_cache_state = CheckboxGroup(labels=labels, active=[index for index, item in enumerate(labels)])
+checkbox_cache_state.on_change('active', update)
+
 button_download = Button(label="Download", button_type='success')
 button_download.callback = CustomJS(args=dict(source=source), code=open(os.path.join(os.path.dirname(__file__), "download.js")).read())
 
 widgets = [select_concurrency, checkbox_database, multiselect_query_id, slider_rows,
-           slider_time, button_download]
+           slider_time, checkbox_cache_state, button_download]
 
 #  Layout
 curdoc().title = "Big Data Benchmarking"
+if app_args['live']:
+    logging.info("Following live feed file: " + live_filepath)
+    curdoc().add_periodic_callback(poll, LIVE_INTERVAL_MS)
 curdoc().add_root(column(row(widgetbox(widgets), widgetbox(data_table)),
-                         row(bar_concurrency_by_database),
+                         row(widgetbox(live_table)),
+                         row(bar_concurrency_by_database.figure),
+                         row(bar_cache_state_by_database.figure),
                          row([item for item in plots['scatter_plot']]),
                          row([item for item in plots['bar_database_by_query_category']]),
                          row([item for item in plots['bar_database_by_table_size']]),
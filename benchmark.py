@@ -1,14 +1,25 @@
 #!/usr/bin/env python
 
 
-import os
+import re
+import sys
+import math
 import time
+import hashlib
+import queue
 import logging
+import threading
+import multiprocessing
+import subprocess
+import random
 import pandas
-from random import randint
+import histogram
+import tracing
 from retrying import retry
 from sqlalchemy import create_engine
 from pebble import concurrent
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import current_thread
 
 
 class Timer:
@@ -25,87 +36,677 @@ class TimeoutException(Exception):
     pass
 
 
-@concurrent.process(timeout=3600)  # timeout after 3600 seconds (60 minutes)
-def query(sql, engine):
+QUERY_TIMEOUT = 3600  # timeout after 3600 seconds (60 minutes)
+CANCEL_GRACE = 30  # seconds a cancelled query has to return before its session is killed and its process terminated
+BREAKER_TIMEOUTS = 3  # consecutive timeouts of a query category on a table after which its queries are skipped
+FETCH_BATCH_SIZE = 10000
+OS_CACHE_DROP_TIMEOUT = 300  # seconds the local OS page cache drop command has to finish
+CONFIDENCE_Z = 1.96  # 95% confidence
+
+oracle_numeric_datatypes = ['NUMBER', 'FLOAT', 'INTEGER']
+hana_numeric_datatypes = ['TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'SMALLDECIMAL', 'DECIMAL', 'REAL', 'DOUBLE']
+sqlserver_numeric_datatypes = ['tinyint', 'smallint', 'int', 'bigint', 'decimal', 'numeric', 'float']
+sqlite_numeric_datatypes = ['INTEGER', 'FLOAT', 'REAL', 'NUMERIC']
+NUMERIC_DATATYPES = set(map(str.lower, (oracle_numeric_datatypes + hana_numeric_datatypes + sqlserver_numeric_datatypes
+                                        + sqlite_numeric_datatypes)))
+
+
+def cancel(connection):
+    """
+    Cancels the statement running on a connection from another thread, using the 'cancel' method of the DBAPI
+    connection of drivers such as cx_Oracle, psycopg2 and pymssql, or the 'interrupt' method of sqlite3.  Returns
+    whether the driver supports cancelling.
+    """
+    dbapi_connection = connection.connection
+    for method in ['cancel', 'interrupt']:
+        if hasattr(dbapi_connection, method):
+            getattr(dbapi_connection, method)()
+            return True
+    return False
+
+
+class Deadline:
+    """
+    Cancels the statement running on a connection when it is still running after 'timeout' seconds.  A query failing
+    after it was cancelled raises a TimeoutException instead of the error of the driver.
+    """
+    def __init__(self, connection, timeout=None):
+        self.connection = connection
+        self.timeout = timeout
+        self.expired = False
+        self.timer = None
+
+    def __enter__(self):
+        if self.timeout:
+            self.timer = threading.Timer(self.timeout, self.expire)
+            self.timer.daemon = True
+            self.timer.start()
+        return self
+
+    def expire(self):
+        self.expired = True
+        try:
+            if not cancel(self.connection):
+                logging.warning("The driver is unable to cancel the query, waiting for it to finish")
+        except Exception as error:
+            logging.warning("Unable to cancel the query:  " + str(error))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.timer:
+            self.timer.cancel()
+        if exc_type is not None and self.expired:
+            raise TimeoutException("Query cancelled after " + str(self.timeout) + " seconds")
+        return False
+
+
+def execute(sql, connection, fetch_mode='dataframe', batch_size=FETCH_BATCH_SIZE, instrumentation=None, timeout=None):
+    """
+    Executes the sql query using an open connection, returning a dictionary of metrics for the query results.  The
+    'dataframe' fetch mode times building a full pandas DataFrame of the results, the 'stream' fetch mode calls the
+    stream function instead.  The query is cancelled on the server after 'timeout' seconds.  When an 'instrumentation'
+    dictionary is given, the server times of the session are read before the timed execution, and the instrument
+    function runs after it and adds its metrics.  The wall clock time the execution started at is returned as
+    'executed_at', to trace the execution from the thread waiting for it.
+    """
+    server_times_before = server_times(connection, instrumentation) if instrumentation else None
+    executed_at = time.time()
+    with Deadline(connection, timeout):
+        if fetch_mode == 'stream':
+            metrics = stream(sql, connection, batch_size)
+        else:
+            with Timer() as t:
+                dataframe = pandas.read_sql(sql, connection)
+                rows = len(dataframe.index)
+            metrics = {'rows': rows, 'time': t.interval, 'first_row_time': float('nan'), 'fetch_time': float('nan'),
+                       'bytes': int(dataframe.memory_usage(index=False, deep=True).sum())}
+    if instrumentation:
+        metrics.update(instrument(sql, connection, instrumentation, server_times_before))
+        metrics['client_time'] = metrics['time'] - metrics['server_elapsed_time']
+    metrics['executed_at'] = executed_at
+    return metrics
+
+
+def next_result(cursor):
     """
-    Uses the pebble.concurrent.process decorator, this function will timeout after the specified time frame has passed.
-    Executes the sql query using the engine, returning the time in seconds it takes the query to return all results as
-    well as returns the number of rows from the query results.
+    Moves the cursor to its next result set, returning whether there is one.  Drivers without multiple result sets
+    have no 'nextset' method or raise their own NotSupportedError.
     """
-    with Timer() as t:
-        dataframe = pandas.read_sql(sql, engine)
-        rows = len(dataframe.index)
-    return rows, t
+    nextset = getattr(cursor, 'nextset', None)
+    try:
+        return bool(nextset and nextset())
+    except Exception:
+        return False
 
 
-@retry(stop_max_attempt_number=6)  # stop after 6 attempts
-def build_query(engine, query_template, table_name, datatypes_dataframe, rows):
+def fetch_statements(statements, connection, **kwargs):
+    """
+    Executes a statement or a list of statements through a raw DBAPI cursor after formatting them with 'kwargs',
+    returning the rows of the last statement returning rows.  A statement returning several result sets, such as a
+    query under SET SHOWPLAN_TEXT ON whose statement text precedes its plan, returns its last non-empty result set.
     """
-    Using the retry decorator, will retry up to the specified number of attempts.  Calls the query_builder function,
-    formats the sql query, then calls the query function returning the formatted sql query, the number of rows from the
-    query result, and the formatted query execution time.
+    cursor = connection.connection.cursor()
+    rows = []
+    try:
+        for statement in [statements] if isinstance(statements, str) else statements:
+            cursor.execute(statement.format(**kwargs))
+            if cursor.description is None:
+                continue
+            rows = []
+            while True:
+                if cursor.description is not None:
+                    rows = cursor.fetchall() or rows
+                if not next_result(cursor):
+                    break
+    finally:
+        cursor.close()
+    return rows
+
+
+def plan_hash(plan):
+    """
+    Returns a hash of the shape of an execution plan, ignoring the numbers such as costs and row estimates that change
+    between executions of the same plan.
+    """
+    return hashlib.sha1(re.sub(r'\d+(\.\d+)?', '#', plan).encode('utf-8')).hexdigest()[:16]
+
+
+def server_times(connection, instrumentation):
+    """
+    Returns the cumulative server elapsed and CPU time in seconds of the session of the connection, the first and
+    second columns of the 'server_time_query' of the database, or None when the database has none.  A time the
+    database does not expose is NaN.
+    """
+    if not instrumentation.get('server_time_query'):
+        return None
+    try:
+        rows = fetch_statements(instrumentation['server_time_query'], connection)
+    except Exception as error:
+        logging.warning("Unable to capture server time:  " + str(error))
+        return None
+    values = list(rows[0]) if rows else []
+    return [float(value) if value is not None else float('nan') for value in (values + [None, None])[:2]]
+
+
+def instrument(sql, connection, instrumentation, server_times_before=None):
+    """
+    Captures the server-reported elapsed and optionally CPU time in seconds of the sql query, the increase of the
+    session times of the server_times function since 'server_times_before', read just before the execution, then its
+    execution plan with the 'explain_query' of the database, on the connection that executed it.  The times of the
+    session only count this execution whatever the other sessions run.  Each statement of the explain query is
+    formatted with the sql query and a 'statement_id' derived from it.  Metrics the database does not expose are left
+    empty.
+    """
+    metrics = {'plan': '', 'plan_hash': '', 'server_elapsed_time': float('nan'), 'server_cpu_time': float('nan')}
+    statement_id = hashlib.sha1(sql.encode('utf-8')).hexdigest()[:16]
+    server_times_after = server_times(connection, instrumentation) if server_times_before else None
+    if server_times_after:  # first, so the explain query is not counted
+        metrics['server_elapsed_time'] = server_times_after[0] - server_times_before[0]
+        metrics['server_cpu_time'] = server_times_after[1] - server_times_before[1]
+    if instrumentation.get('explain_query'):
+        try:
+            rows = fetch_statements(instrumentation['explain_query'], connection, query=sql, statement_id=statement_id)
+            metrics['plan'] = '\n'.join('\t'.join(str(value) for value in row) for row in rows)
+            metrics['plan_hash'] = plan_hash(metrics['plan'])
+        except Exception as error:
+            logging.warning("Unable to capture execution plan:  " + str(error))
+    return metrics
+
+
+def instruments(attributes, args):
+    """
+    Returns the instrumentation dictionary of the database when the '--explain' argument is given, otherwise None.
+    """
+    if not args.get('explain'):
+        return None
+    return {'explain_query': attributes.get('explain_query'), 'server_time_query': attributes.get('server_time_query')}
+
+
+def stream(sql, connection, batch_size=FETCH_BATCH_SIZE):
+    """
+    Executes the sql query through a raw DBAPI cursor, fetching 'batch_size' rows at a time and discarding each batch
+    after counting it, so the results are never materialized.  Returns the number of rows, the total time, the time to
+    the first row, the time spent fetching after the first row and the approximate number of bytes, estimated from the
+    average row size of the first batch.
+    """
+    cursor = connection.connection.cursor()  # raw DBAPI cursor bypassing the SQLAlchemy result proxy
+    try:
+        rows = 0
+        sample = []
+        with Timer() as t:
+            cursor.execute(sql)
+            batch = cursor.fetchmany(batch_size)
+            first_row_time = time.perf_counter() - t.start
+            sample = batch
+            while batch:
+                rows += len(batch)
+                batch = cursor.fetchmany(batch_size)
+    finally:
+        cursor.close()
+    row_bytes = sum(sys.getsizeof(value) for row in sample for value in row) / len(sample) if sample else 0
+    return {'rows': rows, 'time': t.interval, 'first_row_time': first_row_time,
+            'fetch_time': t.interval - first_row_time, 'bytes': int(row_bytes * rows)}
+
+
+@concurrent.process(timeout=None)
+def query(sql, engine, fetch_mode='dataframe', batch_size=FETCH_BATCH_SIZE, instrumentation=None, timeout=None):
+    """
+    Uses the pebble.concurrent.process decorator, this function runs in a new process which is terminated by the
+    execute_query function when it does not return within the grace period after the timeout.  Opens a new connection
+    using the engine and executes the sql query, returning the dictionary of metrics from the execute function
+    including the time in seconds it took to connect.
+    """
+    with Timer() as c:
+        connection = engine.connect()
+    try:
+        metrics = execute(sql, connection, fetch_mode, batch_size, instrumentation, timeout)
+    finally:
+        connection.close()
+    metrics['connect_time'] = c.interval
+    return metrics
+
+
+class Worker(multiprocessing.Process):
+    """
+    A long-lived process holding its own connection to the database for the duration of the benchmark.  SQL strings
+    are received through the 'task_queue' and the query results are returned through the 'result_queue', so no process
+    is forked and no login is performed per query.  When a 'cancellation' dictionary is given, the worker reports the
+    id of its session from the 'session_id_query' of the database after connecting, so a query that does not return
+    after being cancelled by the driver can be stopped with the 'cancel_query' of the database on another connection.
+    """
+    def __init__(self, connection_string, fetch_mode='dataframe', batch_size=FETCH_BATCH_SIZE, name=None,
+                 instrumentation=None, cancellation=None):
+        super().__init__(name=name, daemon=True)
+        self.connection_string = connection_string
+        self.fetch_mode = fetch_mode
+        self.batch_size = batch_size
+        self.instrumentation = instrumentation
+        self.cancellation = cancellation or {}
+        self.task_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        self.connect_time = None
+        self.session_id = None
+
+    def run(self):
+        engine = create_engine(self.connection_string)
+        try:
+            with Timer() as c:
+                connection = engine.connect()
+            session_id = None
+            if self.cancellation.get('session_id_query'):
+                session_id = fetch_statements(self.cancellation['session_id_query'], connection)[0][0]
+        except Exception as error:
+            self.result_queue.put(('error', str(error)))
+            return
+        self.result_queue.put(('connected', (c.interval, session_id)))
+        for sql, timeout in iter(self.task_queue.get, None):  # a None task stops the worker
+            try:
+                self.result_queue.put(('result', execute(sql, connection, self.fetch_mode, self.batch_size,
+                                                                self.instrumentation, timeout)))
+            except TimeoutException as error:
+                self.result_queue.put(('timeout', str(error)))
+            except Exception as error:  # exceptions raised by the database drivers are not always picklable
+                self.result_queue.put(('error', str(error)))
+        connection.close()
+        engine.dispose()
+
+    def _get(self, timeout):
+        try:
+            status, payload = self.result_queue.get(timeout=timeout)
+        except queue.Empty:
+            self.kill_session()
+            self.terminate()
+            raise TimeoutException("Worker " + str(self.name) + " did not respond after " + str(timeout) + " seconds")
+        if status == 'error':
+            raise RuntimeError(payload)
+        if status == 'timeout':
+            raise TimeoutException(payload)
+        return payload
+
+    def kill_session(self):
+        """
+        Stops the query running in the session of the worker with the 'cancel_query' of the database, executed on a new
+        connection.
+        """
+        if self.session_id is None or not self.cancellation.get('cancel_query'):
+            return
+        logging.warning("Killing session " + str(self.session_id) + " of worker " + str(self.name))
+        engine = create_engine(self.connection_string)
+        try:
+            with engine.connect() as connection:
+                fetch_statements(self.cancellation['cancel_query'], connection, session_id=self.session_id)
+        except Exception as error:
+            logging.error("Unable to kill session " + str(self.session_id) + ":  " + str(error))
+        finally:
+            engine.dispose()
+
+    def connect(self, timeout=QUERY_TIMEOUT):
+        """
+        Starts the process and blocks until the connection to the database is established, returning the time in
+        seconds it took to connect.
+        """
+        self.start()
+        self.connect_time, self.session_id = self._get(timeout)
+        return self.connect_time
+
+    def execute(self, sql, timeout=QUERY_TIMEOUT):
+        """
+        Sends the sql query to the worker process and blocks until the results are ready, returning the dictionary of
+        metrics from the execute function including the time in seconds the worker took to connect.  The worker cancels
+        the query after 'timeout' seconds, and is terminated after its session is killed when it still has not
+        returned CANCEL_GRACE seconds later.
+        """
+        if not self.is_alive():
+            raise RuntimeError("Worker " + str(self.name) + " is not running")
+        self.task_queue.put((sql, timeout))
+        metrics = self._get(timeout + CANCEL_GRACE)
+        metrics['connect_time'] = self.connect_time
+        return metrics
+
+    def stop(self):
+        if self.is_alive():
+            self.task_queue.put(None)
+            self.join(timeout=60)
+
+
+def execute_query(engine, sql, args, worker=None, instrumentation=None, timeout=QUERY_TIMEOUT):
+    """
+    Executes the sql query returning the dictionary of metrics from the execute function.  When a warm 'worker' is
+    given the query is sent to its already open connection, otherwise the connection pool is disposed and the query runs
+    in a new process with the given 'instrumentation'.  The query is cancelled after 'timeout' seconds, raising a
+    TimeoutException, and its process is terminated when it still has not returned CANCEL_GRACE seconds later.
     """
-    query_builder_dict = query_builder(table_name, datatypes_dataframe, rows)
-    sql = query_template.format(**query_builder_dict)
     logging.debug("Executing query:  " + sql)
+    if worker:
+        return worker.execute(sql, timeout)
     engine.dispose()  # dispose of the connection pool and create a new connection pool immediately
-    rows, t = query(sql, engine).result()  # blocks until results are ready
-    return sql, rows, float(t.interval)
+    future = query(sql, engine, args['fetch_mode'], args['batch_size'], instrumentation, timeout)
+    try:
+        return future.result(timeout=timeout + CANCEL_GRACE)  # blocks until results are ready
+    except FutureTimeoutError:
+        future.cancel()  # terminates the process
+        raise TimeoutException("Query process did not respond after " + str(timeout) + " seconds")
 
 
-def query_builder(table_name, datatypes_dataframe, rows):
+@retry(stop_max_attempt_number=6, retry_on_exception=lambda error: not isinstance(error, TimeoutException))
+def run_query(engine, sql, args, worker=None, instrumentation=None, timeout=QUERY_TIMEOUT):
     """
-    Builds and returns a dictionary to be used with the str.format function.
+    Using the retry decorator, will retry errors up to the specified number of attempts, but never a query that timed
+    out.  Executes the sql query with the execute_query function.
     """
-    oracle_numeric_datatypes = ['NUMBER', 'FLOAT', 'INTEGER']
-    hana_numeric_datatypes = ['TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'SMALLDECIMAL', 'DECIMAL', 'REAL', 'DOUBLE']
-    sqlserver_numeric_datatypes = ['tinyint', 'smallint', 'int', 'bigint', 'decimal', 'numeric', 'float']
-    numeric_datatypes = set(map(str.lower, (oracle_numeric_datatypes + hana_numeric_datatypes + sqlserver_numeric_datatypes)))
-    numeric_columns = datatypes_dataframe[datatypes_dataframe['data_type'].str.lower().isin(numeric_datatypes)]['column_name']
-    character_columns = datatypes_dataframe[~datatypes_dataframe['data_type'].str.lower().isin(numeric_datatypes)]['column_name']  # non-numeric columns
+    return execute_query(engine, sql, args, worker, instrumentation, timeout)
+
+
+def query_timeout(query_row, args):
+    """
+    Returns the timeout in seconds of a query:  its own 'timeout' in the queries file, otherwise the timeout of its
+    category from the '--category-timeout' arguments, otherwise the '--query-timeout' argument.
+    """
+    timeout = query_row.get('timeout')
+    if timeout is not None and timeout == timeout:  # not NaN
+        return float(timeout)
+    return float(args['category_timeouts'].get(str(query_row.get('category')), args['query_timeout']))
+
+
+def cancellation(attributes):
+    """
+    Returns the dictionary of the 'session_id_query' and 'cancel_query' of the database used to kill the session of a
+    worker whose query does not return after being cancelled.
+    """
+    return {'session_id_query': attributes.get('session_id_query'), 'cancel_query': attributes.get('cancel_query')}
+
+
+def cache_hooks(attributes):
+    """
+    Returns the dictionary of the cache flush hooks of the database:  the 'cache_flush_query' executed against the
+    database before every cold execution, formatted with the 'table_name', and the 'os_cache_drop_command' run on the
+    local machine, for a database reading its files through the page cache of this machine.
+    """
+    return {'cache_flush_query': attributes.get('cache_flush_query'),
+            'os_cache_drop_command': attributes.get('os_cache_drop_command')}
+
+
+def flush_cache(engine, attributes, table_name):
+    """
+    Flushes the caches of the database holding a table with its hooks, on a new connection so the connection of the
+    query keeps its session, then drops the local OS page cache.  Returns whether at least one hook is defined and
+    every hook succeeded, otherwise the next execution is not cold.
+    """
+    hooks = cache_hooks(attributes)
+    if not any(hooks.values()):
+        return False
+    try:
+        with Timer() as t:
+            if hooks['cache_flush_query']:
+                with engine.begin() as connection:
+                    fetch_statements(hooks['cache_flush_query'], connection, table_name=table_name)
+            if hooks['os_cache_drop_command']:
+                subprocess.run(hooks['os_cache_drop_command'], shell=True, check=True, timeout=OS_CACHE_DROP_TIMEOUT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as error:
+        logging.error("Unable to drop the OS page cache:  " + error.stderr.decode('utf-8', 'replace').strip())
+        return False
+    except Exception as error:
+        logging.error("Unable to flush the cache of table " + table_name + ":  " + str(error))
+        return False
+    logging.info("Flushed the cache of table " + table_name + str(': {:f} sec'.format(t.interval)))
+    return True
+
+
+class CircuitBreaker:
+    """
+    Skips the queries of a category on a table after 'threshold' consecutive timeouts of that category on that table,
+    so a pathological table does not stall every thread for the timeout of each of its heavy queries.  A breaker is
+    shared by the threads benchmarking a database and lasts for every iteration.  A 'threshold' of 0 never skips.
+    """
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.timeouts = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(query_row):
+        return str(query_row['table_name']), str(query_row.get('category'))
+
+    def open(self, query_row):
+        with self.lock:
+            return bool(self.threshold) and self.timeouts.get(self.key(query_row), 0) >= self.threshold
+
+    def record(self, query_row):
+        with self.lock:
+            key = self.key(query_row)
+            if query_row['status'] == 'timeout':
+                self.timeouts[key] = self.timeouts.get(key, 0) + 1
+                if self.timeouts[key] == self.threshold:
+                    logging.warning("Circuit breaker open after " + str(self.threshold) + " timeouts:  skipping the " +
+                                    key[1] + " queries on table " + key[0])
+            elif query_row['status'] == 'ok':
+                self.timeouts[key] = 0
+
+
+def query_builder(table_name, datatypes_dataframe, rows, rng=random):
+    """
+    Builds and returns a dictionary to be used with the str.format function.  The columns and the number of rows are
+    chosen with the 'rng' parameter, a seeded random.Random when compiling a workload.
+    """
+    numeric = datatypes_dataframe['data_type'].str.lower().isin(NUMERIC_DATATYPES)
+    numeric_columns = list(datatypes_dataframe[numeric]['column_name'].astype(str))
+    character_columns = list(datatypes_dataframe[~numeric]['column_name'].astype(str))  # non-numeric columns
     query_builder_dict = {}
-    query_builder_dict['columns'] = '"' + '", "'.join(map(str, list(character_columns.sample(n=randint(1, character_columns.size))))) + '"'
+    query_builder_dict['columns'] = '"' + '", "'.join(rng.sample(character_columns, rng.randint(1, len(character_columns)))) + '"'
     query_builder_dict['table'] = '"' + table_name + '"'
-    query_builder_dict['column_1'] = '"' + character_columns.sample().to_string(header=False, index=False) + '"'
-    query_builder_dict['column_2'] = '"' + character_columns.sample().to_string(header=False, index=False) + '"'
-    query_builder_dict['row'] = str(randint(1, rows))
-    query_builder_dict['order_column'] = '"' + character_columns.sample().to_string(header=False, index=False) + '"'
-    query_builder_dict['numeric_column'] = '"' + numeric_columns.sample().to_string(header=False, index=False) + '"'
-    query_builder_dict['column'] = '"' + character_columns.sample().to_string(header=False, index=False) + '"'
+    query_builder_dict['column_1'] = '"' + rng.choice(character_columns) + '"'
+    query_builder_dict['column_2'] = '"' + rng.choice(character_columns) + '"'
+    query_builder_dict['row'] = str(rng.randint(1, rows))
+    query_builder_dict['order_column'] = '"' + rng.choice(character_columns) + '"'
+    query_builder_dict['numeric_column'] = '"' + rng.choice(numeric_columns) + '"'
+    query_builder_dict['column'] = '"' + rng.choice(character_columns) + '"'
     return query_builder_dict
 
 
-def database(queries_dataframe, attributes, tables_dataframe, csv_filepath, args):
+def median_confidence_interval(times, z=CONFIDENCE_Z):
+    """
+    Returns the distribution-free confidence interval of the median of the execution times, the order statistics
+    whose ranks are 'z' standard deviations of the binomial distribution of the number of times below the median away
+    from the middle rank.  The ranks are counted from 1, so the lower rank is one more than its index and the upper rank
+    n + 1 minus it, such as the 5th and 16th of 20 times at 95% confidence.
+    """
+    times = sorted(times)
+    n = len(times)
+    low = max(int(math.floor(n / 2.0 - z * math.sqrt(n) / 2.0)) - 1, 0)
+    high = min(int(math.ceil(n / 2.0 + z * math.sqrt(n) / 2.0)), n - 1)
+    return times[low], times[high]
+
+
+def relative_width(times):
+    """
+    Returns the width of the confidence interval of the median relative to the median.
+    """
+    if len(times) < 2:
+        return float('inf')
+    low, high = median_confidence_interval(times)
+    median = pandas.Series(times).median()
+    return (high - low) / median if median else float('inf')
+
+
+def outliers(times):
+    """
+    Returns a list of booleans flagging the execution times outside of the Tukey fences, 1.5 interquartile ranges
+    below the first quartile or above the third quartile.
     """
-    Benchmark the database based on the number of iterations specified in the arg['iterations'] parameter.  Execute
-    every query from the 'queries_dataframe' parameter against every table in the 'tables_dataframe' parameter.  Write
-    the execution time to the 'csv_filepath' parameter.
+    series = pandas.Series(times)
+    if len(series.index) < 4:
+        return [False] * len(series.index)
+    q1, q3 = series.quantile(0.25), series.quantile(0.75)
+    return list((series < q1 - 1.5 * (q3 - q1)) | (series > q3 + 1.5 * (q3 - q1)))
+
+
+def repeat(times, elapsed, repetitions, succeeded, args):
+    """
+    Returns whether to execute the query again.  Without the adaptive mode every query is executed once.  In the
+    adaptive mode a query is repeated until the relative width of the confidence interval of its median is at most
+    'target_ci', stopping after 'max_repetitions' executions, after 'time_budget' seconds or at the first error.
+    """
+    if not args['adaptive'] or not succeeded:
+        return False
+    if repetitions >= args['max_repetitions'] or elapsed >= args['time_budget']:
+        return False
+    return len(times) < args['min_repetitions'] or relative_width(times) > args['target_ci']
+
+
+def database(workload_dataframe, attributes, sink, args, histograms=None, breaker=None, checkpoint=None):
+    """
+    Benchmark the database by replaying every iteration of the 'workload_dataframe' parameter, a workload compiled by
+    workload.build holding the sql query to execute against each table.  Every query is first executed 'warm_up' times
+    without being recorded, then once or, in the adaptive mode, until its timings converge.  Put a record of every
+    execution on the 'sink' parameter, a results.ResultsSink, flagging the outliers among the repetitions of a query.
+    When a 'histograms' dictionary is given, the execution time of every successful query is also recorded into the
+    histogram of its key.  The 'breaker' parameter, a CircuitBreaker shared with the other threads, skips the queries
+    of the categories that keep timing out on a table.  The queries this thread already executed before a resumed run
+    was interrupted are skipped with the 'checkpoint' parameter, a checkpoint.Checkpoint.  In the cache state mode,
+    every query is first executed once right after the caches are flushed with the hooks of the database, recorded
+    with the 'cold' cache state but not into the histograms, and its other executions with the 'warm' cache state.
     """
     engine = create_engine(attributes['connection_string'])
-    for i in range(args['iterations']):
-        logging.info("============  Iteration " + str(i+1) + " ============")
-        benchmark_dataframe = pandas.DataFrame()
-        for table_index, table_row in tables_dataframe.iterrows():
-            logging.info("Querying table: " + table_row['table_name'])
-            datatypes_query = attributes['datatypes_query'].format(table_name=table_row['table_name'])
-            datatypes_dataframe = pandas.read_sql(datatypes_query, engine)
-            datatypes_dataframe.columns = map(str.lower, datatypes_dataframe.columns)  # SQLAlchemy column case sensitivity is inconsistent between SQL dialects
-            for query_index, query_row in queries_dataframe.iterrows():
-                try:
-                    (query_row['query_executed'], query_row['rows'], query_row['time']) = build_query(
-                        engine, query_row['query_template'], table_row['table_name'], datatypes_dataframe, args['rows'])
-                    logging.info('Table: ' + table_row['table_name'] + " Query " + str(query_row['query_id']) + str(': {:f} sec'.format(query_row['time'])))
-                except TimeoutException as error:
-                    # TEST THIS SECTION
-                    print("Function took longer than %d seconds" % error.args[1])
-                    (query_row['query_executed'], query_row['rows'], query_row['time']) = ('Timeout!', 0, 600)
-                    logging.error("Timeout!  " + "Query " + str(query_row['query_id']) + str(':  {:f} sec'.format(query_row['time'])))
-                except Exception as error:
-                    logging.error(error)
-                    (query_row['query_executed'], query_row['rows'], query_row['time']) = ('Timeout!', 0, 600)
-                    logging.error("Timeout!  " + "Query " + str(query_row['query_id']) + str(':  {:f} sec'.format(query_row['time'])))
-                query_row['concurrency_factor'] = int(args['concurrent_users'])
-                query_row = pandas.concat([query_row, table_row])
-                benchmark_dataframe = benchmark_dataframe.append(query_row, ignore_index=True)
-        benchmark_dataframe.to_csv(csv_filepath, index=False, mode='a', header=not os.path.isfile(csv_filepath))
-        del benchmark_dataframe
\ No newline at end of file
+    breaker = breaker or CircuitBreaker(args['breaker_timeouts'])
+    worker = None
+    if args['connection_mode'] == 'warm':
+        worker = start_worker(attributes, args)
+    for iteration, iteration_dataframe in workload_dataframe.groupby('iteration', sort=True):
+        logging.info("============  Iteration " + str(iteration) + " ============")
+        for table_name, table_dataframe in iteration_dataframe.groupby('table_name', sort=True):
+            logging.info("Querying table: " + table_name)
+            for workload_index, workload_row in table_dataframe.iterrows():
+                if checkpoint and checkpoint.done(workload_row, current_thread().name):
+                    continue
+                cold_records = []
+                if args.get('cache_state') and not breaker.open(workload_row):
+                    flushed = flush_cache(engine, attributes, workload_row['table_name'])
+                    query_row, succeeded = execute_row(engine, workload_row, attributes, args, worker, None, breaker)
+                    if worker and not worker.is_alive():
+                        worker = start_worker(attributes, args)
+                    query_row['cache_state'] = 'cold' if flushed else 'unflushed'
+                    cold_records.append(query_row)
+                for warm_up in range(args['warm_up'] if not breaker.open(workload_row) else 0):
+                    try:
+                        run_query(engine, workload_row['query_executed'], args, worker,
+                                  timeout=query_timeout(workload_row, args))
+                    except Exception as error:
+                        logging.error("Warm-up failed:  " + str(error))
+                    if worker and not worker.is_alive():
+                        worker = start_worker(attributes, args)
+                records = []
+                succeeded_list = []
+                start = time.perf_counter()
+                while not records or repeat([query_row['time'] for query_row, succeeded in zip(records, succeeded_list)
+                                             if succeeded], time.perf_counter() - start, len(records),
+                                            succeeded_list[-1], args):
+                    query_row, succeeded = execute_row(engine, workload_row, attributes, args, worker, histograms, breaker)
+                    if worker and not worker.is_alive():  # the worker is terminated when a query times out
+                        worker = start_worker(attributes, args)
+                    query_row['repetition'] = len(records) + 1
+                    records.append(query_row)
+                    succeeded_list.append(succeeded)
+                if args['adaptive']:
+                    flag(records, succeeded_list, args)
+                if args.get('cache_state'):
+                    [query_row.update(cache_state='warm') for query_row in records]
+                [sink.put(query_row) for query_row in cold_records + records]
+    if worker:
+        worker.stop()
+
+
+def flag(records, succeeded_list, args):
+    """
+    Flags every record of the repetitions of a query with whether its timings converged and whether its execution
+    time is an outlier among the successful repetitions.
+    """
+    times = [query_row['time'] for query_row, succeeded in zip(records, succeeded_list) if succeeded]
+    width = relative_width(times)
+    flags = iter(outliers(times))
+    for query_row, succeeded in zip(records, succeeded_list):
+        query_row['converged'] = int(width <= args['target_ci'])
+        query_row['outlier'] = int(next(flags)) if succeeded else 0
+    logging.info('Table: ' + records[0]['table_name'] + " Query " + str(records[0]['query_id']) + ": " +
+                 str(len(records)) + " repetitions, median " + str('{:f} sec'.format(pandas.Series(times).median())) +
+                 ", CI width " + str('{:.1%}'.format(width)) + ", " + str(sum(query_row['outlier'] for query_row in records)) +
+                 " outliers")
+
+
+def execute_row(engine, workload_row, attributes, args, worker=None, histograms=None, breaker=None):
+    """
+    Executes the sql query of a workload row, returning the record of the execution and whether it succeeded.  The
+    'status' of the record is 'ok', 'error', 'timeout', or 'skipped' when the circuit 'breaker' is open, and the 'time'
+    of an error or a timeout is the real elapsed time.
+    """
+    query_row = workload_row.to_dict()
+    query_row.update({'status': 'ok', 'error': '', 'timeout': query_timeout(query_row, args)})
+    query_row['started_at'] = time.time()  # wall clock of the client resource profiler
+    if breaker and breaker.open(query_row):
+        query_row.update({'status': 'skipped', 'rows': float('nan'), 'time': float('nan')})
+        logging.warning("Skipped!  " + 'Table: ' + query_row['table_name'] + " Query " + str(query_row['query_id']))
+    else:
+        try:
+            query_row.update(run_query(engine, query_row['query_executed'], args, worker,
+                                       instruments(attributes, args), query_row['timeout']))
+            if histograms is not None:
+                histogram_key = histogram.key(query_row, query_row, args['concurrent_users'])
+                histograms.setdefault(histogram_key, histogram.Histogram()).record(query_row['time'])
+            logging.info('Table: ' + query_row['table_name'] + " Query " + str(query_row['query_id']) + str(': {:f} sec'.format(query_row['time'])))
+        except TimeoutException as error:
+            query_row.update({'status': 'timeout', 'error': str(error), 'rows': float('nan'),
+                              'time': time.time() - query_row['started_at']})
+            logging.error("Timeout!  " + 'Table: ' + query_row['table_name'] + " Query " + str(query_row['query_id']) +
+                          str(':  {:f} sec'.format(query_row['time'])))
+        except Exception as error:
+            query_row.update({'status': 'error', 'error': str(error), 'rows': float('nan'),
+                              'time': time.time() - query_row['started_at']})
+            logging.error("Error!  " + 'Table: ' + query_row['table_name'] + " Query " + str(query_row['query_id']) +
+                          ":  " + str(error))
+        if breaker:
+            breaker.record(query_row)
+    query_row['finished_at'] = time.time()
+    query_row['concurrency_factor'] = int(args['concurrent_users'])
+    query_row['connection_mode'] = args['connection_mode']
+    query_row['fetch_mode'] = args['fetch_mode']
+    query_row['thread'] = current_thread().name
+    trace(query_row)
+    return query_row, query_row['status'] == 'ok'
+
+
+def trace(query_row):
+    """
+    Records the spans of an execution on the track of the current thread:  the whole 'query' from the thread, and the
+    'connect' of a new connection, the 'execute' until the first row and the 'fetch' of the other rows measured by the
+    process that executed it.  The dataframe fetch mode does not time the first row, so its 'execute' span includes
+    the fetch.
+    """
+    if not tracing.enabled:
+        return
+    tracing.complete('query', query_row['started_at'], query_row['finished_at'] - query_row['started_at'],
+                     table_name=query_row['table_name'], query_id=query_row['query_id'], status=query_row['status'],
+                     rows=query_row.get('rows'))
+    executed_at = query_row.get('executed_at')
+    if query_row['status'] != 'ok' or executed_at is None:
+        return
+    if query_row['connection_mode'] == 'cold':
+        tracing.complete('connect', executed_at - query_row['connect_time'], query_row['connect_time'],
+                         connection_mode='cold')
+    first_row_time = query_row['first_row_time']
+    if first_row_time == first_row_time:  # not NaN
+        tracing.complete('execute', executed_at, first_row_time)
+        tracing.complete('fetch', executed_at + first_row_time, query_row['fetch_time'])
+    else:
+        tracing.complete('execute', executed_at, query_row['time'])
+
+
+def start_worker(attributes, args):
+    """
+    Starts a warm worker process for the current thread and logs the time it took to connect to the database.
+    """
+    worker = Worker(attributes['connection_string'], args['fetch_mode'], args['batch_size'],
+                    name=current_thread().name + ' worker', instrumentation=instruments(attributes, args),
+                    cancellation=cancellation(attributes))
+    with tracing.span('connect', connection_mode='warm'):
+        connect_time = worker.connect()
+    logging.info("Worker connect time: " + str('{:f} sec'.format(connect_time)))
+    return worker
\ No newline at end of file
@@ -12,23 +12,39 @@ import sys
 import argparse
 import json
 import logging
+import multiprocessing
 import pandas
 from datetime import datetime, timezone
-from threading import Thread
+from threading import Thread, current_thread
 from sqlalchemy import create_engine
 import drop_tables
 import create_tables
 import benchmark
+import load_generator
+import histogram
+import results
+import metadata
+import workload
+import distributed
+import profiler
+import synthetic
+import saturation
+import scaling
+import mixed
+import checkpoint
+import manifest
+import tracing
 
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 script_name = os.path.splitext(os.path.basename(__file__))[0]
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(module)s %(threadName)s (%(thread)d) %(message)s'
 
 
 def initialize_logging(logging_dir):
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(module)s %(threadName)s (%(thread)d) %(message)s')
+    formatter = logging.Formatter(LOG_FORMAT)
 
     handler = logging.StreamHandler()
     handler.setLevel(logging.INFO)
@@ -41,19 +57,339 @@ def initialize_logging(logging_dir):
     logger.addHandler(handler)
 
 
+def benchmark_users(database, workload_dataframe, attributes, sink, args, controller=None, run_checkpoint=None):
+    """
+    Benchmarks the database with 'concurrent_users' users, each executing every query of the workload in its own thread,
+    or split between the agents of a 'controller'.  Each thread skips the queries it executed before an interrupted run
+    of the 'run_checkpoint' parameter.  Returns the merged histograms and the benchmark time in seconds.
+    """
+    if controller:
+        return controller.run(workload_dataframe, attributes, sink, args)
+    thread_histograms = [{} for thread_number in range(args['concurrent_users'])]
+    breaker = benchmark.CircuitBreaker(args['breaker_timeouts'])  # shared by the users
+    with benchmark.Timer() as t:
+        thread_list = [Thread(name=database + ' thread #' + str(thread_number+1), target=benchmark.database,
+                              args=(workload_dataframe, attributes, sink, args, thread_histograms[thread_number],
+                                    breaker, run_checkpoint))
+                       for thread_number in range(args['concurrent_users'])]
+        [thread.start() for thread in thread_list]
+        [thread.join() for thread in thread_list]
+    return histogram.merge_all(thread_histograms), t.interval
+
+
+def benchmark_database(database, attributes, sink, args, run_id, histograms_filepath, catalog_filepath,
+                       controller=None, saturation_filepath=None, mixed_filepath=None, run_checkpoint=None,
+                       manifest_filepath=None, trace_filepath=None, load_filepath=None):
+    """
+    Runs the whole pipeline of a database:  find or create and load the tables, query their metadata, benchmark the
+    database with concurrent connections and drop the tables.  Puts a record of every execution on the 'sink'
+    parameter.  When a 'controller' is given, the concurrent connections are run by its agents.  In the search mode,
+    the concurrency levels are appended to the 'saturation_filepath' CSV file, in the mixed mode the read latency and
+    write throughput report to the 'mixed_filepath' CSV file, and with the load generator the summary of its phases to
+    the 'load_filepath' CSV file.  The progress is saved to the 'run_checkpoint'
+    parameter, so a resumed run skips a database already benchmarked, reuses the tables already loaded and only
+    executes the missing queries.  In the keep loaded mode, the tables are recorded in the load manifest of the
+    'manifest_filepath' JSON file and only the data files changed since their last load are loaded again.  When
+    tracing, the spans of the database are appended to the 'trace_filepath' JSON lines file once it is benchmarked.
+    """
+    if run_checkpoint and run_checkpoint.finished(database):
+        logging.info(database + " was already benchmarked by run " + run_checkpoint.run_id + ", skipping")
+        return
+    loaded_tables = run_checkpoint.loaded(database) if run_checkpoint and args['create_tables'] else None
+    data_path = args['data_path']
+    engine = create_engine(attributes['connection_string'])
+    catalog = metadata.Catalog(database, attributes, catalog_filepath, args['catalog_ttl'])
+    if args['refresh_catalog']:
+        catalog.invalidate()
+    if not args['create_tables']:  # Use existing tables in database
+        logging.info('############  Querying ' + database + ' for all table names  ############')
+        sql = attributes['table_name_query'].format(table_like=args['table_like'])
+        logging.info(sql)
+        tables_dataframe = pandas.read_sql(sql, engine)
+        tables_dataframe.columns = tables_dataframe.columns.str.lower()  # SQLAlchemy column case sensitivity is inconsistent between SQL dialects
+        tables_dataframe.sort_values('table_name', inplace=True)
+        logging.info('Found the following table names:')
+        [logging.info(table_name) for table_name in tables_dataframe['table_name']]
+    elif loaded_tables is not None:  # Reuse the tables loaded before the run was interrupted
+        logging.info('############  Reusing the tables loaded into ' + database + ' by run ' + run_checkpoint.run_id +
+                     '  ############')
+        tables_dataframe = pandas.DataFrame({'table_name': sorted(loaded_tables)})
+        [logging.info(table_name) for table_name in tables_dataframe['table_name']]
+    elif args['generate'] and args['generate_target'] == 'database':  # Generate synthetic tables into database
+        logging.info('############  Generate synthetic tables into ' + database + '  ############')
+        spec = synthetic.load_spec(args['generate'])
+        load_manifest = manifest.LoadManifest(database, manifest_filepath) if args.get('keep_loaded') else None
+        load_dataframe = pandas.concat([synthetic.load(engine, spec, scale_factor, args['seed'], args['load_processes'],
+                                                       load_manifest)
+                                        for scale_factor in args['scale_factor']], ignore_index=True)
+        logging.info(load_dataframe[['table_name', 'rows', 'megabytes', 'seconds', 'rows_per_sec', 'mb_per_sec',
+                                     'cached']])
+        tables_dataframe = load_dataframe[['table_name']].sort_values('table_name')
+        catalog.invalidate(list(load_dataframe.loc[~load_dataframe['cached'].astype(bool), 'table_name']))
+        if load_manifest is not None:
+            load_manifest.save()
+        if run_checkpoint:
+            run_checkpoint.load(database, tables_dataframe['table_name'])
+    else:  # Use data files on local file system to create tables and insert into database
+        logging.info('############  Searching for data files on local file system  ############')
+        data_filepath_list = [os.path.join(data_path, filename) for filename in os.listdir(data_path) if
+                              filename.endswith(".csv")]
+        if not data_filepath_list:
+            logging.error("No data files found in path:  " + str(data_path))
+            sys.exit(1)
+        tables_dataframe = pandas.DataFrame({'table_name': [(os.path.splitext(os.path.basename(filename))[0])
+                                                            for filename in data_filepath_list]})
+        tables_dataframe.sort_values('table_name', inplace=True)
+        logging.info('Found the following files in path:  ' + str(data_path))
+        [logging.info(filename) for filename in data_filepath_list]
+
+        logging.info('############  Create tables and load data into ' + database + '  ############')
+        load_manifest = manifest.LoadManifest(database, manifest_filepath) if args.get('keep_loaded') else None
+        load_dataframe = create_tables.individual(engine, data_filepath_list, args['load_processes'],
+                                                  args['infer_rows'], load_manifest)
+        logging.info(load_dataframe[['table_name', 'rows', 'megabytes', 'seconds', 'rows_per_sec', 'mb_per_sec',
+                                     'cached']])
+        reloaded_tables = list(load_dataframe.loc[~load_dataframe['cached'].astype(bool), 'table_name'])
+        catalog.invalidate(reloaded_tables)
+
+        # Alter table
+        alter_table_query = attributes.get('alter_table_query', None)
+        if alter_table_query:
+            for table_name in reloaded_tables:
+                logging.info(alter_table_query.format(table_name=table_name))
+                engine.connect().execute(alter_table_query.format(table_name=table_name))
+        if load_manifest is not None:
+            load_manifest.save()
+        if run_checkpoint:
+            run_checkpoint.load(database, tables_dataframe['table_name'])
+
+    # Query the catalog for the number of records and the data types of each table and categorize
+    logging.info('############  Querying for the number of records in each table  ############')
+    catalog.seconds = 0.0
+    tables_dataframe['table_row_count'] = tables_dataframe['table_name'].apply(
+        lambda table_name: catalog.row_count(engine, table_name, args['statistics_row_counts']))
+    [catalog.datatypes(engine, table_name) for table_name in tables_dataframe['table_name']]
+    catalog.save()
+    logging.info(database + ' metadata time: %.07f sec' % catalog.seconds)
+    bins = [0, 100000, 1000000, 10000000, 1000000000]
+    label_names = ['Small', 'Medium', 'Large', 'X-Large']
+    tables_dataframe['table_size_category'] = pandas.cut(tables_dataframe['table_row_count'], bins,
+                                                         labels=label_names)
+    logging.info(tables_dataframe[['table_name', 'table_row_count', 'table_size_category']])
+    if args['sweep']:  # every size of a table family is queried with the same workload
+        tables_dataframe['table_family'] = tables_dataframe['table_name'].apply(scaling.family)
+
+    # Benchmark database with concurrent connections
+    logging.info('############  Benchmarking ' + database + '  ############')
+    if args.get('cache_state') and not any(benchmark.cache_hooks(attributes).values()):
+        logging.warning("No 'cache_flush_query' or 'os_cache_drop_command' defined for " + database + ", the first "
+                        "execution of every query will be recorded with the 'unflushed' cache state")
+    queries_filepath = 'queries/queries.csv'
+    queries_dataframe = pandas.read_csv(queries_filepath)  # load queries from CSV file
+    queries_dataframe = queries_dataframe[
+        queries_dataframe['database'] == database]  # filter queries on database name
+    if not queries_dataframe.empty:
+        if args['workload']:
+            logging.info("Replaying workload:  " + args['workload'])
+            workload_dataframe = workload.load(args['workload'], tables_dataframe)
+        else:
+            workload_dataframe = workload.build(queries_dataframe, tables_dataframe, catalog, engine, database, args)
+    write_dataframe = pandas.DataFrame()
+    if not queries_dataframe.empty and args['mixed']:
+        writes_dataframe = pandas.read_csv(mixed.WRITES_FILEPATH)  # load write templates from CSV file
+        writes_dataframe = writes_dataframe[writes_dataframe['database'] == database]
+        reused = sorted(set(writes_dataframe['query_id']) & set(queries_dataframe['query_id']))
+        if reused:
+            logging.error("Write templates of " + database + " from " + mixed.WRITES_FILEPATH + " reuse the query ids " +
+                          ', '.join(map(str, reused)) + " of the read queries, benchmarking the read workload only")
+        elif writes_dataframe.empty:
+            logging.warning("Missing " + database + " write templates from " + mixed.WRITES_FILEPATH +
+                            ", benchmarking the read workload only")
+        else:
+            write_dataframe = mixed.build(writes_dataframe, tables_dataframe, catalog, engine, args)
+    if not queries_dataframe.empty and args['search']:
+        with benchmark.Timer() as t:
+            saturation.search(database, lambda level_sink, level_args: benchmark_users(
+                database, workload_dataframe, attributes, level_sink, level_args, controller),
+                              sink, args, run_id, histograms_filepath, saturation_filepath)
+        logging.info(database + ' search time: %.07f sec' % t.interval)
+    elif not write_dataframe.empty:
+        with benchmark.Timer() as t:
+            mixed.run(database, lambda phase_sink, phase_args: benchmark_users(
+                database, workload_dataframe, attributes, phase_sink, phase_args),
+                      write_dataframe, engine, attributes, sink, args, run_id, mixed_filepath)
+        logging.info(database + ' mixed benchmark time: %.07f sec' % t.interval)
+    elif not queries_dataframe.empty:
+        if args['qps']:
+            histograms, seconds = load_generator.run(workload_dataframe, attributes, sink, args, database, run_id,
+                                                     load_filepath)
+        else:
+            histograms, seconds = benchmark_users(database, workload_dataframe, attributes, sink, args, controller,
+                                                  run_checkpoint)
+        logging.info(database + ' benchmark time: %.07f sec' % seconds)
+
+        # Latency percentiles and throughput from the merged thread or agent histograms
+        histogram.save(histograms_filepath, histograms, seconds, run_id)
+        logging.info("Latency percentiles in seconds and throughput in queries/sec:")
+        logging.info(histogram.report(histograms, seconds).to_string(index=False))
+    else:
+        logging.warning("Missing " + database + " queries from " + queries_filepath)
+
+    # Drop tables
+    if args['drop_tables']:
+        logging.info('############  Dropping tables in ' + database + '  ############')
+        drop_tables.drop(engine, tables_dataframe)
+        catalog.invalidate(list(tables_dataframe['table_name']))
+        load_manifest = manifest.LoadManifest(database, manifest_filepath)
+        load_manifest.forget(list(tables_dataframe['table_name']))
+        load_manifest.save()
+        if run_checkpoint:
+            run_checkpoint.drop(database)
+    catalog.save()
+    tracing.save(trace_filepath, run_id)
+
+
+def cpu_shares(count, cpus_per_database=None):
+    """
+    Splits the CPUs available to this process into 'count' lists of 'cpus_per_database' CPUs, by default an equal
+    share each.  Lists wrap around the available CPUs when there are not enough of them.
+    """
+    available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    share = cpus_per_database or max(len(available) // count, 1)
+    return [[available[(number * share + cpu) % len(available)] for cpu in range(share)] for number in range(count)]
+
+
+def database_process(database, attributes, sink, args, run_id, histograms_filepath, catalog_filepath,
+                     saturation_filepath, mixed_filepath, run_checkpoint, manifest_filepath, trace_filepath,
+                     load_filepath, cpus):
+    """
+    Runs the pipeline of a database in its own process, pinned with the worker and loader processes it starts to the
+    'cpus' list so the client of one database never slows the others, and logging to its own log file.  Logging is
+    configured again when the process did not inherit the handlers of the parent, as with the spawn and forkserver
+    start methods.
+    """
+    current_thread().name = database
+    if args.get('trace'):
+        tracing.start()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    logger = logging.getLogger()
+    if not logger.handlers:
+        initialize_logging(os.path.join(script_dir, 'log/'))
+    handler = logging.FileHandler(os.path.join(script_dir, 'log/' + script_name + '_' + database.replace(' ', '_') + '.log'),
+                                  'a', encoding='utf-8')
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.addHandler(handler)
+    try:
+        with benchmark.Timer() as t:
+            benchmark_database(database, attributes, sink, args, run_id, histograms_filepath, catalog_filepath,
+                               saturation_filepath=saturation_filepath, mixed_filepath=mixed_filepath,
+                               run_checkpoint=run_checkpoint, manifest_filepath=manifest_filepath,
+                               trace_filepath=trace_filepath, load_filepath=load_filepath)
+        logging.info(database + ' pipeline time: %.07f sec' % t.interval)
+    except Exception:
+        logging.exception("Unable to benchmark " + database)
+        sys.exit(1)
+
+
+def benchmark_parallel(database_list, sink, args, run_id, histograms_filepath, catalog_filepath,
+                       saturation_filepath=None, mixed_filepath=None, run_checkpoint=None, manifest_filepath=None,
+                       trace_filepath=None, load_filepath=None):
+    """
+    Runs the pipeline of every database of the 'database_list' parameter, a list of (database, attributes) tuples, at
+    the same time in its own process.  The records of every process are forwarded through a queue to the single
+    writer of the 'sink' parameter, so every database is merged into the same run.  A database is only marked as
+    finished in the 'run_checkpoint' parameter once all its results are written and its process succeeded.
+    """
+    record_queue = multiprocessing.Queue()
+    forwarder = Thread(name='results forwarder', target=results.forward, args=(record_queue, sink), daemon=True)
+    forwarder.start()
+    process_list = []
+    for (database, attributes), cpus in zip(database_list, cpu_shares(len(database_list), args['cpus_per_database'])):
+        process = multiprocessing.Process(name=database, target=database_process,
+                                          args=(database, attributes, results.QueueSink(record_queue), args, run_id,
+                                                histograms_filepath, catalog_filepath, saturation_filepath,
+                                                mixed_filepath, run_checkpoint, manifest_filepath, trace_filepath,
+                                                load_filepath, cpus))
+        process.start()
+        logging.info("Started " + database + " process " + str(process.pid) + " on CPUs " + str(cpus))
+        process_list.append(process)
+    for process in process_list:
+        process.join()
+        logging.info("Finished " + process.name + " process with exit code " + str(process.exitcode))
+    record_queue.put(None)
+    forwarder.join()
+    if run_checkpoint:
+        sink.sync()
+        [run_checkpoint.finish(process.name) for process in process_list if process.exitcode == 0]
+
+
+def resumable(args):
+    """
+    Returns whether a run can be resumed.  Only the users benchmarking every query once per iteration record which
+    queries were executed, the load generator, search, mixed and controller modes would run their phases again.
+    """
+    return not (args.get('qps') or args.get('search') or args.get('mixed') or args.get('controller'))
+
+
 def main(args):
 
-    # Validate data path
+    # Run as a load generation agent of a controller
     start_timestamp = datetime.now(timezone.utc)
     logging.info("Started " + script_name + " script")
-    data_path = args['data_path']
-    if not os.path.isdir(data_path):
-        logging.error("No such directory:  " + data_path)
-        sys.exit(1)
+    if args['agent']:
+        distributed.agent(distributed.address(args['agent']), args['agent_name'])
+        return
 
     # Define the Big Data Benchmarking CSV file
     csv_name = script_name + '.csv'
     csv_filepath = os.path.join(script_dir, 'csv/' + csv_name)
+    histograms_filepath = os.path.join(script_dir, 'csv/' + script_name + '_histograms.jsonl')
+    results_path = os.path.join(script_dir, 'csv/' + script_name + '_results')
+    live_filepath = os.path.join(script_dir, 'csv/' + script_name + '_live.jsonl')
+    catalog_filepath = os.path.join(script_dir, 'csv/' + script_name + '_catalog.json')
+    profile_filepath = os.path.join(script_dir, 'csv/' + script_name + '_profile.jsonl')
+    saturation_filepath = os.path.join(script_dir, 'csv/' + script_name + '_saturation.csv')
+    load_filepath = os.path.join(script_dir, 'csv/' + script_name + '_load.csv')
+    scaling_filepath = os.path.join(script_dir, 'csv/' + script_name + '_scaling.csv')
+    mixed_filepath = os.path.join(script_dir, 'csv/' + script_name + '_mixed.csv')
+    checkpoint_filepath = os.path.join(script_dir, 'csv/' + script_name + '_checkpoint.jsonl')
+    manifest_filepath = os.path.join(script_dir, 'csv/' + script_name + '_loads.json')
+    trace_filepath = os.path.join(script_dir, 'csv/' + script_name + '_trace.jsonl')
+    run_id = args['resume'] or start_timestamp.strftime('%Y%m%dT%H%M%SZ')
+
+    # Resume an interrupted run with the arguments it was started with
+    run_checkpoint = None
+    if args['resume']:
+        try:
+            run_checkpoint = checkpoint.resume(checkpoint_filepath, run_id, results_path)
+        except ValueError as error:
+            logging.error(str(error) + ".  Use [-h] for more help.")
+            sys.exit(2)
+        if run_checkpoint.is_completed:
+            logging.warning("Run " + run_id + " is already completed")
+            return
+        args = dict(run_checkpoint.args, resume=run_id)
+        if not resumable(args):
+            logging.error("Run " + run_id + " was started with [-q], [--qps], [--search], [--mixed] or [--controller], "
+                          "which cannot be resumed without executing its queries again.  Use [-h] for more help.")
+            sys.exit(2)
+    elif not resumable(args):
+        logging.warning("Run " + run_id + " cannot be resumed with [--resume] if it is interrupted")
+
+    # Validate data path
+    data_path = args['data_path']
+    if args['generate'] and args['generate_target'] == 'csv' and not (
+            run_checkpoint and run_checkpoint.all_loaded(args['database_list'])):
+        logging.info('############  Generating synthetic data files at scale factors ' +
+                     ', '.join(map(str, args['scale_factor'])) + '  ############')
+        spec = synthetic.load_spec(args['generate'])
+        for scale_factor in args['scale_factor']:
+            synthetic.generate(spec, scale_factor, args['seed'], data_path, args['load_processes'])
+    if not os.path.isdir(data_path) and not (args['generate'] and args['generate_target'] == 'database'):
+        logging.error("No such directory:  " + data_path)
+        sys.exit(1)
 
     if not args['database_list']:
         logging.warning('No databases specified.  Skipping benchmarking...')
@@ -62,79 +398,61 @@ def main(args):
         # Load configuration from JSON file
         with open('config.json', 'r') as config_file:
             database_config = json.load(config_file)
-        logging.info("Big Data Benchmarking CSV file to save results to:  " + csv_filepath)
+        run_checkpoint = run_checkpoint or checkpoint.start(checkpoint_filepath, run_id, args)
+        if args.get('trace'):
+            tracing.start()
+        client_profiler = profiler.start(profile_filepath, run_id, args)
+        sink = results.ResultsSink(results_path, run_id, args['results_format'],
+                                   live_filepath=live_filepath if args['live'] else None,
+                                   annotate=client_profiler.annotate if client_profiler else None)
+        logging.info("Big Data Benchmarking results store to save run " + run_id + " to:  " + sink.path)
+
+        controller = distributed.Controller(distributed.address(args['controller']), args['agents']) \
+            if args['controller'] else None
 
         # Iterate through the database list specified in the script arguments
+        database_list = []
         for database in args['database_list']:
             attributes = database_config.get(database, None)
             if not attributes:
                 logging.error("No configuration found for database:  " + database)
                 continue
-            engine = create_engine(attributes['connection_string'])
-            if not args['create_tables']:  # Use existing tables in database
-                logging.info('############  Querying ' + database + ' for all table names  ############')
-                sql = attributes['table_name_query'].format(table_like=args['table_like'])
-                logging.info(sql)
-                tables_dataframe = pandas.read_sql(sql, engine)
-                tables_dataframe.columns = tables_dataframe.columns.str.lower()  # SQLAlchemy column case sensitivity is inconsistent between SQL dialects
-                tables_dataframe.sort_values('table_name', inplace=True)
-                logging.info('Found the following table names:')
-                [logging.info(table_name) for table_name in tables_dataframe['table_name']]
-            else:  # Use data files on local file system to create tables and insert into database
-                logging.info('############  Searching for data files on local file system  ############')
-                data_filepath_list = [os.path.join(data_path, filename) for filename in os.listdir(data_path) if
-                                      filename.endswith(".csv")]
-                if not data_filepath_list:
-                    logging.error("No data files found in path:  " + str(data_path))
-                    sys.exit(1)
-                tables_dataframe = pandas.DataFrame({'table_name': [(os.path.splitext(os.path.basename(filename))[0])
-                                                                    for filename in data_filepath_list]})
-                tables_dataframe.sort_values('table_name', inplace=True)
-                logging.info('Found the following files in path:  ' + str(data_path))
-                [logging.info(filename) for filename in data_filepath_list]
-
-                logging.info('############  Create tables and load data into ' + database + '  ############')
-                create_tables.individual(engine, data_filepath_list)
-
-                # Alter table
-                alter_table_query = attributes.get('alter_table_query', None)
-                if alter_table_query:
-                    for table_name in tables_dataframe['table_name']:
-                        logging.info(alter_table_query.format(table_name=table_name))
-                        engine.connect().execute(alter_table_query.format(table_name=table_name))
-
-            # Query for the number of records in each table and categorize
-            logging.info('############  Querying for the number of records in each table  ############')
-            tables_dataframe['table_row_count'] = tables_dataframe['table_name'].apply(
-                lambda table_name: pandas.read_sql('SELECT COUNT(*) FROM "{table_name}"'.format(table_name=table_name),
-                                                   engine).ix[:, 0])
-            bins = [0, 100000, 1000000, 10000000, 1000000000]
-            label_names = ['Small', 'Medium', 'Large', 'X-Large']
-            tables_dataframe['table_size_category'] = pandas.cut(tables_dataframe['table_row_count'], bins,
-                                                                 labels=label_names)
-            logging.info(tables_dataframe[['table_name', 'table_row_count', 'table_size_category']])
-
-            # Benchmark database with concurrent connections
-            logging.info('############  Benchmarking ' + database + '  ############')
-            queries_filepath = 'queries/queries.csv'
-            queries_dataframe = pandas.read_csv(queries_filepath)  # load queries from CSV file
-            queries_dataframe = queries_dataframe[
-                queries_dataframe['database'] == database]  # filter queries on database name
-            if not queries_dataframe.empty:
-                with benchmark.Timer() as t:
-                    thread_list = [Thread(name=database + ' thread #' + str(thread_number+1), target=benchmark.database,
-                                          args=(queries_dataframe, attributes, tables_dataframe, csv_filepath, args))
-                                   for thread_number in range(args['concurrent_users'])]
-                    [thread.start() for thread in thread_list]
-                    [thread.join() for thread in thread_list]
-                logging.info(database + ' benchmark time: %.07f sec' % t.interval)
+            if args['parallel']:
+                database_list.append((database, attributes))
             else:
-                logging.warning("Missing " + database + " queries from " + queries_filepath)
+                try:
+                    benchmark_database(database, attributes, sink, args, run_id, histograms_filepath, catalog_filepath,
+                                       controller, saturation_filepath, mixed_filepath, run_checkpoint,
+                                       manifest_filepath, trace_filepath, load_filepath)
+                except distributed.AgentError as error:  # the run is missing the executions of the failed agents
+                    logging.error("Run " + run_id + " of " + database + " is incomplete.  " + str(error))
+                    sink.close()
+                    controller.close()
+                    sys.exit(1)
+                sink.sync()  # the database is only finished once its results are written
+                run_checkpoint.finish(database)
+        if controller:
+            controller.close()
+        if database_list:
+            benchmark_parallel(database_list, sink, args, run_id, histograms_filepath, catalog_filepath,
+                               saturation_filepath, mixed_filepath, run_checkpoint, manifest_filepath, trace_filepath,
+                               load_filepath)
 
-            # Drop tables
-            if args['drop_tables']:
-                logging.info('############  Dropping tables in ' + database + '  ############')
-                drop_tables.drop(engine, tables_dataframe)
+        # Write the remaining results and export the run to CSV
+        sink.close()
+        if args.get('trace'):
+            tracing.save(trace_filepath, run_id)
+            trace_json_filepath = os.path.join(script_dir, 'csv/' + script_name + '_' + run_id + '.trace.json')
+            tracing.export(trace_filepath, trace_json_filepath, run_id)
+        if client_profiler:
+            client_profiler.stop()
+        if args['sweep']:
+            scaling.report(results.read(results_path, run_ids=[run_id], results_format=sink.results_format),
+                           args['target_rows'], scaling_filepath, run_id)
+        if args['csv_export']:
+            logging.info("Exporting run " + run_id + " to Big Data Benchmarking CSV file:  " + csv_filepath)
+            results.export_csv(results_path, csv_filepath, [run_id], sink.results_format)
+        run_checkpoint.complete()
 
     # Finish
     logging.info(script_name + " script duration:  " + str(datetime.now(timezone.utc) - start_timestamp))
@@ -153,6 +471,23 @@ if __name__ == '__main__':
     parser.add_argument('database_list', nargs='*', default=[],
                         help="Specify the list of Databases to benchmark.  These names must match the names "
                              "pre-configured in the 'config.json' file.")
+    parser.add_argument('--parallel', dest='parallel', action='store_true',
+                        help="Run the whole pipeline of every database at the same time, each in its own process with "
+                             "its own log file, merging the results into the same run")
+    parser.add_argument('--cpus-per-database', dest='cpus_per_database', default=None, type=int,
+                        help="The number of CPUs each database process and its workers are pinned to when using "
+                             "'--parallel'.  Default is an equal share of the CPUs")
+    parser.add_argument('--controller', dest='controller', default=None, type=str,
+                        help="Listen on this 'host:port' address for load generation agents and split the concurrent "
+                             "users between them, merging their results into the same run.  The run exits with an error "
+                             "when an agent disconnects before finishing, as its remaining executions are missing")
+    parser.add_argument('--agents', dest='agents', default=1, type=int,
+                        help="The number of agents the controller waits for before benchmarking.  Default is 1")
+    parser.add_argument('--agent', dest='agent', default=None, type=str,
+                        help="Run as a load generation agent of the controller listening on this 'host:port' address")
+    parser.add_argument('--agent-name', dest='agent_name', default=None, type=str,
+                        help="The name of the agent in the results, unique among the agents of the controller.  Default "
+                             "is the host name and the process id")
     parser.add_argument('-t', '--table-like', dest='table_like', default='%',
                         type=str, help="Specify the name of the tables to benchmark.  This uses the SQL 'LIKE' operator"
                                        " to search a specified pattern so use the '%%' sign to define wildcards.  "
@@ -163,6 +498,151 @@ if __name__ == '__main__':
                         help="The number of benchmark iterations to perform on the database.  Default is 1")
     parser.add_argument('-u', '--users', dest='concurrent_users', default=1, type=int,
                         help="The number of concurrent users to connect to the database.  Default is 1")
+    parser.add_argument('--search', dest='search', action='store_true',
+                        help="Search the knee of the concurrency curve of every database instead of benchmarking "
+                             "'--users' users:  the number of users is raised by '--search-factor' until the throughput "
+                             "plateaus, the p99 rises sharply or the error rate exceeds '--max-error-rate', then "
+                             "bisected.  The levels are saved to 'csv/" + script_name + "_saturation.csv'")
+    parser.add_argument('--search-factor', dest='search_factor', default=2.0, type=float,
+                        help="The factor multiplying the number of users at every step of the search.  Default is 2")
+    parser.add_argument('--search-max-users', dest='search_max_users', default=256, type=int,
+                        help="The highest number of users of the search.  Default is 256")
+    parser.add_argument('--knee-gain', dest='knee_gain', default=0.1, type=float,
+                        help="The fraction of throughput a step of the search must gain to keep scaling, and the "
+                             "fraction of the highest throughput within which the knee is reached.  Default is 0.1")
+    parser.add_argument('--knee-latency', dest='knee_latency', default=2.0, type=float,
+                        help="The factor by which the p99 execution time rising in a step of the search stops the "
+                             "search.  Default is 2")
+    parser.add_argument('--max-error-rate', dest='max_error_rate', default=0.05, type=float,
+                        help="The fraction of failed or timed out queries stopping the search.  Default is 0.05")
+    parser.add_argument('--bisect-steps', dest='bisect_steps', default=3, type=int,
+                        help="The number of bisections of the interval below the knee found by the search.  Default is 3")
+    parser.add_argument('--mixed', dest='mixed', action='store_true',
+                        help="Benchmark every database under concurrent writes:  the read workload runs first alone, "
+                             "then again while '--write-ratio' of the users execute the INSERT, UPDATE and DELETE "
+                             "templates of '" + mixed.WRITES_FILEPATH + "'.  The tables are restored afterwards "
+                             "and the read latency degradation and write throughput saved to 'csv/" + script_name +
+                             "_mixed.csv'")
+    parser.add_argument('--write-ratio', dest='write_ratio', default=mixed.WRITE_RATIO, type=float,
+                        help="The fraction of the '--users' users executing the write templates in the mixed mode, "
+                             "with at least one reader and one writer.  Default is " + str(mixed.WRITE_RATIO))
+    parser.add_argument('--write-batch-size', dest='write_batch_size', default=mixed.WRITE_BATCH_SIZE, type=int,
+                        help="The number of rows of every batch append, update and delete of the mixed mode.  "
+                             "Default is " + str(mixed.WRITE_BATCH_SIZE))
+    parser.add_argument('--warm-up', dest='warm_up', default=0, type=int,
+                        help="The number of times every query is executed before it is measured, without recording "
+                             "the results.  Default is 0")
+    parser.add_argument('--cache-state', dest='cache_state', action='store_true',
+                        help="Measure every query both cold and warm:  once right after flushing the caches with the "
+                             "'cache_flush_query' and 'os_cache_drop_command' hooks of the database in 'config.json', "
+                             "then after the '--warm-up' executions.  The results are tagged with their 'cache_state' "
+                             "and the cold executions are left out of the latency histograms.  Requires a single user")
+    parser.add_argument('-a', '--adaptive', dest='adaptive', action='store_true',
+                        help="Repeat every query until the confidence interval of its median execution time is narrower "
+                             "than '--target-ci', flagging the outliers among the repetitions")
+    parser.add_argument('--target-ci', dest='target_ci', default=0.05, type=float,
+                        help="The width of the 95%% confidence interval of the median relative to the median at which "
+                             "the adaptive mode stops repeating a query.  Default is 0.05")
+    parser.add_argument('--min-repetitions', dest='min_repetitions', default=5, type=int,
+                        help="The minimum number of repetitions of every query in the adaptive mode.  Default is 5")
+    parser.add_argument('--max-repetitions', dest='max_repetitions', default=50, type=int,
+                        help="The maximum number of repetitions of every query in the adaptive mode.  Default is 50")
+    parser.add_argument('--time-budget', dest='time_budget', default=60.0, type=float,
+                        help="The number of seconds after which the adaptive mode stops repeating a query.  "
+                             "Default is 60")
+    parser.add_argument('-m', '--connection-mode', dest='connection_mode', default='warm', choices=['warm', 'cold'],
+                        help="'warm' runs every concurrent user in a long-lived worker process holding its own "
+                             "connection, so the connect cost is paid once and reported separately.  'cold' disposes "
+                             "of the connection pool and forks a new process for every query.  Default is 'warm'")
+    parser.add_argument('-f', '--fetch-mode', dest='fetch_mode', default='dataframe', choices=['dataframe', 'stream'],
+                        help="'dataframe' times building a full pandas DataFrame of the query results.  'stream' "
+                             "fetches the results through a raw DBAPI cursor in batches that are counted and discarded, "
+                             "recording the time to first row separately.  Default is 'dataframe'")
+    parser.add_argument('-b', '--batch-size', dest='batch_size', default=benchmark.FETCH_BATCH_SIZE, type=int,
+                        help="The number of rows to fetch at a time when using the 'stream' fetch mode.  "
+                             "Default is " + str(benchmark.FETCH_BATCH_SIZE))
+    parser.add_argument('-q', '--qps', dest='qps', default=None, type=float,
+                        help="Run an open-loop load generator issuing queries at this target rate in queries per "
+                             "second instead of having every concurrent user run all queries back to back.  "
+                             "'--users' is then the maximum number of queries executing at the same time")
+    parser.add_argument('--arrival', dest='arrival', default='poisson', choices=['constant', 'poisson', 'stepped'],
+                        help="The arrival process of the load generator.  'stepped' raises the rate in '--steps' equal "
+                             "steps during the steady-state phase.  Default is 'poisson'")
+    parser.add_argument('--steps', dest='steps', default=4, type=int,
+                        help="The number of steps of the 'stepped' arrival process.  Default is 4")
+    parser.add_argument('--ramp-up', dest='ramp_up', default=10.0, type=float,
+                        help="The number of seconds the load generator takes to ramp up to the target rate.  Default is 10")
+    parser.add_argument('--duration', dest='duration', default=60.0, type=float,
+                        help="The number of seconds of the steady-state phase of the load generator.  Default is 60")
+    parser.add_argument('--cool-down', dest='cool_down', default=10.0, type=float,
+                        help="The number of seconds the load generator takes to ramp down from the target rate.  "
+                             "Default is 10")
+    parser.add_argument('--think-time', dest='think_time', default=0.0, type=float,
+                        help="The mean number of seconds, exponentially distributed, each load generator user and "
+                             "each writer of the mixed mode waits after a query before executing the next one.  "
+                             "Default is 0")
+    parser.add_argument('-s', '--seed', dest='seed', default=0, type=int,
+                        help="The seed of the random choices of columns and rows when compiling the queries into a "
+                             "workload, so the same seed executes the same queries on every database.  Default is 0")
+    parser.add_argument('-w', '--workload', dest='workload', default=None, type=str,
+                        help="Replay a workload file previously compiled to 'queries/workloads/' instead of compiling "
+                             "the queries")
+    parser.add_argument('-e', '--explain', dest='explain', action='store_true',
+                        help="After every query, capture its execution plan with the 'explain_query' and its "
+                             "server-reported elapsed and CPU time of the database, the increase of the session times "
+                             "of its 'server_time_query' over the execution, outside of the timed execution.  The plan "
+                             "and a hash of its shape are saved with the results")
+    parser.add_argument('--results-format', dest='results_format', default=results.default_format(),
+                        choices=['parquet', 'sqlite'],
+                        help="The format of the results store.  'parquet' requires pyarrow.  Default is 'parquet' "
+                             "when pyarrow is installed, otherwise 'sqlite'")
+    parser.add_argument('--live', dest='live', action='store_true',
+                        help="Publish every batch of results to the live feed file tailed by the dashboard started "
+                             "with 'bokeh serve app --args --live'")
+    parser.add_argument('--profile-interval', dest='profile_interval', default=profiler.PROFILE_INTERVAL, type=float,
+                        help="The number of seconds between two samples of the CPU, memory, threads and connections of "
+                             "the client processes, saved to 'csv/" + script_name + "_profile.jsonl'.  Results measured "
+                             "while the client was saturated are marked as suspect.  Requires psutil, 0 disables it.  "
+                             "Default is " + str(profiler.PROFILE_INTERVAL))
+    parser.add_argument('--trace', dest='trace', action='store_true',
+                        help="Record a span of every metadata query, workload build, connection, execution, fetch and "
+                             "results write on the track of its thread, one per concurrent user, and export the run "
+                             "to 'csv/" + script_name + "_RUN_ID.trace.json' in the Chrome trace event format, to open "
+                             "in chrome://tracing or https://ui.perfetto.dev")
+    parser.add_argument('--cpu-threshold', dest='cpu_threshold', default=profiler.CPU_THRESHOLD, type=float,
+                        help="The CPU percent of the host, or of one CPU for a single client process, above which the "
+                             "client is saturated.  Default is " + str(profiler.CPU_THRESHOLD))
+    parser.add_argument('--memory-threshold', dest='memory_threshold', default=profiler.MEMORY_THRESHOLD, type=float,
+                        help="The memory percent of the host above which the client is saturated.  "
+                             "Default is " + str(profiler.MEMORY_THRESHOLD))
+    parser.add_argument('--query-timeout', dest='query_timeout', default=benchmark.QUERY_TIMEOUT, type=float,
+                        help="The number of seconds after which a query is cancelled on the server and recorded as a "
+                             "timeout.  A 'timeout' column of the queries CSV file overrides it per query.  "
+                             "Default is " + str(benchmark.QUERY_TIMEOUT))
+    parser.add_argument('--category-timeout', dest='category_timeout', default=[], action='append', type=str,
+                        metavar='CATEGORY=SECONDS',
+                        help="The timeout of the queries of a category, such as 'Join=60'.  Can be repeated")
+    parser.add_argument('--breaker-timeouts', dest='breaker_timeouts', default=benchmark.BREAKER_TIMEOUTS, type=int,
+                        help="The number of consecutive timeouts of a query category on a table after which its "
+                             "remaining executions are skipped, 0 never skips.  Default is " +
+                             str(benchmark.BREAKER_TIMEOUTS))
+    parser.add_argument('--resume', dest='resume', default=None, type=str, metavar='RUN_ID',
+                        help="Resume an interrupted run with the arguments it was started with, saved with its "
+                             "progress to 'csv/" + script_name + "_checkpoint.jsonl'.  Databases already benchmarked "
+                             "are skipped, the tables already loaded are reused and every user only executes the "
+                             "queries whose results are missing from the run, appending them to it.  The other "
+                             "arguments are ignored.  Runs started with '--qps', '--search', '--mixed' or "
+                             "'--controller' cannot be resumed")
+    parser.add_argument('--no-csv', dest='csv_export', action='store_false',
+                        help="Do not export the results of the run to the Big Data Benchmarking CSV file")
+    parser.add_argument('--catalog-ttl', dest='catalog_ttl', default=metadata.CATALOG_TTL, type=float,
+                        help="The number of seconds the data types and row counts of the tables are cached across runs "
+                             "before they are queried again.  Default is " + str(metadata.CATALOG_TTL))
+    parser.add_argument('--refresh-catalog', dest='refresh_catalog', action='store_true',
+                        help="Invalidate the cached data types and row counts of the tables before the run")
+    parser.add_argument('--statistics-row-counts', dest='statistics_row_counts', action='store_true',
+                        help="Read the number of rows of each table from the dictionary statistics with the "
+                             "'row_count_query' of the database instead of SELECT COUNT(*)")
     parser.add_argument('-p', '--path', dest='data_path', default=os.path.join(script_dir + os.path.sep + 'data'),
                         type=str, help="Full directory path to where the data files are stored.  These will be used to "
                                        "create the tables and insert into database.  Default path is:  /data")
@@ -170,11 +650,63 @@ if __name__ == '__main__':
                         help="Create tables and insert into database the data files that exist within in the folder "
                              "'--path' argument.  Not specifying this option will run benchmarks on all existing "
                              "tables in the database.")
+    parser.add_argument('-l', '--load-processes', dest='load_processes', default=os.cpu_count(), type=int,
+                        help="The number of processes parsing and inserting the data files in parallel when using "
+                             "'--create-tables'.  Default is the number of CPUs")
+    parser.add_argument('--infer-rows', dest='infer_rows', default=None, type=int,
+                        help="The number of rows of each data file sampled to infer the table schema when using "
+                             "'--create-tables'.  The schema is cached next to the data file.  Default is all rows")
+    parser.add_argument('-g', '--generate', dest='generate', default=None, type=str,
+                        help="Generate the synthetic tables described in this JSON file, see 'synthetic.json.example', "
+                             "from the '--seed' argument so the data is identical on every machine")
+    parser.add_argument('--scale-factor', dest='scale_factor', default=[1.0], type=float, nargs='+',
+                        help="The factors multiplying the number of rows of every synthetic table, which is generated "
+                             "once per factor and named with it such as 'Sales_SF100'.  Default is 1")
+    parser.add_argument('--sweep', dest='sweep', action='store_true',
+                        help="Query every size of a table family, the tables named with a '_SF' scale factor suffix, "
+                             "with the same workload, then fit how the execution time of every query scales with the "
+                             "number of rows.  The report is saved to 'csv/" + script_name + "_scaling.csv'")
+    parser.add_argument('--target-rows', dest='target_rows', default=scaling.TARGET_ROWS, type=int,
+                        help="The number of rows at which the sweep extrapolates the fitted execution times.  "
+                             "Default is " + str(scaling.TARGET_ROWS))
+    parser.add_argument('--generate-target', dest='generate_target', default='csv', choices=['csv', 'database'],
+                        help="'csv' writes the synthetic tables as CSV files to the '--path' directory before the run.  "
+                             "'database' generates and inserts them directly through the bulk insert path when using "
+                             "'--create-tables', without writing files.  Default is 'csv'")
     parser.add_argument('-d', '--drop-tables', dest='drop_tables', action='store_true',
                         help="The '--create-tables' argument must be specified.  Only those tables created will be dropped.")
+    parser.add_argument('-k', '--keep-loaded', dest='keep_loaded', action='store_true',
+                        help="Create the tables like '--create-tables' and keep them loaded after the run.  The "
+                             "size, modification time, sampled content hash and schema of every data file are recorded "
+                             "in 'csv/" + script_name + "_loads.json', so the next run skips the tables whose file is "
+                             "unchanged and whose row count verifies, and only drops and loads again the changed files.  "
+                             "Tables generated with '--generate-target database' are skipped when generated from the "
+                             "same spec and seed")
 
     args = vars(parser.parse_args())
+    if args['keep_loaded'] and args['drop_tables']:
+        parser.error("[-k], [--keep-loaded] cannot be combined with [-d], [--drop-tables].  Use [-h] for more help.")
+    args['create_tables'] = args['create_tables'] or args['keep_loaded']
     if args['drop_tables'] and not args['create_tables']:
         parser.error("[-d], [--drop-tables] requires [-c], [--create-tables].  Use [-h] for more help.")
+    if args['generate'] and args['generate_target'] == 'database' and not args['create_tables']:
+        parser.error("[--generate-target database] requires [-c], [--create-tables].  Use [-h] for more help.")
+    if args['mixed'] and (args['search'] or args['qps'] or args['controller']):
+        parser.error("[--mixed] cannot be combined with [--search], [-q], [--qps] or [--controller].  "
+                     "Use [-h] for more help.")
+    if args['cache_state'] and (args['concurrent_users'] != 1 or args['search'] or args['qps'] or args['mixed'] or
+                                args['controller']):
+        parser.error("[--cache-state] requires a single user, [-u 1], and cannot be combined with [--search], [-q], "
+                     "[--qps], [--mixed] or [--controller], since flushing the caches would evict the data of the other "
+                     "users.  Use [-h] for more help.")
+    if args['search'] and args['qps']:
+        parser.error("[--search] cannot be combined with [-q], [--qps].  Use [-h] for more help.")
+    if args['controller'] and (args['parallel'] or args['qps']):
+        parser.error("[--controller] cannot be combined with [--parallel] or [-q], [--qps].  Use [-h] for more help.")
+    try:
+        args['category_timeouts'] = {category: float(seconds) for category, seconds in
+                                     (timeout.split('=', 1) for timeout in args.pop('category_timeout'))}
+    except ValueError:
+        parser.error("[--category-timeout] must be CATEGORY=SECONDS.  Use [-h] for more help.")
     initialize_logging(os.path.join(script_dir, 'log/'))
     main(args)
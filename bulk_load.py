@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+
+import os
+import io
+import mmap
+import logging
+import multiprocessing
+import pandas
+from sqlalchemy import create_engine
+from benchmark import Timer
+
+
+MMAP_CHUNK_SIZE = 64 * 1024 * 1024  # number of bytes counted at a time when counting lines
+RANGE_SIZE = 32 * 1024 * 1024  # approximate number of bytes parsed by a process at a time
+INSERT_BATCH_SIZE = 10000  # number of rows sent to the database per executemany call
+PLACEHOLDERS = {'qmark': '?', 'format': '%s', 'pyformat': '%s', 'numeric': ':{index}', 'named': ':{index}'}
+
+loader_engine = None  # engine of the current loader process, created by the initialize function
+
+
+def count_lines(filepath):
+    """
+    Counts the number of lines in a file by memory mapping it and counting the newline bytes in fixed size chunks,
+    without decoding or splitting the lines in Python.  A last line without a trailing newline is counted as well.
+    """
+    if os.path.getsize(filepath) == 0:
+        return 0
+    with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        line_count = sum(m[offset:offset + MMAP_CHUNK_SIZE].count(b'\n') for offset in range(0, len(m), MMAP_CHUNK_SIZE))
+        if m[-1:] != b'\n':
+            line_count += 1
+    return line_count
+
+
+def record_end(m, start, offset):
+    """
+    Returns the offset following the first newline at or after 'offset' that ends a record of the memory mapped CSV
+    file, a newline preceded by an even number of quotes since the record boundary 'start', or the end of the file.  A
+    newline within a quoted value is preceded by an odd number of quotes, escaped quotes being doubled.
+    """
+    quotes = m[start:offset].count(b'"')
+    while True:
+        newline = m.find(b'\n', offset)
+        if newline < 0:
+            return len(m)
+        quotes += m[offset:newline + 1].count(b'"')
+        offset = newline + 1
+        if quotes % 2 == 0:
+            return offset
+
+
+def byte_ranges(filepath, range_size=RANGE_SIZE):
+    """
+    Splits a CSV file into a list of (start, end) byte offsets of roughly 'range_size' bytes, skipping the header line.
+    Every range ends on a newline outside of a quoted value, so it can be parsed on its own even when quoted values
+    contain newlines.
+    """
+    ranges = []
+    if os.path.getsize(filepath) == 0:
+        return ranges
+    with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        start = record_end(m, 0, 0)  # skip the header
+        while start < len(m):
+            end = record_end(m, start, min(start + range_size, len(m)))
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_range(filepath, start, end, names, usecols, dtype=None):
+    """
+    Parses the CSV rows between the 'start' and 'end' byte offsets into a DataFrame having the 'usecols' columns.  The
+    optional 'dtype' dictionary keeps string columns from being parsed as numbers in ranges containing only digits.
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return pandas.read_csv(io.BytesIO(data), header=None, names=names, usecols=usecols, dtype=dtype, low_memory=False)
+
+
+def records(dataframe):
+    """
+    Returns the rows of a DataFrame as a list of lists of Python objects, with NaN values replaced by None.
+    """
+    return dataframe.astype(object).where(pandas.notnull(dataframe), None).values.tolist()
+
+
+def insert_statement(table_name, columns, paramstyle, rows=1):
+    """
+    Builds an INSERT statement for the 'columns' of a table using the parameter style of the DBAPI driver.  When 'rows'
+    is greater than one a multi-row VALUES clause is built.
+    """
+    values = []
+    for row in range(rows):
+        placeholders = [PLACEHOLDERS[paramstyle].format(index=row * len(columns) + index + 1)
+                        for index in range(len(columns))]
+        values.append('(' + ', '.join(placeholders) + ')')
+    return 'INSERT INTO "' + table_name + '" ("' + '", "'.join(columns) + '") VALUES ' + ', '.join(values)
+
+
+def executemany(engine, cursor, table_name, dataframe):
+    """
+    Inserts the rows using executemany, which uses array binding on cx_Oracle, is rewritten into multi-row VALUES by
+    the MySQL drivers and uses 'fast_executemany' on pyodbc.
+    """
+    if engine.driver == 'pyodbc':
+        cursor.fast_executemany = True
+    sql = insert_statement(table_name, dataframe.columns, engine.dialect.paramstyle)
+    rows = records(dataframe)
+    for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+        cursor.executemany(sql, rows[offset:offset + INSERT_BATCH_SIZE])
+
+
+def values(engine, cursor, table_name, dataframe):
+    """
+    Inserts the rows using INSERT statements having a multi-row VALUES clause, keeping below 1000 rows and 2000
+    parameters per statement.
+    """
+    rows_per_statement = max(1, min(1000, 2000 // len(dataframe.columns)))
+    rows = records(dataframe)
+    for offset in range(0, len(rows), rows_per_statement):
+        batch = rows[offset:offset + rows_per_statement]
+        sql = insert_statement(table_name, dataframe.columns, engine.dialect.paramstyle, len(batch))
+        cursor.execute(sql, [value for row in batch for value in row])
+
+
+def copy(engine, cursor, table_name, dataframe):
+    """
+    Inserts the rows using the PostgreSQL COPY command, streaming the DataFrame as CSV.
+    """
+    buffer = io.StringIO()
+    dataframe.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cursor.copy_expert('COPY "' + table_name + '" ("' + '", "'.join(dataframe.columns) + '") FROM STDIN WITH CSV', buffer)
+
+
+# Fastest insert path for each SQLAlchemy dialect name
+FAST_PATHS = {'postgresql': copy, 'mssql': values, 'oracle': executemany, 'mysql': executemany,
+              'sqlite': executemany, 'hana': executemany}
+
+
+def insert(engine, table_name, dataframe):
+    """
+    Inserts the DataFrame into an existing table using the fastest path of the dialect in a single transaction.
+    The 'mssql' dialect uses executemany instead of multi-row VALUES when the pyodbc driver supports fast_executemany.
+    """
+    if dataframe.empty:
+        return
+    fast_path = FAST_PATHS.get(engine.dialect.name, executemany)
+    if engine.driver == 'pyodbc':
+        fast_path = executemany
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        fast_path(engine, cursor, table_name, dataframe)
+        cursor.close()
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def initialize(url):
+    """
+    Creates the engine of a loader process.  SQLite allows a single writer, so its lock timeout is raised to let the
+    processes take turns.
+    """
+    global loader_engine
+    connect_args = {'timeout': 3600} if url.drivername.startswith('sqlite') else {}
+    loader_engine = create_engine(url, connect_args=connect_args)
+
+
+def load_range(task):
+    """
+    Parses a byte range of a CSV file and inserts it into the table, returning the number of rows and bytes loaded.
+    Runs in a loader process.
+    """
+    filepath, start, end, table_name, names, usecols, columns, dtype = task
+    dataframe = read_range(filepath, start, end, names, usecols, dtype)
+    dataframe = dataframe[usecols]
+    dataframe.columns = columns
+    insert(loader_engine, table_name, dataframe)
+    return len(dataframe.index), end - start
+
+
+def load(url, table_name, filepath, usecols, columns, processes=None, dtype=None):
+    """
+    Loads a CSV file into an existing table by splitting it into byte ranges that are parsed and inserted by a pool of
+    'processes', each holding its own connection.  The 'usecols' header names of the CSV file are inserted into the
+    'columns' of the table.  Returns a dictionary with the number of rows, megabytes, seconds, rows/sec and MB/sec.
+    """
+    names = list(pandas.read_csv(filepath, nrows=0).columns)
+    tasks = [(filepath, start, end, table_name, names, usecols, columns, dtype) for start, end in byte_ranges(filepath)]
+    rows = 0
+    megabytes = 0
+    with Timer() as t:
+        pool = multiprocessing.Pool(processes, initializer=initialize, initargs=(url,))
+        try:
+            for range_rows, range_bytes in pool.imap_unordered(load_range, tasks):
+                rows += range_rows
+                megabytes += range_bytes / (1024 * 1024)
+        finally:
+            pool.terminate()  # every task has completed unless an exception was raised
+            pool.join()
+    stats = {'table_name': table_name, 'rows': rows, 'megabytes': megabytes, 'seconds': t.interval,
+             'rows_per_sec': rows / t.interval, 'mb_per_sec': megabytes / t.interval}
+    logging.info("Loaded " + table_name + ":  " + str(rows) + " rows, " + '{:.1f} MB in {:.1f} sec  ({:.0f} rows/sec, '
+                 '{:.2f} MB/sec)'.format(megabytes, t.interval, stats['rows_per_sec'], stats['mb_per_sec']))
+    return stats
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+import logging
+import results
+
+
+class Checkpoint:
+    """
+    The persisted plan and progress of a run, appended as JSON lines to 'filepath' so the database processes of a
+    parallel run can record their progress in the same file.  The 'plan' line holds the arguments of the run, then a
+    'loaded' line is appended once the tables of a database are created and loaded, a 'dropped' line once they are
+    dropped, a 'finished' line once a database is benchmarked and a 'completed' line at the end of the run.  The
+    queries already executed are read back from the results store itself, so a query is only skipped when its results
+    were written.
+    """
+    def __init__(self, filepath, run_id, events=None, completed=None):
+        self.filepath = filepath
+        self.run_id = run_id
+        self.events = events or []
+        self.completed = completed or set()  # (table_name, query_id, iteration, thread) of every query executed
+
+    def append(self, event, **values):
+        line = dict(values, run_id=self.run_id, event=event)
+        with open(self.filepath, 'a') as f:
+            f.write(json.dumps(line) + '\n')
+        self.events.append(line)
+
+    def plan(self, args):
+        self.append('plan', args=args)
+
+    @property
+    def args(self):
+        return next(line['args'] for line in self.events if line['event'] == 'plan')
+
+    def loaded(self, database):
+        """
+        Returns the names of the tables created and loaded into the database by the run, or None when they were not
+        loaded yet or were dropped since.
+        """
+        tables = None
+        for line in self.events:
+            if line.get('database') == database and line['event'] in ['loaded', 'dropped']:
+                tables = line.get('tables')
+        return tables
+
+    def load(self, database, table_names):
+        self.append('loaded', database=database, tables=list(table_names))
+
+    def drop(self, database):
+        self.append('dropped', database=database)
+
+    def finished(self, database):
+        return any(line['event'] == 'finished' and line['database'] == database for line in self.events)
+
+    def finish(self, database):
+        if not self.finished(database):
+            self.append('finished', database=database)
+
+    def all_loaded(self, database_list):
+        """
+        Returns whether the tables of every database were loaded, or the database benchmarked, before the interruption.
+        """
+        return all(self.loaded(database) is not None or self.finished(database) for database in database_list)
+
+    def complete(self):
+        self.append('completed')
+
+    @property
+    def is_completed(self):
+        return any(line['event'] == 'completed' for line in self.events)
+
+    def done(self, workload_row, thread):
+        """
+        Returns whether a query of the workload was already executed by the given user thread.
+        """
+        return (str(workload_row['table_name']), int(workload_row['query_id']), int(workload_row['iteration']),
+                thread) in self.completed
+
+
+def start(filepath, run_id, args):
+    """
+    Starts the checkpoint of a new run, saving its plan.
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    checkpoint = Checkpoint(filepath, run_id)
+    checkpoint.plan(args)
+    return checkpoint
+
+
+def resume(filepath, run_id, results_path, results_format=None):
+    """
+    Reads the checkpoint of a run and the queries it already executed from the results store.  Raises a ValueError
+    when the run has no plan in the checkpoint file.
+    """
+    events = []
+    if os.path.isfile(filepath):
+        with open(filepath, 'r') as f:
+            lines = [json.loads(line) for line in f if line.endswith('\n')]  # the last line may be incomplete
+        events = [line for line in lines if line['run_id'] == run_id]
+    if not any(line['event'] == 'plan' for line in events):
+        raise ValueError("No checkpoint of run " + run_id + " in " + filepath)
+    checkpoint = Checkpoint(filepath, run_id, events)
+    results_format = results_format or checkpoint.args['results_format']
+    executed = results.read(results_path, columns=['table_name', 'query_id', 'iteration', 'thread'], run_ids=[run_id],
+                            results_format=results_format).dropna()
+    completed = set(zip(executed['table_name'].astype(str), executed['query_id'].astype(int),
+                        executed['iteration'].astype(int), executed['thread'].astype(str)))
+    logging.info("Resuming run " + run_id + ":  " + str(len(completed)) + " queries already executed")
+    checkpoint.completed = completed
+    return checkpoint
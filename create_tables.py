@@ -5,40 +5,56 @@ import os
 import logging
 import subprocess
 import pandas
-from inflection import underscore
-from sqlalchemy import create_engine, types
+from sqlalchemy import create_engine
+import bulk_load
+import manifest
+import schema
 
 
 script_dir = os.path.dirname(os.path.join(os.getcwd(), __file__))
 data_path = os.path.join(script_dir + os.path.sep + "data")
 
 
-def individual(engine, data_filepath_list):
+def individual(engine, data_filepath_list, processes=None, sample_rows=None, load_manifest=None):
     """
-    Create individual SQL tables for every CSV file within a directory
+    Create individual SQL tables for every CSV file within a directory.  A single schema is inferred for each file,
+    from all of its rows or its first 'sample_rows' rows, and the table is created before any rows are inserted.  The
+    file is then loaded in parallel by 'processes' loader processes using bulk_load.  With a manifest.LoadManifest, a
+    table is skipped when its file has the fingerprint recorded at its last load and its row count verifies, otherwise
+    the table is dropped and loaded again and its fingerprint recorded.  Returns a DataFrame of the load statistics for
+    every table, in which the 'cached' column flags the skipped tables.
     """
+    stats_list = []
     for filepath in data_filepath_list:
         table_name = os.path.splitext(os.path.basename(filepath))[0]  # set table name to basename of filepath
         logging.info("Reading data file:  " + filepath)
-        line_count = sum(1 for line in open('On_Time_Performance_1993_2.csv')) - 1
+        inferred = schema.load(filepath, sample_rows)
+        if load_manifest is not None:
+            file_fingerprint = manifest.fingerprint(filepath, inferred)
+            if load_manifest.matches(engine, table_name, file_fingerprint):
+                rows = load_manifest.tables[table_name]['rows']
+                logging.info("Table " + table_name + " is already loaded with " + str(rows) + " rows, skipping")
+                stats_list.append({'table_name': table_name, 'rows': rows, 'megabytes': file_fingerprint['size'] / 1e6,
+                                   'seconds': 0.0, 'rows_per_sec': float('nan'), 'mb_per_sec': float('nan'),
+                                   'cached': True})
+                continue
+            schema.table(table_name, inferred).drop(engine, checkfirst=True)  # never append to a stale table
+        line_count = bulk_load.count_lines(filepath) - 1
         logging.info(str(line_count) + " rows will be inserted.")
-        for dataframe in pandas.read_csv(filepath, low_memory=False, iterator=True, chunksize=1000000):  # infer dtypes
-            dataframe.dropna(axis=1, thresh=len(dataframe.index) // 10, inplace=True)  # drop columns having more than 90% NaN values
-            dataframe.columns = map(str.upper, map(underscore, dataframe.columns))  # camelcase to underscore to uppercase
-            dtype_dict = {}
-            for column in dataframe.columns:  # map DataFrame dtypes to Database data types
-                if dataframe[column].dtype in ['object']:
-                    dtype_dict[column] = types.String(int(dataframe[column].str.len().max()))
-                elif dataframe[column].dtype in ['int64']:
-                    dtype_dict[column] = types.Integer()
-                elif dataframe[column].dtype in ['float64']:
-                    dtype_dict[column] = types.Float()
-                else:
-                    logging.error(str(dataframe[column].dtype) + " dtype unsupported.  Dropping column:  " + column)  # ['object_', 'string_', 'unicode_', 'unicode', 'int_', 'float_']
-                    del dataframe[column]
-            logging.info("Creating table and inserting data into table:  " + table_name)
-            dataframe.to_sql(table_name, engine, if_exists='append', index=False, chunksize=1000, dtype=dtype_dict)
-            logging.info("Successfully inserted data")
+        usecols = [column['header'] for column in inferred['columns']]
+        columns = [column['column'] for column in inferred['columns']]
+        dtype = {column['header']: str for column in inferred['columns'] if column['type'] == 'string'}
+        logging.info("Creating table and inserting data into table:  " + table_name)
+        schema.create(engine, table_name, inferred)
+        stats = bulk_load.load(engine.url, table_name, filepath, usecols, columns, processes, dtype)
+        if stats['rows'] != line_count:
+            logging.warning(str(stats['rows']) + " rows were inserted into " + table_name + " but the file has " +
+                            str(line_count) + " lines")
+        if load_manifest is not None:
+            load_manifest.record(table_name, file_fingerprint, stats['rows'])
+        stats_list.append(dict(stats, cached=False))
+        logging.info("Successfully inserted data")
+    return pandas.DataFrame(stats_list)
 
 
 ############################################################################
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+import time
+import socket
+import logging
+import pandas
+from threading import Thread, Lock
+from retrying import retry
+import benchmark
+import histogram
+
+
+START_DELAY = 2.0  # seconds between sending the assignments and the synchronized start of the agents
+CLOCK_SAMPLES = 5  # number of round trips used to estimate the clock offset of an agent
+
+
+class AgentError(Exception):
+    pass
+
+
+def address(text):
+    """
+    Parses a 'host:port' string into a (host, port) tuple.
+    """
+    host, port = text.rsplit(':', 1)
+    return host, int(port)
+
+
+class Connection:
+    """
+    A socket exchanging messages as JSON lines.  Sending is thread-safe so every thread of an agent can stream its
+    results through the same connection.
+    """
+    def __init__(self, sock):
+        self.socket = sock
+        self.file = sock.makefile('r', encoding='utf-8')
+        self.lock = Lock()
+
+    def send(self, message):
+        line = json.dumps(message, default=lambda value: value.item()) + '\n'  # numpy scalars
+        with self.lock:
+            self.socket.sendall(line.encode('utf-8'))
+
+    def receive(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Connection closed by peer")
+        return json.loads(line)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+class AgentSink:
+    """
+    A sink streaming the result records of an agent back to the controller.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def put(self, record):
+        self.connection.send({'type': 'result', 'record': record})
+
+
+@retry(stop_max_delay=60000, wait_fixed=1000, retry_on_exception=lambda error: isinstance(error, ConnectionRefusedError))
+def connect(controller_address):
+    """
+    Using the retry decorator, keeps trying to connect to a controller that is not listening yet for up to 60 seconds.
+    """
+    return Connection(socket.create_connection(controller_address))
+
+
+def agent(controller_address, name=None):
+    """
+    Runs a load generation agent.  The agent connects to the controller, then runs every assignment it receives with
+    the benchmark.database loop in the number of threads assigned, starting at the synchronized start time and
+    streaming every result record back, until the controller sends 'exit'.  The name defaults to the host name and the
+    process id, so several agents can run on the same host.
+    """
+    name = name or socket.gethostname() + ':' + str(os.getpid())
+    connection = connect(controller_address)
+    connection.send({'type': 'hello', 'name': name})
+    logging.info("Agent " + name + " connected to controller " + str(controller_address))
+    try:
+        while True:
+            message = connection.receive()
+            if message['type'] == 'ping':
+                connection.send({'type': 'pong', 'sent': message['sent'], 'time': time.time()})
+            elif message['type'] == 'assign':
+                run_assignment(connection, name, message)
+            elif message['type'] == 'exit':
+                break
+            elif message['type'] == 'reject':
+                logging.error("Agent " + name + " rejected by controller " + str(controller_address) + ":  " +
+                              message['reason'])
+                break
+    finally:
+        connection.close()
+    logging.info("Agent " + name + " finished")
+
+
+def run_assignment(connection, name, message):
+    """
+    Benchmarks the database of an assignment with its share of the concurrent users and sends back the histograms and
+    the benchmark time of the agent.
+    """
+    workload_dataframe = pandas.DataFrame(message['workload'])
+    args = message['args']
+    sink = AgentSink(connection)
+    thread_histograms = [{} for thread_number in range(message['threads'])]
+    breaker = benchmark.CircuitBreaker(args['breaker_timeouts'])
+    delay = message['start_at'] - time.time()
+    logging.info("Agent " + name + " starting " + str(message['threads']) + " threads in " + str('{:f} sec'.format(delay)))
+    if delay > 0:
+        time.sleep(delay)
+    with benchmark.Timer() as t:
+        thread_list = [Thread(name=name + ' thread #' + str(thread_number+1), target=benchmark.database,
+                              args=(workload_dataframe, message['attributes'], sink, args, thread_histograms[thread_number],
+                                    breaker))
+                       for thread_number in range(message['threads'])]
+        [thread.start() for thread in thread_list]
+        [thread.join() for thread in thread_list]
+    histograms = histogram.merge_all(thread_histograms)
+    connection.send({'type': 'histograms', 'seconds': t.interval,
+                     'histograms': [[list(histogram_key), histograms[histogram_key].to_dict()] for histogram_key in histograms]})
+    connection.send({'type': 'done'})
+
+
+class Controller:
+    """
+    Coordinates load generation agents running on one or more hosts.  The controller listens on 'listen_address' until
+    'agents' agents are connected and estimates the offset of the clock of each agent, then every benchmark is split
+    between the agents, started at the same time on every agent and merged into a single run.  An agent connecting with
+    the name of an agent already connected is rejected, as the results of both would be merged under the same name.
+    """
+    def __init__(self, listen_address, agents):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(listen_address)
+        self.server.listen(agents)
+        logging.info("Controller waiting for " + str(agents) + " agents on " + str(listen_address))
+        self.agents = []
+        while len(self.agents) < agents:
+            sock, peer = self.server.accept()
+            connection = Connection(sock)
+            hello = connection.receive()
+            if hello['name'] in [agent_dict['name'] for agent_dict in self.agents]:
+                logging.warning("Rejected agent " + hello['name'] + " connected from " + str(peer) +
+                                ":  an agent of the same name is already connected")
+                connection.send({'type': 'reject', 'reason': "an agent named " + hello['name'] + " is already connected"})
+                connection.close()
+                continue
+            offset = self.clock_offset(connection)
+            logging.info("Agent " + hello['name'] + " connected from " + str(peer) + " with clock offset " +
+                         str('{:f} sec'.format(offset)))
+            self.agents.append({'name': hello['name'], 'connection': connection, 'offset': offset})
+
+    @staticmethod
+    def clock_offset(connection):
+        """
+        Returns the offset of the clock of an agent from the clock of the controller, estimated from the round trip
+        having the lowest latency, assuming the latency is the same in both directions.
+        """
+        samples = []
+        for sample in range(CLOCK_SAMPLES):
+            connection.send({'type': 'ping', 'sent': time.time()})
+            pong = connection.receive()
+            received = time.time()
+            samples.append((received - pong['sent'], pong['time'] - (pong['sent'] + received) / 2.0))
+        return min(samples)[1]
+
+    def run(self, workload_dataframe, attributes, sink, args):
+        """
+        Assigns the workload to every agent with an equal share of the 'concurrent_users' threads, and puts every
+        result record the agents stream back on the 'sink' parameter, tagged with the agent name.  Returns the merged
+        histograms and the longest benchmark time of the agents.  When the connection of an agent fails before the agent
+        is done, the agent is dropped from the controller once the other agents are done, and AgentError is raised since
+        the run is missing the remaining executions of the failed agent.
+        """
+        workload = workload_dataframe.astype(object).where(pandas.notnull(workload_dataframe), None).to_dict(orient='records')
+        start = time.time() + START_DELAY
+        agent_histograms = []
+        agent_seconds = []
+        reader_list = []
+        for number, agent_dict in enumerate(self.agents):
+            threads = args['concurrent_users'] // len(self.agents) + (number < args['concurrent_users'] % len(self.agents))
+            agent_dict['connection'].send({'type': 'assign', 'workload': workload, 'attributes': attributes,
+                                           'args': args, 'threads': threads, 'start_at': start + agent_dict['offset']})
+            reader = Thread(name=agent_dict['name'] + ' reader', target=self.read,
+                            args=(agent_dict, sink, agent_histograms, agent_seconds))
+            reader.start()
+            reader_list.append(reader)
+        [reader.join() for reader in reader_list]
+        failed = [agent_dict for agent_dict in self.agents if agent_dict.get('error')]
+        if failed:
+            self.agents = [agent_dict for agent_dict in self.agents if not agent_dict.get('error')]
+            [agent_dict['connection'].close() for agent_dict in failed]
+            raise AgentError("Agents failed before finishing the run:  " +
+                             ', '.join(agent_dict['name'] + ' (' + agent_dict['error'] + ')' for agent_dict in failed))
+        return histogram.merge_all(agent_histograms), max(agent_seconds) if agent_seconds else 0.0
+
+    @staticmethod
+    def read(agent_dict, sink, agent_histograms, agent_seconds):
+        """
+        Receives the messages of an agent until it is done.  A connection closed, reset or cut in the middle of a
+        message is recorded as the 'error' of the agent instead of ending the thread with an exception.
+        """
+        while True:
+            try:
+                message = agent_dict['connection'].receive()
+            except (OSError, ValueError) as error:  # ConnectionError is an OSError, a truncated JSON line a ValueError
+                logging.error("Agent " + agent_dict['name'] + " failed:  " + str(error))
+                agent_dict['error'] = str(error)
+                return
+            if message['type'] == 'result':
+                message['record']['agent'] = agent_dict['name']
+                for column in ['started_at', 'finished_at', 'executed_at']:  # to the clock of the controller
+                    if message['record'].get(column) is not None:
+                        message['record'][column] -= agent_dict['offset']
+                sink.put(message['record'])
+            elif message['type'] == 'histograms':
+                agent_histograms.append({tuple(histogram_key): histogram.Histogram.from_dict(histogram_dict)
+                                         for histogram_key, histogram_dict in message['histograms']})
+                agent_seconds.append(message['seconds'])
+            elif message['type'] == 'done':
+                return
+
+    def close(self):
+        for agent_dict in self.agents:
+            agent_dict['connection'].send({'type': 'exit'})
+            agent_dict['connection'].close()
+        self.server.close()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+import pandas
+
+
+SUB_BUCKET_BITS = 11  # 2048 sub-buckets per power of two keeps the relative error of a value below 0.1%
+UNITS_PER_SECOND = 1000000  # values are recorded in microseconds
+PERCENTILES = [50, 90, 99, 99.9]
+KEY_COLUMNS = ['database', 'query_id', 'table_size_category', 'concurrency_factor']
+
+
+class Histogram:
+    """
+    A mergeable high dynamic range histogram of latencies in seconds.  Values are counted in log-linear buckets, so
+    the memory used depends on the range of the values rather than on their number, and two histograms are merged by
+    adding their bucket counts.
+    """
+    def __init__(self, counts=None, maximum=0.0):
+        self.counts = counts or {}
+        self.maximum = maximum
+
+    @staticmethod
+    def magnitude(units):
+        return max(units.bit_length() - SUB_BUCKET_BITS, 0)
+
+    def record(self, value):
+        units = max(int(value * UNITS_PER_SECOND), 0)
+        magnitude = self.magnitude(units)
+        lowest = (units >> magnitude) << magnitude
+        self.counts[lowest] = self.counts.get(lowest, 0) + 1
+        self.maximum = max(self.maximum, value)
+
+    def merge(self, other):
+        for lowest, count in other.counts.items():
+            self.counts[lowest] = self.counts.get(lowest, 0) + count
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    @property
+    def count(self):
+        return sum(self.counts.values())
+
+    def percentile(self, percentile):
+        """
+        Returns the highest value equivalent to the bucket holding the given percentile, in seconds.
+        """
+        total = self.count
+        if not total:
+            return float('nan')
+        threshold = percentile / 100.0 * total
+        cumulative = 0
+        for lowest in sorted(self.counts):
+            cumulative += self.counts[lowest]
+            if cumulative >= threshold:
+                highest = lowest + (1 << self.magnitude(lowest)) - 1
+                return min(highest / UNITS_PER_SECOND, self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        return {'counts': {str(lowest): count for lowest, count in self.counts.items()}, 'maximum': self.maximum}
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        return cls({int(lowest): count for lowest, count in dictionary['counts'].items()}, dictionary['maximum'])
+
+
+def key(query_row, table_row, concurrency_factor):
+    """
+    Returns the histogram key of a query execution as a tuple of the KEY_COLUMNS values.
+    """
+    return (str(query_row['database']), int(query_row['query_id']), str(table_row.get('table_size_category')),
+            int(concurrency_factor))
+
+
+def merge_all(histograms_list):
+    """
+    Merges a list of dictionaries of histograms, such as one dictionary per thread, into a single dictionary.
+    """
+    merged = {}
+    for histograms in histograms_list:
+        for histogram_key, histogram in histograms.items():
+            merged.setdefault(histogram_key, Histogram()).merge(histogram)
+    return merged
+
+
+def report(histograms, seconds):
+    """
+    Returns a DataFrame of the count, percentiles, maximum and throughput in queries per second of every histogram.
+    The 'seconds' parameter is either the duration of the run or a dictionary of durations by histogram key.
+    """
+    report_list = []
+    for histogram_key in sorted(histograms):
+        histogram = histograms[histogram_key]
+        duration = seconds.get(histogram_key) if isinstance(seconds, dict) else seconds
+        row = dict(zip(KEY_COLUMNS, histogram_key))
+        row['count'] = histogram.count
+        for percentile in PERCENTILES:
+            row['p' + str(percentile).replace('.', '_')] = histogram.percentile(percentile)
+        row['max'] = histogram.maximum
+        row['throughput'] = histogram.count / duration if duration else float('nan')
+        report_list.append(row)
+    return pandas.DataFrame(report_list, columns=KEY_COLUMNS + ['count'] + ['p' + str(percentile).replace('.', '_')
+                                                                          for percentile in PERCENTILES] + ['max', 'throughput'])
+
+
+def save(filepath, histograms, seconds, run_id):
+    """
+    Appends the histograms of a run to a JSON lines file, one line per histogram key.
+    """
+    with open(filepath, 'a') as f:
+        for histogram_key, histogram in histograms.items():
+            line = dict(zip(KEY_COLUMNS, histogram_key))
+            line.update({'run_id': run_id, 'seconds': seconds, 'histogram': histogram.to_dict()})
+            f.write(json.dumps(line) + '\n')
+
+
+def load(filepath, run_ids=None):
+    """
+    Reads the histograms of the runs saved in a JSON lines file, optionally only those of the given 'run_ids', and
+    merges them by histogram key.  Returns the merged histograms and the total duration of the merged runs by key.
+    """
+    histograms = {}
+    seconds = {}
+    if not os.path.isfile(filepath):
+        return histograms, seconds
+    with open(filepath, 'r') as f:
+        for line in f:
+            saved = json.loads(line)
+            if run_ids and saved['run_id'] not in run_ids:
+                continue
+            histogram_key = tuple(saved[column] for column in KEY_COLUMNS)
+            histograms.setdefault(histogram_key, Histogram()).merge(Histogram.from_dict(saved['histogram']))
+            seconds[histogram_key] = seconds.get(histogram_key, 0) + saved['seconds']
+    return histograms, seconds
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextmanager
+def lock(filepath):
+    """
+    Holds an exclusive lock on the '.lock' file next to a JSON file, so the processes of a parallel run update the
+    JSON file one at a time.  Without fcntl, the updates of the processes are not serialized.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(filepath + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read(filepath, key):
+    """
+    Returns the value of 'key' in the JSON object of a file, or an empty dictionary when the file or the key is missing.
+    """
+    if not filepath or not os.path.isfile(filepath):
+        return {}
+    with open(filepath, 'r') as f:
+        return json.load(f).get(key, {})
+
+
+def update(filepath, key, value):
+    """
+    Writes 'value' under 'key' in the JSON object of a file, keeping the other keys, such as the entries of the other
+    databases.  The file is read and replaced under the lock so no update of another process is lost, and replaced
+    atomically so a reader never reads a partial file.
+    """
+    with lock(filepath):
+        saved = {}
+        if os.path.isfile(filepath):
+            with open(filepath, 'r') as f:
+                saved = json.load(f)
+        saved[key] = value
+        temporary_filepath = filepath + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary_filepath, 'w') as f:
+            json.dump(saved, f, default=lambda value: value.item())  # numpy scalars
+        os.replace(temporary_filepath, filepath)
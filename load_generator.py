@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+
+import os
+import time
+import queue
+import random
+import logging
+import pandas
+from threading import Thread, Barrier, BrokenBarrierError, current_thread
+from sqlalchemy import create_engine
+import benchmark
+import histogram
+
+
+PHASES = ['ramp_up', 'steady', 'cool_down']
+
+
+def rate(elapsed, args):
+    """
+    Returns the target number of queries per second at 'elapsed' seconds into the run.  The rate rises linearly during
+    the ramp-up phase, holds during the steady-state phase and falls linearly during the cool-down phase.  The 'stepped'
+    arrival process raises the steady-state rate in 'steps' equal steps up to the target rate.
+    """
+    ramp_up, duration, cool_down = args['ramp_up'], args['duration'], args['cool_down']
+    if elapsed < ramp_up:
+        return args['qps'] * elapsed / ramp_up
+    elif elapsed < ramp_up + duration:
+        if args['arrival'] == 'stepped':
+            step = int((elapsed - ramp_up) // (duration / args['steps'])) + 1
+            return args['qps'] * min(step, args['steps']) / args['steps']
+        return args['qps']
+    return args['qps'] * (ramp_up + duration + cool_down - elapsed) / cool_down
+
+
+def phase(elapsed, args):
+    if elapsed < args['ramp_up']:
+        return 'ramp_up'
+    elif elapsed < args['ramp_up'] + args['duration']:
+        return 'steady'
+    return 'cool_down'
+
+
+def arrivals(args):
+    """
+    Generates the arrival times in seconds from the start of the run by thinning candidate arrivals at the target rate
+    down to the current rate.  'poisson' candidates have exponentially distributed inter-arrival times and are kept
+    at random, 'constant' and 'stepped' candidates are evenly spaced and kept whenever the accumulated rate ratio
+    reaches one arrival.  The arrivals have their own random stream, so they never depend on the jobs dispatched.
+    """
+    rng = random.Random(str(args.get('seed')) + ':arrivals')
+    total = args['ramp_up'] + args['duration'] + args['cool_down']
+    elapsed = 0.0
+    credit = 0.0
+    while True:
+        elapsed += rng.expovariate(args['qps']) if args['arrival'] == 'poisson' else 1.0 / args['qps']
+        if elapsed >= total:
+            break
+        ratio = rate(elapsed, args) / args['qps']
+        if args['arrival'] == 'poisson':
+            if rng.random() < ratio:
+                yield elapsed
+        else:
+            credit += ratio
+            if credit >= 1:
+                credit -= 1
+                yield elapsed
+
+
+def dispatch(job_queue, jobs, args):
+    """
+    Puts every job on the queue at its scheduled arrival time regardless of how many queries are still running, so
+    the arrival rate never depends on the response time of the database.  The jobs are chosen from their own random
+    stream, independent of the stream of the arrivals.
+    """
+    rng = random.Random(str(args.get('seed')) + ':dispatch')
+    start = time.perf_counter()
+    for elapsed in arrivals(args):
+        delay = start + elapsed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        job_queue.put((start, elapsed, rng.choice(jobs)))
+    for _ in range(args['concurrent_users']):
+        job_queue.put(None)
+
+
+def execute(job_queue, sink, records, histograms, barrier, breaker, engine, attributes, args):
+    """
+    Takes jobs from the queue and executes them until the dispatcher is done, recording the queueing delay between the
+    scheduled arrival and the start of the execution separately from the execution time.  Every record is put on the
+    'sink' parameter as soon as its execution completes, and the execution time of every successful query is recorded
+    into the histogram of its key in the 'histograms' dictionary, like benchmark.database.  Each executor waits for the
+    optional think time after every query, drawn from its own stream seeded from the 'seed' argument.  Jobs of the
+    categories that keep timing out on a table are skipped by the shared circuit 'breaker'.
+    """
+    try:
+        worker = benchmark.start_worker(attributes, args) if args['connection_mode'] == 'warm' else None
+    except Exception as error:
+        logging.error(current_thread().name + " unable to connect:  " + str(error))
+        barrier.abort()  # release the other executors and the dispatcher
+        return
+    try:
+        barrier.wait()  # the schedule starts once every executor is connected
+    except BrokenBarrierError:  # another executor was unable to connect
+        if worker:
+            worker.stop()
+        return
+    rng = random.Random(str(args.get('seed')) + ':think:' + current_thread().name)
+    for start, elapsed, job in iter(job_queue.get, None):
+        record = {'scheduled': elapsed, 'phase': phase(elapsed, args), 'target_qps': args['qps'],
+                  'arrival': args['arrival'], 'concurrency_factor': args['concurrent_users'],
+                  'connection_mode': args['connection_mode'], 'fetch_mode': args['fetch_mode'], 'error': '',
+                  'status': 'ok', 'rows': float('nan'), 'time': float('nan')}
+        record.update(job)
+        record['timeout'] = benchmark.query_timeout(record, args)
+        record['started'] = time.perf_counter() - start
+        record['started_at'] = time.time()  # wall clock of the client resource profiler
+        record['queue_delay'] = record['started'] - elapsed
+        if breaker.open(record):
+            record['status'] = 'skipped'
+        else:
+            try:
+                record.update(benchmark.execute_query(engine, record['query_executed'], args, worker,
+                                                      benchmark.instruments(attributes, args), record['timeout']))
+            except Exception as error:
+                logging.error(error)
+                record.update({'status': 'timeout' if isinstance(error, benchmark.TimeoutException) else 'error',
+                               'error': str(error), 'time': time.time() - record['started_at']})
+                if worker and not worker.is_alive():  # the worker is terminated when a query does not return
+                    worker = benchmark.start_worker(attributes, args)
+            breaker.record(record)
+        record['finished'] = time.perf_counter() - start
+        record['finished_at'] = time.time()
+        record['thread'] = current_thread().name
+        if record['status'] == 'ok':
+            histograms.setdefault(histogram.key(record, record, args['concurrent_users']),
+                                  histogram.Histogram()).record(record['time'])
+        records.append(record)
+        sink.put(record)
+        if args['think_time']:
+            time.sleep(rng.expovariate(1.0 / args['think_time']))
+    if worker:
+        worker.stop()
+
+
+def summary(benchmark_dataframe, args):
+    """
+    Summarizes each phase of the run with the offered throughput, counting the queries scheduled during the phase, and
+    the achieved throughput, counting the queries that completed successfully during the phase, in queries per second
+    next to the percentiles of the queueing delay and the execution time of the queries scheduled during the phase.
+    """
+    durations = {'ramp_up': args['ramp_up'], 'steady': args['duration'], 'cool_down': args['cool_down']}
+    summary_list = []
+    phase_start = 0.0
+    for phase_name in PHASES:
+        phase_end = phase_start + durations[phase_name]
+        if not durations[phase_name]:
+            continue
+        phase_dataframe = benchmark_dataframe[benchmark_dataframe['phase'] == phase_name]
+        succeeded = phase_dataframe[phase_dataframe['status'] == 'ok']
+        completed = benchmark_dataframe[(benchmark_dataframe['status'] == 'ok')
+                                        & (benchmark_dataframe['finished'] >= phase_start)
+                                        & (benchmark_dataframe['finished'] < phase_end)]
+        phase_start = phase_end
+        summary_list.append({'phase': phase_name,
+                             'offered_qps': len(phase_dataframe.index) / durations[phase_name],
+                             'achieved_qps': len(completed.index) / durations[phase_name],
+                             'errors': int(phase_dataframe['status'].isin(['error', 'timeout']).sum()),
+                             'queue_delay_p50': succeeded['queue_delay'].quantile(0.5),
+                             'queue_delay_p99': succeeded['queue_delay'].quantile(0.99),
+                             'time_p50': succeeded['time'].quantile(0.5),
+                             'time_p99': succeeded['time'].quantile(0.99)})
+    return pandas.DataFrame(summary_list, columns=['phase', 'offered_qps', 'achieved_qps', 'errors', 'queue_delay_p50',
+                                                   'queue_delay_p99', 'time_p50', 'time_p99'])
+
+
+def run(workload_dataframe, attributes, sink, args, database=None, run_id=None, filepath=None):
+    """
+    Benchmark the database with an open-loop load generator.  Queries are issued at the 'qps' target rate following
+    the 'arrival' process through the ramp-up, steady-state and cool-down phases, and are executed by up to
+    'concurrent_users' executors.  Every query is a random query of the compiled 'workload_dataframe' parameter.  Puts a
+    record of every execution on the 'sink' parameter, a results.ResultsSink, logs the summary of each phase and
+    appends it to the optional 'filepath' CSV file.  Returns the merged histograms of the executors and the run time in
+    seconds, like the closed-loop benchmark.  When an executor is unable to connect, no query is issued.
+    """
+    engine = create_engine(attributes['connection_string'])
+    jobs = [workload_row.to_dict() for workload_index, workload_row in workload_dataframe.iterrows()]
+
+    job_queue = queue.Queue()
+    records = []  # list.append is thread-safe
+    thread_histograms = [{} for thread_number in range(args['concurrent_users'])]
+    barrier = Barrier(args['concurrent_users'] + 1)
+    breaker = benchmark.CircuitBreaker(args['breaker_timeouts'])
+    thread_list = [Thread(name='executor #' + str(thread_number+1), target=execute,
+                          args=(job_queue, sink, records, thread_histograms[thread_number], barrier, breaker, engine,
+                                attributes, args))
+                   for thread_number in range(args['concurrent_users'])]
+    with benchmark.Timer() as t:
+        [thread.start() for thread in thread_list]
+        try:
+            barrier.wait()
+        except BrokenBarrierError:
+            [thread.join() for thread in thread_list]
+            logging.error("No queries were issued, an executor was unable to connect to the database")
+            return {}, 0.0
+        dispatch(job_queue, jobs, args)
+        [thread.join() for thread in thread_list]
+
+    benchmark_dataframe = pandas.DataFrame(records)
+    if benchmark_dataframe.empty:
+        logging.warning("No queries were issued")
+        return {}, t.interval
+    summary_dataframe = summary(benchmark_dataframe, args)
+    logging.info(summary_dataframe)
+    if filepath:
+        summary_dataframe.insert(0, 'database', database)
+        summary_dataframe.insert(0, 'run_id', run_id)
+        summary_dataframe.to_csv(filepath, index=False, mode='a', header=not os.path.isfile(filepath))
+    return histogram.merge_all(thread_histograms), t.interval
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+import time
+import hashlib
+import logging
+import pandas
+from threading import Lock
+import jsonfile
+
+
+SAMPLE_BLOCKS = 16  # blocks of a data file hashed into its fingerprint, spread evenly from its start to its end
+SAMPLE_BLOCK_SIZE = 64 * 1024
+
+
+def sample_hash(filepath, blocks=SAMPLE_BLOCKS, block_size=SAMPLE_BLOCK_SIZE):
+    """
+    Returns a hash of 'blocks' blocks of 'block_size' bytes spread evenly over a file, the first at its start and the
+    last at its end, so a change to the content of a large file is detected without reading all of it.  A file smaller
+    than the blocks is hashed whole.
+    """
+    size = os.path.getsize(filepath)
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        if size <= blocks * block_size:
+            digest.update(f.read())
+        else:
+            for block in range(blocks):
+                f.seek((size - block_size) * block // (blocks - 1))
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+def fingerprint(filepath, inferred):
+    """
+    Returns the fingerprint of a data file:  its size, modification time, sampled content hash and inferred schema.
+    """
+    return {'size': os.path.getsize(filepath), 'mtime': os.path.getmtime(filepath), 'sample_hash': sample_hash(filepath),
+            'columns': inferred['columns']}
+
+
+class LoadManifest:
+    """
+    The record of the tables loaded into a database from the data files, the fingerprint of the file each table was
+    loaded from and the number of rows loaded.  A table whose data file still has the same fingerprint and whose row
+    count still matches does not need to be loaded again.  When a 'filepath' is given, the manifest is persisted to
+    that JSON file, holding the tables of every database by name, like the metadata.Catalog.
+    """
+    def __init__(self, database, filepath=None):
+        self.database = database
+        self.filepath = filepath
+        self.lock = Lock()
+        self.tables = jsonfile.read(filepath, database)
+
+    def matches(self, engine, table_name, file_fingerprint):
+        """
+        Returns whether the table was loaded from a data file of the same fingerprint and still has the number of rows
+        loaded, verified with SELECT COUNT(*).
+        """
+        with self.lock:
+            entry = self.tables.get(table_name)
+        if not entry or entry['fingerprint'] != json.loads(json.dumps(file_fingerprint)):
+            return False
+        try:
+            sql = 'SELECT COUNT(*) FROM "{table_name}"'.format(table_name=table_name)
+            row_count = int(pandas.read_sql(sql, engine).iloc[0, 0])
+        except Exception as error:  # the table was dropped outside of the benchmark
+            logging.warning("Unable to verify table " + table_name + ":  " + str(error))
+            return False
+        if row_count != entry['rows']:
+            logging.warning("Table " + table_name + " has " + str(row_count) + " rows but " + str(entry['rows']) +
+                            " were loaded")
+            return False
+        return True
+
+    def record(self, table_name, file_fingerprint, rows):
+        with self.lock:
+            self.tables[table_name] = {'fingerprint': file_fingerprint, 'rows': int(rows), 'loaded': time.time()}
+
+    def forget(self, table_names):
+        """
+        Removes the given 'table_names', such as after the tables are dropped.
+        """
+        with self.lock:
+            self.tables = {table_name: entry for table_name, entry in self.tables.items()
+                           if table_name not in table_names}
+
+    def save(self):
+        """
+        Writes the manifest of the database to the JSON file, keeping the manifests of the other databases.
+        """
+        if not self.filepath:
+            return
+        with self.lock:
+            jsonfile.update(self.filepath, self.database, self.tables)
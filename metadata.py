@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+
+import time
+import logging
+import pandas
+from threading import Lock
+import jsonfile
+import tracing
+
+
+CATALOG_TTL = 86400  # cached metadata expires after 86400 seconds (24 hours)
+
+
+class Catalog:
+    """
+    A cache of the catalog metadata of a database, the data types of the columns and the row count of every table.
+    One catalog is shared by every thread benchmarking the database so each metadata query runs once per table rather
+    than once per thread and iteration.  When a 'filepath' is given, the cache is persisted to that JSON file, holding
+    the metadata of every database by name, so it is reused across runs until it is older than 'ttl' seconds or
+    invalidated.  The time spent querying the catalog is logged as its own cost and accumulated in 'seconds'.
+    """
+    def __init__(self, database, attributes, filepath=None, ttl=CATALOG_TTL):
+        self.database = database
+        self.attributes = attributes
+        self.filepath = filepath
+        self.ttl = ttl
+        self.seconds = 0.0
+        self.lock = Lock()
+        self.entries = jsonfile.read(filepath, database)
+
+    def fetch(self, kind, table_name, function):
+        """
+        Returns the cached value of the 'kind' metadata of a table, calling 'function' to query it when it is missing
+        or expired.  The lock is held while querying so concurrent threads wait for the first query instead of all
+        running it.
+        """
+        key = kind + ':' + table_name
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.time() - entry['fetched'] < self.ttl:
+                return entry['value']
+            start = time.perf_counter()
+            with tracing.span('metadata', kind=kind, table_name=table_name):
+                value = function()
+            seconds = time.perf_counter() - start
+            self.seconds += seconds
+            logging.info("Metadata " + kind + " of " + table_name + str(': {:f} sec'.format(seconds)))
+            self.entries[key] = {'value': value, 'fetched': time.time(), 'seconds': seconds}
+            return value
+
+    def datatypes(self, engine, table_name):
+        """
+        Returns a DataFrame of the columns and their data types from the 'datatypes_query' of the database.
+        """
+        def query():
+            datatypes_query = self.attributes['datatypes_query'].format(table_name=table_name)
+            dataframe = pandas.read_sql(datatypes_query, engine)
+            dataframe.columns = map(str.lower, dataframe.columns)  # SQLAlchemy column case sensitivity is inconsistent between SQL dialects
+            return {'columns': list(dataframe.columns), 'data': dataframe.astype(object).values.tolist()}
+        value = self.fetch('datatypes', table_name, query)
+        return pandas.DataFrame(value['data'], columns=value['columns'])
+
+    def row_count(self, engine, table_name, statistics=False):
+        """
+        Returns the number of rows of a table.  When 'statistics' is True and the database has a 'row_count_query',
+        the row count is read from the dictionary statistics instead of counting every row, falling back to
+        SELECT COUNT(*) when the table has no statistics.  The statistics and the exact counts are cached as separate
+        kinds, so an exact count is never answered with an estimate cached by another run.
+        """
+        def query():
+            row_count_query = self.attributes.get('row_count_query')
+            if statistics and row_count_query:
+                row_count = pandas.read_sql(row_count_query.format(table_name=table_name), engine).iloc[0, 0]
+                if pandas.notnull(row_count):
+                    return int(row_count)
+                logging.warning("No statistics found for table:  " + table_name)
+            sql = 'SELECT COUNT(*) FROM "{table_name}"'.format(table_name=table_name)
+            return int(pandas.read_sql(sql, engine).iloc[0, 0])
+        return self.fetch('row_count_statistics' if statistics else 'row_count', table_name, query)
+
+    def invalidate(self, table_names=None):
+        """
+        Removes the cached metadata of the given 'table_names', or of every table when None, such as after the tables
+        are created, loaded or dropped.
+        """
+        with self.lock:
+            if table_names is None:
+                self.entries = {}
+            else:
+                self.entries = {key: entry for key, entry in self.entries.items()
+                                if key.split(':', 1)[1] not in table_names}
+
+    def save(self):
+        """
+        Writes the cached metadata of the database to the JSON file, keeping the metadata of the other databases.
+        """
+        if not self.filepath:
+            return
+        with self.lock:
+            jsonfile.update(self.filepath, self.database, self.entries)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+
+import os
+import random
+import hashlib
+import logging
+import time
+import pandas
+from threading import Thread, Event, Lock, current_thread
+from sqlalchemy import create_engine
+import benchmark
+
+
+WRITE_RATIO = 0.25  # fraction of the concurrent users running the write templates in the mixed mode
+WRITE_BATCH_SIZE = 1000
+WRITES_FILEPATH = 'queries/writes.csv'
+
+# Default statements copying a table before the writes and restoring it afterwards, overridden by the
+# 'snapshot_query' and 'restore_query' of the database
+SNAPSHOT_QUERY = 'CREATE TABLE "{snapshot}" AS SELECT * FROM "{table_name}"'
+RESTORE_QUERY = ['DELETE FROM "{table_name}"', 'INSERT INTO "{table_name}" SELECT * FROM "{snapshot}"',
+                 'DROP TABLE "{snapshot}"']
+
+MIXED_COLUMNS = ['database', 'operation', 'category', 'users', 'queries', 'errors', 'read_only_p50', 'mixed_p50',
+                 'read_only_p99', 'mixed_p99', 'degradation', 'seconds', 'throughput', 'rows_per_sec']
+
+
+def users(args):
+    """
+    Splits the concurrent users between readers and writers by the '--write-ratio' argument, with at least one of
+    each.  Returns the number of readers and the number of writers.
+    """
+    writers = max(int(round(args['concurrent_users'] * args['write_ratio'])), 1)
+    return max(args['concurrent_users'] - writers, 1), writers
+
+
+def build(writes_dataframe, tables_dataframe, catalog, engine, args):
+    """
+    Expands every write template against every table, seeded like workload.build so the same seed writes the same
+    columns on every database.  Templates are formatted with the query_builder dictionary and the '--write-batch-size'
+    argument as 'batch_size'.  Returns the write workload DataFrame joined with the 'tables_dataframe' parameter.
+    """
+    write_list = []
+    for table_index, table_row in tables_dataframe.iterrows():
+        datatypes_dataframe = catalog.datatypes(engine, table_row['table_name'])
+        datatypes_dataframe = datatypes_dataframe[['column_name', 'data_type']].astype(str).sort_values('column_name')
+        for write_index, write_row in writes_dataframe.iterrows():
+            rng = random.Random(str(args['seed']) + ':' + table_row['table_name'] + ':write:' +
+                                str(write_row['query_id']))
+            try:
+                write_builder_dict = benchmark.query_builder(table_row['table_name'], datatypes_dataframe,
+                                                             args['write_batch_size'], rng)
+                write_builder_dict['batch_size'] = str(args['write_batch_size'])
+                query_executed = write_row['query_template'].format(**write_builder_dict)
+            except Exception as error:
+                logging.error("Unable to build write " + str(write_row['query_id']) + " for table " +
+                              table_row['table_name'] + ":  " + str(error))
+                continue
+            write_dict = write_row.to_dict()
+            write_dict.update({'table_name': table_row['table_name'], 'query_executed': query_executed})
+            write_list.append(write_dict)
+    return pandas.DataFrame(write_list).merge(tables_dataframe, on='table_name')
+
+
+def execute_statements(engine, statements, **kwargs):
+    """
+    Executes a statement or a list of statements formatted with 'kwargs' in a single transaction.
+    """
+    with engine.begin() as connection:
+        for statement in [statements] if isinstance(statements, str) else statements:
+            connection.execute(statement.format(**kwargs))
+
+
+def snapshot_name(table_name):
+    """
+    Returns the name of the copy of a table, short enough for the identifier limits of every database.
+    """
+    return 'SNAPSHOT_' + hashlib.sha1(table_name.encode('utf-8')).hexdigest()[:12].upper()
+
+
+def snapshot(engine, attributes, table_names):
+    """
+    Copies every table written by the mixed mode with the 'snapshot_query' of the database.  A copy left behind by an
+    interrupted run is restored first, so the table is always copied in its original state.
+    """
+    for table_name in table_names:
+        name = snapshot_name(table_name)
+        with engine.connect() as connection:
+            exists = engine.dialect.has_table(connection, name)
+        if exists:
+            logging.warning("Restoring " + table_name + " from the snapshot of an interrupted run:  " + name)
+            restore(engine, attributes, [table_name])
+        logging.info("Copying table " + table_name + " to " + name)
+        execute_statements(engine, attributes.get('snapshot_query', SNAPSHOT_QUERY), table_name=table_name,
+                           snapshot=name)
+
+
+def restore(engine, attributes, table_names):
+    """
+    Restores every table from its copy with the 'restore_query' of the database, which also drops the copy.
+    """
+    for table_name in table_names:
+        logging.info("Restoring table " + table_name + " from " + snapshot_name(table_name))
+        execute_statements(engine, attributes.get('restore_query', RESTORE_QUERY), table_name=table_name,
+                           snapshot=snapshot_name(table_name))
+
+
+class MixedSink:
+    """
+    A sink tagging every record with the workload mode and the 'concurrency_factor' of the phase, the total number of
+    readers and writers running, and keeping the status, time and rows of every record for the report before passing
+    it on to the 'sink' parameter.
+    """
+    def __init__(self, sink, workload_mode, concurrency_factor):
+        self.sink = sink
+        self.workload_mode = workload_mode
+        self.concurrency_factor = concurrency_factor
+        self.summaries = []
+        self.lock = Lock()
+
+    def put(self, record):
+        record['workload_mode'] = self.workload_mode
+        record['concurrency_factor'] = self.concurrency_factor
+        record.setdefault('operation', 'read')
+        with self.lock:
+            self.summaries.append({'operation': record['operation'], 'category': record.get('category'),
+                                   'status': record.get('status'), 'time': record.get('time'),
+                                   'rows': record.get('rows')})
+        self.sink.put(record)
+
+
+def write(write_dataframe, attributes, sink, args, stop):
+    """
+    Executes the write workload round robin until the 'stop' event is set, every statement in its own transaction on
+    the connection of this writer, starting at a different offset in every writer and waiting the optional think time
+    after every statement.  Puts a record of every execution on the 'sink' parameter, with the number of rows written.
+    """
+    engine = create_engine(attributes['connection_string'])
+    connection = engine.connect()
+    write_rows = [write_row for write_index, write_row in write_dataframe.iterrows()]
+    position = int(current_thread().name.rsplit('#', 1)[-1])
+    try:
+        while not stop.is_set():
+            write_row = write_rows[position % len(write_rows)]
+            position += 1
+            record = write_row.to_dict()
+            record.update({'operation': 'write', 'status': 'ok', 'error': '', 'rows': float('nan'),
+                           'timeout': benchmark.query_timeout(record, args), 'connection_mode': 'warm',
+                           'thread': current_thread().name})
+            record['started_at'] = time.time()
+            try:
+                with benchmark.Deadline(connection, record['timeout']), benchmark.Timer() as t:
+                    with connection.begin():
+                        rowcount = connection.execute(record['query_executed']).rowcount
+                record.update({'time': t.interval, 'rows': rowcount if rowcount >= 0 else float('nan')})
+            except Exception as error:
+                status = 'timeout' if isinstance(error, benchmark.TimeoutException) else 'error'
+                record.update({'status': status, 'error': str(error), 'time': time.time() - record['started_at']})
+                logging.error("Write " + status + "!  " + 'Table: ' + record['table_name'] + " Write " +
+                              str(record['query_id']) + ":  " + str(error))
+            record['finished_at'] = time.time()
+            sink.put(record)
+            if args['think_time']:
+                stop.wait(random.expovariate(1.0 / args['think_time']))
+    finally:
+        connection.close()
+        engine.dispose()
+
+
+def report(database, read_only, mixed, readers, writers, seconds, filepath=None, run_id=None):
+    """
+    Compares the read latency of every query category without and with the concurrent writes, and reports the
+    throughput of every write category during the mixed phase of 'seconds' seconds.  The report is logged, appended to
+    the optional 'filepath' CSV file and returned as a DataFrame.
+    """
+    columns = ['operation', 'category', 'status', 'time', 'rows']
+    read_only_dataframe = pandas.DataFrame(read_only.summaries, columns=columns)
+    mixed_dataframe = pandas.DataFrame(mixed.summaries, columns=columns)
+    report_list = []
+    for (operation, category), category_dataframe in mixed_dataframe.groupby(['operation', 'category'], sort=True):
+        succeeded = category_dataframe[category_dataframe['status'] == 'ok']
+        row = {'database': database, 'operation': operation, 'category': category,
+               'users': readers if operation == 'read' else writers, 'queries': len(category_dataframe.index),
+               'errors': len(category_dataframe.index) - len(succeeded.index), 'seconds': seconds,
+               'mixed_p50': succeeded['time'].quantile(0.5), 'mixed_p99': succeeded['time'].quantile(0.99)}
+        if operation == 'read':
+            baseline = read_only_dataframe[(read_only_dataframe['category'] == category) &
+                                           (read_only_dataframe['status'] == 'ok')]
+            row.update({'read_only_p50': baseline['time'].quantile(0.5),
+                        'read_only_p99': baseline['time'].quantile(0.99)})
+            row['degradation'] = row['mixed_p50'] / row['read_only_p50'] if row['read_only_p50'] else float('nan')
+        else:
+            row.update({'throughput': len(succeeded.index) / seconds if seconds else 0.0,
+                        'rows_per_sec': succeeded['rows'].sum() / seconds if seconds else 0.0})
+        report_list.append(row)
+    report_dataframe = pandas.DataFrame(report_list, columns=MIXED_COLUMNS)
+    logging.info("Read latency in seconds without and with " + str(writers) + " writers, and write throughput in "
+                 "statements/sec and rows/sec of " + database + ":\n" + report_dataframe.to_string(index=False))
+    if filepath:
+        report_dataframe.insert(0, 'run_id', run_id)
+        report_dataframe.to_csv(filepath, index=False, mode='a', header=not os.path.isfile(filepath))
+    return report_dataframe
+
+
+def run(database, run_reads, write_dataframe, engine, attributes, sink, args, run_id=None, filepath=None):
+    """
+    Benchmarks a database under concurrent writes.  'run_reads' benchmarks the read workload with the given sink and
+    arguments, first alone with the readers of the users function, then again while the writers execute the write
+    workload until the readers finish.  Records are tagged with the 'read-only' or 'mixed' workload mode and the 'read'
+    or 'write' operation, and with the number of users running in their phase.  The written tables are copied before the writes and restored afterwards, unless they are
+    dropped after the run.  Returns the report DataFrame of the report function.
+    """
+    readers, writers = users(args)
+    read_args = dict(args, concurrent_users=readers)
+    logging.info("Read-only phase of " + database + " with " + str(readers) + " readers")
+    read_only = MixedSink(sink, 'read-only', readers)
+    run_reads(read_only, read_args)
+
+    table_names = sorted(write_dataframe['table_name'].unique())
+    if not args['drop_tables']:
+        snapshot(engine, attributes, table_names)
+    try:
+        logging.info("Mixed phase of " + database + " with " + str(readers) + " readers and " + str(writers) +
+                     " writers")
+        mixed = MixedSink(sink, 'mixed', readers + writers)
+        stop = Event()
+        thread_list = [Thread(name=database + ' writer #' + str(thread_number+1), target=write,
+                              args=(write_dataframe, attributes, mixed, args, stop))
+                       for thread_number in range(writers)]
+        with benchmark.Timer() as t:
+            [thread.start() for thread in thread_list]
+            try:
+                run_reads(mixed, read_args)
+            finally:
+                stop.set()
+                [thread.join() for thread in thread_list]
+    finally:
+        if not args['drop_tables']:
+            restore(engine, attributes, table_names)
+    return report(database, read_only, mixed, readers, writers, t.interval, filepath, run_id)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+import time
+import logging
+from threading import Thread, Event, Lock
+try:
+    import psutil
+except ImportError:  # psutil is optional, the client is not profiled without it
+    psutil = None
+
+
+PROFILE_INTERVAL = 1.0  # seconds between two samples
+CPU_THRESHOLD = 90.0  # percent of the CPUs of the host, or of one CPU for a single process
+MEMORY_THRESHOLD = 90.0  # percent of the physical memory of the host
+
+
+class Profiler:
+    """
+    A background sampler of the resources used by the benchmarking client.  Every 'interval' seconds the CPU, resident
+    memory, threads and open connections of this process and of every worker, query and loader process it started are
+    appended to the 'filepath' JSON lines file, timestamped with time.time(), the same clock as the 'started_at' and
+    'finished_at' of the result records.  A window between two samples is saturated when the CPUs of the host are busier
+    than 'cpu_threshold' percent, when a single process uses one CPU at 'cpu_threshold' percent or more, or when the
+    memory used is above 'memory_threshold' percent.  Results measured during a saturated window are marked as suspect.
+    """
+    def __init__(self, filepath, run_id, interval=PROFILE_INTERVAL, cpu_threshold=CPU_THRESHOLD,
+                 memory_threshold=MEMORY_THRESHOLD):
+        self.filepath = filepath
+        self.run_id = run_id
+        self.interval = interval
+        self.cpu_threshold = cpu_threshold
+        self.memory_threshold = memory_threshold
+        self.process = psutil.Process()
+        self.processes = {}  # cpu_percent is measured since the previous call on the same psutil.Process
+        self.windows = []  # (start, end) of every saturated window
+        self.samples = 0
+        self.sampled = time.time()  # end of the last window sampled
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = Thread(name='profiler', target=self.run, daemon=True)
+
+    def start(self):
+        psutil.cpu_percent()  # the first call only starts the measurement
+        self.sampled = time.time()
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as error:
+                logging.warning("Unable to profile the client:  " + str(error))
+
+    def sample(self):
+        """
+        Samples every process of the client and the host, writing a line per process and recording the window since
+        the previous sample when it is saturated.
+        """
+        processes = {}
+        for process in [self.process] + self.process.children(recursive=True):
+            processes[process.pid] = self.processes.get(process.pid, process)
+        self.processes = processes
+        host_cpu_percent = psutil.cpu_percent()
+        host_memory_percent = psutil.virtual_memory().percent
+        now = time.time()
+        lines = []
+        for pid, process in processes.items():
+            try:
+                with process.oneshot():
+                    connections = getattr(process, 'net_connections', process.connections)  # renamed in psutil 6
+                    lines.append({'run_id': self.run_id, 'timestamp': now, 'window_start': self.sampled, 'pid': pid,
+                                  'role': 'controller' if pid == self.process.pid else 'worker',
+                                  'cpu_percent': process.cpu_percent(), 'rss': process.memory_info().rss,
+                                  'threads': process.num_threads(), 'connections': len(connections(kind='inet')),
+                                  'host_cpu_percent': host_cpu_percent, 'host_memory_percent': host_memory_percent})
+            except (psutil.NoSuchProcess, psutil.AccessDenied):  # query processes exit between two samples
+                continue
+        saturated = host_cpu_percent >= self.cpu_threshold or host_memory_percent >= self.memory_threshold or \
+            any(line['cpu_percent'] >= self.cpu_threshold for line in lines)
+        with open(self.filepath, 'a') as f:
+            f.write(''.join(json.dumps(dict(line, saturated=int(saturated))) + '\n' for line in lines))
+        with self.lock:
+            if saturated:
+                logging.warning("Client saturated:  host CPU " + str(host_cpu_percent) + "%, host memory " +
+                                str(host_memory_percent) + "%, busiest process CPU " +
+                                str(max([line['cpu_percent'] for line in lines] or [0.0])) + "%")
+                self.windows.append((self.sampled, now))
+            self.samples += 1
+            self.sampled = now
+
+    def suspect(self, started_at, finished_at):
+        """
+        Returns whether an execution between the 'started_at' and 'finished_at' times overlaps a saturated window.
+        """
+        with self.lock:
+            return any(start < finished_at and end > started_at for start, end in self.windows)
+
+    def annotate(self, dataframe):
+        """
+        Sets the 'suspect' column of a batch of results, waiting for at most two intervals until the profiler has
+        sampled past the end of the latest execution of the batch.  Records without execution times are not suspect.
+        """
+        if 'started_at' not in dataframe.columns or 'finished_at' not in dataframe.columns:
+            return dataframe
+        latest = dataframe['finished_at'].max()
+        deadline = time.time() + 2 * self.interval
+        while self.thread.is_alive() and self.sampled < latest and time.time() < deadline:
+            time.sleep(self.interval / 10.0)
+        dataframe['suspect'] = [float(self.suspect(started_at, finished_at))
+                                if started_at == started_at and finished_at == finished_at else 0.0  # not NaN
+                                for started_at, finished_at in zip(dataframe['started_at'], dataframe['finished_at'])]
+        return dataframe
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        logging.info("Client saturated during " + str(len(self.windows)) + " of " + str(self.samples) +
+                     " profiled windows, see:  " + self.filepath)
+
+
+def start(filepath, run_id, args):
+    """
+    Starts a profiler with the '--profile-interval', '--cpu-threshold' and '--memory-threshold' arguments, returning
+    None when profiling is disabled or psutil is not installed.
+    """
+    if not args['profile_interval']:
+        return None
+    if psutil is None:
+        logging.warning("psutil is not installed, the client resources are not profiled")
+        return None
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    return Profiler(filepath, run_id, args['profile_interval'], args['cpu_threshold'], args['memory_threshold']).start()
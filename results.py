@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+
+import os
+import glob
+import json
+import time
+import queue
+import sqlite3
+import logging
+import pandas
+from datetime import datetime, timezone
+from threading import Thread, Event
+import tracing
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional, the SQLite store is used without it
+    pyarrow = None
+
+
+SCHEMA_VERSION = 1  # incremented whenever the meaning of an existing column changes
+
+# Data type of every known results column.  Unknown columns are stored as 'float' when numeric, otherwise as 'str'.
+SCHEMA = {
+    'run_id': 'str', 'schema_version': 'int', 'timestamp': 'str', 'database': 'str', 'query_id': 'int',
+    'category': 'str', 'name': 'str', 'query_template': 'str', 'query_executed': 'str', 'table_name': 'str',
+    'table_row_count': 'float', 'table_size_category': 'str', 'concurrency_factor': 'int', 'iteration': 'float',
+    'thread': 'str', 'connection_mode': 'str', 'fetch_mode': 'str', 'rows': 'float', 'time': 'float',
+    'connect_time': 'float', 'first_row_time': 'float', 'fetch_time': 'float', 'bytes': 'float',
+    'phase': 'str', 'arrival': 'str', 'target_qps': 'float', 'scheduled': 'float', 'started': 'float',
+    'finished': 'float', 'queue_delay': 'float', 'error': 'str', 'plan': 'str', 'plan_hash': 'str',
+    'server_elapsed_time': 'float', 'server_cpu_time': 'float', 'client_time': 'float', 'workload_id': 'str',
+    'repetition': 'float', 'converged': 'float', 'outlier': 'float', 'agent': 'str', 'started_at': 'float',
+    'finished_at': 'float', 'suspect': 'float', 'table_family': 'str', 'status': 'str', 'timeout': 'float',
+    'workload_mode': 'str', 'operation': 'str', 'cache_state': 'str', 'executed_at': 'float',
+}
+
+# Columns of the original results CSV file, read by the dashboard
+CSV_COLUMNS = ['category', 'concurrency_factor', 'database', 'name', 'query_executed', 'query_id', 'query_template',
+               'rows', 'table_name', 'table_row_count', 'table_size_category', 'time', 'cache_state', 'operation',
+               'workload_mode']
+
+
+def succeeded(dataframe, writes=False, mixed=False):
+    """
+    Returns the results of the successful executions.  Errors, timeouts and skipped queries are recorded with their
+    real elapsed time, or none, and would distort the averages.  Results saved before the 'status' column existed
+    recorded every failure as a 'Timeout!' query.  The write statements and the reads slowed down by the concurrent
+    writes of the mixed mode are excluded as well, unless 'writes' or 'mixed' is given.
+    """
+    keep = pandas.Series(True, index=dataframe.index)
+    if 'status' in dataframe.columns:
+        keep &= dataframe['status'].fillna('ok') == 'ok'
+    if 'operation' in dataframe.columns and not writes:
+        keep &= dataframe['operation'] != 'write'
+    if 'workload_mode' in dataframe.columns and not mixed:
+        keep &= dataframe['workload_mode'] != 'mixed'
+    if 'query_executed' in dataframe.columns:
+        keep &= dataframe['query_executed'] != 'Timeout!'
+    return dataframe[keep]
+
+
+def default_format():
+    return 'parquet' if pyarrow else 'sqlite'
+
+
+def store_path(path, results_format):
+    """
+    Returns the path of the results store, a directory of Parquet files partitioned by run id or a SQLite file.
+    """
+    return path if results_format == 'parquet' else path + '.sqlite'
+
+
+def normalize(records):
+    """
+    Builds a DataFrame from a batch of result records, casting every column to its data type in SCHEMA so that the
+    batches of every run share the same schema.
+    """
+    dataframe = pandas.DataFrame(records)
+    for column in dataframe.columns:
+        kind = SCHEMA.get(column)
+        if kind is None:
+            kind = 'float' if pandas.to_numeric(dataframe[column], errors='coerce').notnull().sum() == \
+                dataframe[column].notnull().sum() else 'str'
+        if kind == 'str':
+            dataframe[column] = dataframe[column].where(dataframe[column].isnull(), dataframe[column].astype(str))
+        elif kind == 'int':
+            dataframe[column] = dataframe[column].astype('int64')
+        else:
+            dataframe[column] = pandas.to_numeric(dataframe[column], errors='coerce').astype('float64')
+    return dataframe
+
+
+def write_parquet(path, dataframe, run_id, part):
+    directory = os.path.join(path, 'run_id=' + run_id)
+    os.makedirs(directory, exist_ok=True)
+    table = pyarrow.Table.from_pandas(dataframe, preserve_index=False)
+    pyarrow.parquet.write_table(table, os.path.join(directory, 'part-{:05d}.parquet'.format(part)))
+
+
+def write_sqlite(path, dataframe):
+    connection = sqlite3.connect(path, timeout=60)
+    try:
+        existing = [row[1] for row in connection.execute('PRAGMA table_info("results")')]
+        if not existing:
+            connection.execute('CREATE TABLE "results" ("run_id" TEXT)')
+            connection.execute('CREATE INDEX "results_run_id" ON "results" ("run_id")')
+            existing = ['run_id']
+        for column in dataframe.columns:
+            if column not in existing:
+                sqlite_type = {'object': 'TEXT', 'int64': 'INTEGER'}.get(str(dataframe[column].dtype), 'REAL')
+                connection.execute('ALTER TABLE "results" ADD COLUMN "' + column + '" ' + sqlite_type)
+        sql = 'INSERT INTO "results" ("' + '", "'.join(dataframe.columns) + '") VALUES (' + \
+              ', '.join('?' * len(dataframe.columns)) + ')'
+        connection.executemany(sql, dataframe.astype(object).where(pandas.notnull(dataframe), None).values.tolist())
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class ResultsSink:
+    """
+    A thread-safe sink for result records.  Benchmark threads put records on a queue and a single writer thread
+    batches them into the columnar results store, tagging every record with the run id and the schema version, so no
+    thread ever writes to the store concurrently.  When a 'live_filepath' is given, every batch written is also
+    published as JSON lines to that file, which the dashboard tails in live mode.  When an 'annotate' function is
+    given, such as profiler.Profiler.annotate, every batch is passed through it before it is written.
+    """
+    def __init__(self, path, run_id, results_format=None, batch_size=1000, flush_interval=5.0, live_filepath=None,
+                 annotate=None):
+        self.results_format = results_format or default_format()
+        self.path = store_path(path, self.results_format)
+        self.live_filepath = live_filepath
+        self.annotate = annotate
+        self.run_id = run_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.part = len(glob.glob(os.path.join(self.path, 'run_id=' + run_id, '*.parquet')))
+        self.queue = queue.Queue()
+        self.writer = Thread(name='results writer', target=self.write, daemon=True)
+        self.writer.start()
+
+    def put(self, record):
+        record = dict(record)
+        record['run_id'] = self.run_id
+        record['schema_version'] = SCHEMA_VERSION
+        record.setdefault('timestamp', datetime.now(timezone.utc).isoformat())
+        self.queue.put(record)
+
+    def flush(self, records):
+        if not records:
+            return
+        with tracing.span('write', records=len(records)):
+            dataframe = normalize(records)
+            if self.annotate:
+                dataframe = self.annotate(dataframe)
+            if self.results_format == 'parquet':
+                write_parquet(self.path, dataframe, self.run_id, self.part)
+                self.part += 1
+            else:
+                write_sqlite(self.path, dataframe)
+            if self.live_filepath:
+                publish(self.live_filepath, dataframe)
+
+    def write(self):
+        records = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                record = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                record = False  # flush interval elapsed
+            synced = record if isinstance(record, Event) else None
+            if record and not synced:
+                records.append(record)
+            if record is None or synced or len(records) >= self.batch_size or time.monotonic() >= deadline:
+                try:
+                    self.flush(records)
+                except Exception as error:
+                    logging.error("Unable to write " + str(len(records)) + " results:  " + str(error))
+                records = []
+                deadline = time.monotonic() + self.flush_interval
+            if synced:
+                synced.set()
+            if record is None:
+                return
+
+    def sync(self):
+        """
+        Blocks until every record put so far is written.
+        """
+        synced = Event()
+        self.queue.put(synced)
+        synced.wait()
+
+    def close(self):
+        """
+        Writes the remaining records and stops the writer thread.
+        """
+        self.queue.put(None)
+        self.writer.join()
+
+
+class QueueSink:
+    """
+    A sink for result records put by another process.  Records are timestamped and put on a multiprocessing queue, and
+    the forward function moves them to the ResultsSink of the process owning the results store.
+    """
+    def __init__(self, record_queue):
+        self.queue = record_queue
+
+    def put(self, record):
+        record = dict(record)
+        record['timestamp'] = datetime.now(timezone.utc).isoformat()
+        self.queue.put(record)
+
+
+def forward(record_queue, sink):
+    """
+    Puts every record of the queue on the sink until a None record is received.
+    """
+    for record in iter(record_queue.get, None):
+        sink.put(record)
+
+
+def publish(filepath, dataframe):
+    """
+    Appends a batch of results to a live feed file as JSON lines.  Each batch is written with a single write call so
+    a reader never sees a partial batch other than an incomplete last line.
+    """
+    lines = ''.join(json.dumps({column: (None if pandas.isnull(value) else value) for column, value in record.items()})
+                    + '\n' for record in dataframe.astype(object).to_dict(orient='records'))
+    with open(filepath, 'a') as f:
+        f.write(lines)
+
+
+def tail(filepath, offset=0, max_rows=None):
+    """
+    Reads at most 'max_rows' complete JSON lines of a live feed file starting at the byte 'offset'.  Returns a
+    DataFrame of the records read and the offset following the last complete line read.
+    """
+    records = []
+    if not os.path.isfile(filepath):
+        return pandas.DataFrame(), offset
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        while max_rows is None or len(records) < max_rows:
+            line = f.readline()
+            if not line.endswith(b'\n'):  # end of file or a line still being written
+                break
+            offset += len(line)
+            records.append(json.loads(line.decode('utf-8')))
+    return pandas.DataFrame(records), offset
+
+
+def runs(path, results_format=None):
+    """
+    Returns the list of run ids in the results store.
+    """
+    results_format = results_format or default_format()
+    path = store_path(path, results_format)
+    if results_format == 'parquet':
+        return sorted(os.path.basename(directory)[len('run_id='):]
+                      for directory in glob.glob(os.path.join(path, 'run_id=*')))
+    if not os.path.isfile(path):
+        return []
+    connection = sqlite3.connect(path)
+    try:
+        return [row[0] for row in connection.execute('SELECT DISTINCT "run_id" FROM "results" ORDER BY 1')]
+    finally:
+        connection.close()
+
+
+def read(path, columns=None, run_ids=None, results_format=None):
+    """
+    Reads the results store into a DataFrame, only reading the given 'columns' and the files or rows of the given
+    'run_ids'.  Columns missing from a run are filled with NaN.
+    """
+    results_format = results_format or default_format()
+    run_ids = run_ids or runs(path, results_format)
+    path = store_path(path, results_format)
+    if not os.path.exists(path):
+        return pandas.DataFrame(columns=columns)
+    if results_format == 'parquet':
+        dataframes = []
+        for run_id in run_ids:
+            for filepath in sorted(glob.glob(os.path.join(path, 'run_id=' + run_id, '*.parquet'))):
+                names = pyarrow.parquet.ParquetFile(filepath).schema.names
+                dataframes.append(pyarrow.parquet.read_table(
+                    filepath, columns=[column for column in columns if column in names] if columns else None).to_pandas())
+        dataframe = pandas.concat(dataframes, ignore_index=True) if dataframes else pandas.DataFrame()
+    else:
+        connection = sqlite3.connect(path)
+        try:
+            existing = [row[1] for row in connection.execute('PRAGMA table_info("results")')]
+            selected = [column for column in columns if column in existing] if columns else existing
+            sql = 'SELECT "' + '", "'.join(selected) + '" FROM "results" WHERE "run_id" IN (' + \
+                  ', '.join('?' * len(run_ids)) + ')'
+            dataframe = pandas.read_sql_query(sql, connection, params=list(run_ids)) if run_ids and selected \
+                else pandas.DataFrame()
+        finally:
+            connection.close()
+    return dataframe.reindex(columns=columns) if columns else dataframe
+
+
+def export_csv(path, csv_filepath, run_ids=None, results_format=None):
+    """
+    Exports the results of the given 'run_ids' to a CSV file.  When the CSV file already exists with a different
+    header, it is rewritten with the union of both headers so its rows stay aligned with their columns.
+    """
+    dataframe = read(path, run_ids=run_ids, results_format=results_format)
+    if dataframe.empty:
+        return
+    if os.path.isfile(csv_filepath):
+        header = list(pandas.read_csv(csv_filepath, nrows=0).columns)
+        if set(dataframe.columns) - set(header):
+            dataframe = pandas.concat([pandas.read_csv(csv_filepath, low_memory=False), dataframe], ignore_index=True)
+            dataframe.to_csv(csv_filepath, index=False)
+            return
+        dataframe = dataframe.reindex(columns=header)
+    dataframe.to_csv(csv_filepath, index=False, mode='a', header=not os.path.isfile(csv_filepath))
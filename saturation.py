@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+
+import os
+import logging
+import pandas
+from threading import Lock
+import histogram
+
+
+LEVEL_COLUMNS = ['database', 'concurrency_factor', 'queries', 'errors', 'error_rate', 'seconds', 'throughput',
+                 'p50', 'p99', 'knee']
+
+
+def failed(record):
+    """
+    Returns whether the result record of an execution is an error or a timeout.
+    """
+    return record.get('status') in ['error', 'timeout']
+
+
+class CountingSink:
+    """
+    A sink counting the records and the failed executions put on it before passing them on to the 'sink' parameter.
+    The start and end times of the successful executions of every thread are kept to find the steady window of the
+    level, when every thread was executing queries.
+    """
+    def __init__(self, sink):
+        self.sink = sink
+        self.records = 0
+        self.errors = 0
+        self.executions = {}
+        self.lock = Lock()
+
+    def put(self, record):
+        with self.lock:
+            self.records += 1
+            self.errors += failed(record)
+            if record.get('status') == 'ok' and record.get('executed_at') is not None:
+                thread = (record.get('agent'), record.get('thread'))
+                self.executions.setdefault(thread, []).append((record['executed_at'],
+                                                               record['executed_at'] + record['time']))
+        self.sink.put(record)
+
+    def steady_throughput(self):
+        """
+        Returns the number of successful executions per second within the steady window, from the first execution of
+        the last thread to start to the end of the last execution of the first thread to finish, and the length of
+        the window in seconds.  The ramp up and tail of the threads starting and finishing at different times are
+        excluded, as fewer threads than the level were running.  Returns None when the threads never ran together.
+        """
+        with self.lock:
+            executions = [execution for thread_executions in self.executions.values() for execution in thread_executions]
+            if not executions:
+                return None
+            window_start = max(min(started for started, ended in thread_executions)
+                               for thread_executions in self.executions.values())
+            window_end = min(max(ended for started, ended in thread_executions)
+                             for thread_executions in self.executions.values())
+        count = sum(1 for started, ended in executions if started >= window_start and ended <= window_end)
+        if window_end <= window_start or not count:
+            return None
+        return count / (window_end - window_start), window_end - window_start
+
+
+def measure(database, run, sink, args, level, run_id, histograms_filepath):
+    """
+    Benchmarks a concurrency level by calling 'run' with a copy of the arguments having 'level' concurrent users,
+    returning the throughput of the successful queries in queries per second, the p50 and p99 execution times in
+    seconds and the error rate of the level.  The throughput is measured over the steady window of the level, when
+    every thread was executing, or over the whole benchmark time when the threads never ran together.  The histograms
+    of the level are saved with the other runs.
+    """
+    level_args = dict(args, concurrent_users=level)
+    counting_sink = CountingSink(sink)
+    histograms, seconds = run(counting_sink, level_args)
+    histogram.save(histograms_filepath, histograms, seconds, run_id)
+    merged = histogram.Histogram()
+    [merged.merge(level_histogram) for level_histogram in histograms.values()]
+    steady = counting_sink.steady_throughput()
+    if steady:
+        throughput, steady_seconds = steady
+        logging.info(database + " at " + str(level) + " users:  steady window of " + '{:f} sec'.format(steady_seconds) +
+                     " of " + '{:f} sec'.format(seconds))
+    else:
+        throughput = merged.count / seconds if seconds else 0.0
+    row = {'database': database, 'concurrency_factor': level, 'queries': counting_sink.records,
+           'errors': counting_sink.errors, 'error_rate': counting_sink.errors / max(counting_sink.records, 1),
+           'seconds': seconds, 'throughput': throughput,
+           'p50': merged.percentile(50), 'p99': merged.percentile(99), 'knee': 0}
+    logging.info(database + " at " + str(level) + " users:  " + '{:.2f} queries/sec, p99 {:f} sec, {:.1%} errors'.format(
+        row['throughput'], row['p99'], row['error_rate']))
+    return row
+
+
+def saturated(previous, current, args):
+    """
+    Returns why the concurrency curve stopped scaling between two levels:  'plateau' when the throughput gained less
+    than 'knee_gain' of the throughput of the 'previous' level, 'latency' when the p99 execution time rose more than
+    'knee_latency' times, otherwise None.
+    """
+    if current['throughput'] < previous['throughput'] * (1 + args['knee_gain']):
+        return 'plateau'
+    if current['p99'] > previous['p99'] * args['knee_latency']:
+        return 'latency'
+    return None
+
+
+def search(database, run, sink, args, run_id, histograms_filepath, filepath=None):
+    """
+    Searches the knee of the concurrency curve of a database, the lowest number of concurrent users reaching the
+    throughput plateau.  The number of users is multiplied by 'search_factor' at every step until the throughput stops
+    rising, the p99 rises sharply, the error rate exceeds 'max_error_rate' or 'search_max_users' is reached.  The knee
+    is the lowest level within 'knee_gain' of the highest throughput, excluding the level that stopped the search on
+    latency or errors, and the interval below it is bisected 'bisect_steps' times.  'run' benchmarks the database with
+    the given sink and arguments and returns the merged histograms and the benchmark time.  Every level is logged,
+    appended to the optional 'filepath' CSV file and returned as a DataFrame in which the knee is flagged.
+    """
+    levels = {}
+    level = 1
+    previous = None
+    reason = None
+    while level <= args['search_max_users']:
+        levels[level] = measure(database, run, sink, args, level, run_id, histograms_filepath)
+        if levels[level]['error_rate'] > args['max_error_rate']:
+            reason = 'errors'
+        elif previous:
+            reason = saturated(levels[previous], levels[level], args)
+        if reason:
+            logging.info(database + " stopped scaling at " + str(level) + " users:  " + reason)
+            break
+        previous = level
+        level = max(int(level * args['search_factor']), level + 1)
+    if not reason:
+        logging.warning(database + " throughput was still rising at " + str(previous) + " users, the maximum searched")
+
+    candidates = sorted(candidate for candidate in levels if reason not in ['errors', 'latency'] or candidate != level)
+    plateau = max([levels[candidate]['throughput'] for candidate in candidates] or [0.0])
+
+    def reached(row):
+        return row['error_rate'] <= args['max_error_rate'] and row['throughput'] >= plateau * (1 - args['knee_gain'])
+
+    knee = min([candidate for candidate in candidates if reached(levels[candidate])] or [min(levels)])
+    lower = max([candidate for candidate in candidates if candidate < knee] or [0])
+    for step in range(args['bisect_steps']):
+        if knee - lower <= 1:
+            break
+        middle = (lower + knee) // 2
+        levels[middle] = measure(database, run, sink, args, middle, run_id, histograms_filepath)
+        if reached(levels[middle]):
+            knee = middle
+        else:
+            lower = middle
+
+    levels[knee]['knee'] = 1
+    levels_dataframe = pandas.DataFrame([levels[level] for level in sorted(levels)], columns=LEVEL_COLUMNS)
+    logging.info("Concurrency levels of " + database + ":\n" + levels_dataframe.to_string(index=False))
+    logging.info(database + " knee:  " + str(knee) + " users, " + '{:.2f} queries/sec, p99 {:f} sec'.format(
+        levels[knee]['throughput'], levels[knee]['p99']))
+    if filepath:
+        levels_dataframe.insert(0, 'run_id', run_id)
+        levels_dataframe.to_csv(filepath, index=False, mode='a', header=not os.path.isfile(filepath))
+    return levels_dataframe
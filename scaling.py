@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+
+import os
+import re
+import logging
+import numpy
+import pandas
+import results
+
+
+TARGET_ROWS = 1000000000  # table size at which the fitted latency is extrapolated
+
+# Scaling models of the execution time t of a query against the number of rows n, each fitted as t = a + b * f(n)
+MODELS = {
+    'log n': numpy.log,
+    'sqrt n': numpy.sqrt,
+    'n': lambda n: n,
+    'n log n': lambda n: n * numpy.log(n),
+}
+
+SCALING_COLUMNS = ['database', 'table_family', 'query_id', 'name', 'sizes', 'min_rows', 'max_rows', 'exponent',
+                   'model', 'r2', 'target_rows', 'predicted_time']
+
+
+def family(table_name):
+    """
+    Returns the name of the family of a table, the table name without the scale factor suffix of the synthetic
+    tables, so 'Sales_SF0_1', 'Sales_SF1' and 'Sales_SF10' are the same table at three sizes.
+    """
+    return re.sub(r'_SF[0-9_]+$', '', table_name)
+
+
+def fit_model(rows, times, function):
+    """
+    Fits t = a + b * f(n) by least squares, returning the coefficients and the residual sum of squares, or None when
+    the fitted time decreases with the number of rows.
+    """
+    design = numpy.column_stack([numpy.ones(len(rows)), function(rows)])
+    coefficients = numpy.linalg.lstsq(design, times, rcond=-1)[0]
+    if coefficients[1] < 0:
+        return None
+    return coefficients, float(((design.dot(coefficients) - times) ** 2).sum())
+
+
+def fit(rows, times, target_rows=TARGET_ROWS):
+    """
+    Fits the scaling of the execution times against the numbers of rows.  The exponent is the slope of the power law
+    t = c * n^k fitted in log-log space, so 1 is linear and below 1 sublinear.  With three sizes or more, the MODELS
+    are also fitted and the one with the lowest residuals is kept to extrapolate the execution time at 'target_rows',
+    otherwise the power law is used.  Returns a dictionary of the exponent, the model, its r2 and the predicted time.
+    """
+    rows = numpy.asarray(rows, dtype=float)
+    times = numpy.asarray(times, dtype=float)
+    slope, intercept = numpy.polyfit(numpy.log(rows), numpy.log(numpy.maximum(times, 1e-9)), 1)
+    fitted = {'exponent': slope, 'model': 'power', 'r2': float('nan'),
+              'predicted_time': float(numpy.exp(intercept) * target_rows ** slope)}
+    if len(rows) < 3:
+        return fitted
+    candidates = {name: fit_model(rows, times, function) for name, function in MODELS.items()}
+    candidates = {name: candidate for name, candidate in candidates.items() if candidate is not None}
+    if not candidates:
+        return fitted
+    model = min(candidates, key=lambda name: candidates[name][1])
+    coefficients, residuals = candidates[model]
+    total = float(((times - times.mean()) ** 2).sum())
+    fitted.update({'model': model, 'r2': 1 - residuals / total if total else float('nan'),
+                   'predicted_time': float(coefficients[0] + coefficients[1] * MODELS[model](float(target_rows)))})
+    return fitted
+
+
+def report(results_dataframe, target_rows=TARGET_ROWS, filepath=None, run_id=None):
+    """
+    Fits the scaling of every query of every database from the median execution time of its successful executions
+    against each size of a table family.  Queries benchmarked against a single size are skipped.  The report is
+    logged, appended to the optional 'filepath' CSV file and returned as a DataFrame.
+    """
+    succeeded = results.succeeded(results_dataframe)
+    medians = succeeded.groupby(['database', 'table_family', 'query_id', 'name', 'table_row_count'])['time'].median()
+    report_list = []
+    for (database, table_family, query_id, name), sizes in medians.groupby(level=[0, 1, 2, 3]):
+        if len(sizes.index) < 2:
+            continue
+        rows = sizes.index.get_level_values('table_row_count')
+        row = {'database': database, 'table_family': table_family, 'query_id': query_id, 'name': name,
+               'sizes': len(sizes.index), 'min_rows': rows.min(), 'max_rows': rows.max(), 'target_rows': target_rows}
+        row.update(fit(rows, sizes.values, target_rows))
+        report_list.append(row)
+    report_dataframe = pandas.DataFrame(report_list, columns=SCALING_COLUMNS)
+    if report_dataframe.empty:
+        logging.warning("No query was benchmarked against two sizes of the same table family")
+        return report_dataframe
+    logging.info("Scaling of the execution time with the number of rows, extrapolated at " + str(target_rows) +
+                 " rows:\n" + report_dataframe.to_string(index=False))
+    if filepath:
+        report_dataframe.insert(0, 'run_id', run_id)
+        report_dataframe.to_csv(filepath, index=False, mode='a', header=not os.path.isfile(filepath))
+    return report_dataframe
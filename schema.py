@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+import logging
+import pandas
+from inflection import underscore
+from sqlalchemy import MetaData, Table, Column, types
+from sqlalchemy.schema import CreateTable
+
+
+CHUNK_SIZE = 1000000  # number of rows held in memory at a time while inferring
+KINDS = ['integer', 'float', 'string']  # a column is widened to the later kind when chunks disagree
+FLOAT_LENGTH = 24  # maximum number of characters of a float64 value formatted as text
+
+
+def chunk_statistics(dataframe):
+    """
+    Returns a dictionary of the kind, the number of non-null values and the maximum width in characters of every
+    column of a DataFrame chunk.
+    """
+    statistics = {}
+    for column in dataframe.columns:
+        series = dataframe[column]
+        count = int(series.count())
+        if series.dtype in ['object']:
+            kind = 'string'
+            length = series.str.len().max() if count else 0
+        elif series.dtype in ['int64']:
+            kind = 'integer'
+            length = max(len(str(series.min())), len(str(series.max())))
+        elif series.dtype in ['float64']:
+            kind = 'float'
+            length = FLOAT_LENGTH
+        else:
+            kind = str(series.dtype)
+            length = 0
+        statistics[column] = {'kind': kind, 'count': count, 'length': int(length)}
+    return statistics
+
+
+def merge(statistics, other):
+    """
+    Merges the statistics of a chunk into the statistics accumulated so far.  Columns only have to agree on their kind
+    within the kinds of the KINDS list, an unsupported kind in any chunk marks the column as unsupported.
+    """
+    for column, stats in other.items():
+        merged = statistics.setdefault(column, {'kind': stats['kind'], 'count': 0, 'length': 0})
+        if merged['kind'] != stats['kind']:
+            if merged['kind'] in KINDS and stats['kind'] in KINDS:
+                merged['kind'] = max(merged['kind'], stats['kind'], key=KINDS.index)
+            else:
+                merged['kind'] = 'unsupported'
+        merged['count'] += stats['count']
+        merged['length'] = max(merged['length'], stats['length'])
+    return statistics
+
+
+def infer(filepath, sample_rows=None, chunksize=CHUNK_SIZE):
+    """
+    Infers a single schema for a CSV file by streaming it once in chunks, or only its first 'sample_rows' rows, and
+    merging the statistics of every chunk.  Columns having more than 90% NaN values and columns of unsupported dtypes
+    are dropped.  Returns a dictionary holding the number of rows read and the list of columns, each having the CSV
+    'header', the table 'column' name, the data 'type' and the maximum 'length' in characters.
+    """
+    statistics = {}
+    rows = 0
+    headers = list(pandas.read_csv(filepath, nrows=0).columns)
+    for dataframe in pandas.read_csv(filepath, low_memory=False, iterator=True, chunksize=chunksize, nrows=sample_rows):
+        rows += len(dataframe.index)
+        merge(statistics, chunk_statistics(dataframe))
+    columns = []
+    for header in headers:
+        column = str.upper(underscore(header))  # camelcase to underscore to uppercase
+        stats = statistics.get(header, {'kind': 'string', 'count': 0, 'length': 0})  # the file has no rows
+        if stats['count'] < rows // 10:  # drop columns having more than 90% NaN values
+            logging.info("Column has more than 90% NaN values.  Dropping column:  " + column)
+        elif stats['kind'] not in KINDS:
+            logging.error(stats['kind'] + " dtype unsupported.  Dropping column:  " + column)
+        else:
+            columns.append({'header': header, 'column': column, 'type': stats['kind'], 'length': max(stats['length'], 1)})
+    return {'rows': rows, 'columns': columns}
+
+
+def cache_filepath(filepath):
+    return filepath + '.schema.json'
+
+
+def load(filepath, sample_rows=None):
+    """
+    Returns the schema of a CSV file from the cache file stored next to it when the size and modification time of the
+    CSV file and the number of sampled rows are unchanged, otherwise infers the schema and writes the cache file.
+    """
+    key = {'size': os.path.getsize(filepath), 'mtime': os.path.getmtime(filepath), 'sample_rows': sample_rows}
+    if os.path.isfile(cache_filepath(filepath)):
+        with open(cache_filepath(filepath), 'r') as f:
+            cached = json.load(f)
+        if all(cached.get(name) == value for name, value in key.items()):
+            logging.info("Using cached schema:  " + cache_filepath(filepath))
+            return cached
+    logging.info("Inferring schema:  " + filepath)
+    inferred = infer(filepath, sample_rows)
+    inferred.update(key)
+    try:
+        with open(cache_filepath(filepath), 'w') as f:
+            json.dump(inferred, f, indent=4)
+    except OSError as error:  # the data directory may be read-only
+        logging.warning("Unable to cache schema:  " + str(error))
+    return inferred
+
+
+def sqlalchemy_type(column):
+    """
+    Maps a column of the inferred schema to a SQLAlchemy data type.
+    """
+    if column['type'] == 'string':
+        return types.String(column['length'])
+    elif column['type'] == 'integer':
+        return types.Integer()
+    return types.Float()
+
+
+def table(table_name, inferred):
+    """
+    Returns a SQLAlchemy Table for the inferred schema.
+    """
+    return Table(table_name, MetaData(), *[Column(column['column'], sqlalchemy_type(column)) for column in inferred['columns']])
+
+
+def create(engine, table_name, inferred):
+    """
+    Creates the table for the inferred schema unless it already exists, logging the DDL.
+    """
+    sql_table = table(table_name, inferred)
+    logging.info(str(CreateTable(sql_table).compile(engine)).strip())
+    sql_table.create(engine, checkfirst=True)
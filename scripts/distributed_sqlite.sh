@@ -0,0 +1,24 @@
+#!/bin/sh -e
+
+# Benchmarks the SQLite database of config.json with a local controller and 2 load generation agents, to test the
+# distributed mode on a single host.  Creates the tables from the CSV files of DATA_PATH and drops them afterwards.
+# Usage:  scripts/distributed_sqlite.sh [DATA_PATH] [big_data_benchmarking.py arguments]
+# The PYTHON and PORT environment variables override the Python interpreter and the port of the controller.
+
+cd "$(dirname "$0")/.."
+PYTHON=${PYTHON:-python3}
+PORT=${PORT:-5599}
+DATA_PATH=${1:-data}
+if [ $# -gt 0 ]; then
+    shift
+fi
+
+$PYTHON big_data_benchmarking.py --agent localhost:$PORT --agent-name agent1 &
+AGENT1=$!
+$PYTHON big_data_benchmarking.py --agent localhost:$PORT --agent-name agent2 &
+AGENT2=$!
+trap 'kill $AGENT1 $AGENT2 2>/dev/null || true' EXIT  # agents left waiting by a failed controller
+
+$PYTHON big_data_benchmarking.py SQLite --controller localhost:$PORT --agents 2 -c -d -p "$DATA_PATH" "$@"
+wait $AGENT1
+wait $AGENT2
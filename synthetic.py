@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+import inspect
+import hashlib
+import logging
+import multiprocessing
+import numpy
+import pandas
+from inflection import underscore
+from benchmark import Timer
+import bulk_load
+import schema
+
+
+CHUNK_ROWS = 100000  # rows generated at a time, fixed so the data never depends on the number of processes
+TYPES = ['integer', 'float', 'string', 'date']
+FLOAT_FORMAT = '%.6f'
+DATE_LENGTH = 10  # YYYY-MM-DD
+# the line terminator keyword of DataFrame.to_csv was renamed in pandas 1.5
+LINE_TERMINATOR = 'lineterminator' if 'lineterminator' in inspect.signature(pandas.DataFrame.to_csv).parameters \
+    else 'line_terminator'
+
+
+def load_spec(filepath):
+    """
+    Reads a JSON file describing the synthetic tables by name.  Every table has the number of 'rows' at scale factor 1
+    and a list of 'columns', each having a 'name', a 'type' among the TYPES and optionally:
+      'key':  true for a unique sequence 1, 2, 3...
+      'cardinality':  the number of distinct values, by default the number of rows of the table
+      'skew':  the exponent of the Zipfian distribution of the values, by default 0 for a uniform distribution
+      'null_ratio':  the fraction of NULL values, by default 0
+      'low' and 'high':  the range of the values of integer, float and date columns, over which the 'cardinality'
+        distinct values are spread.  Without 'high', integers and dates are consecutive from 'low' and floats range
+        up to 1
+    """
+    with open(filepath, 'r') as f:
+        spec = json.load(f)
+    for name, table_spec in spec.items():
+        for column in table_spec['columns']:
+            if column['type'] not in TYPES:
+                raise ValueError("Unsupported type of column " + column['name'] + " of table " + name + ":  " +
+                                 column['type'])
+    return spec
+
+
+def table_name(name, scale_factor):
+    """
+    Returns the name of a table at a scale factor, such as 'Sales_SF100' or 'Sales_SF0_1'.
+    """
+    return name + '_SF' + '{:g}'.format(scale_factor).replace('.', '_')
+
+
+def table_rows(table_spec, scale_factor):
+    return max(int(round(table_spec['rows'] * scale_factor)), 1)
+
+
+def random_state(*keys):
+    """
+    Returns a numpy RandomState seeded from a hash of the keys.  The RandomState streams are frozen across numpy
+    versions, so the same keys generate the same values on every machine.
+    """
+    digest = hashlib.sha1(':'.join(str(key) for key in keys).encode('utf-8')).digest()
+    return numpy.random.RandomState(int.from_bytes(digest[:4], 'little'))
+
+
+def ranks(state, size, cardinality, skew=0.0):
+    """
+    Draws 'size' value ranks between 0 and 'cardinality' - 1.  Ranks are uniform when 'skew' is 0, otherwise they
+    follow a bounded Zipfian distribution of exponent 'skew', sampled by inverting its continuous CDF so no table of
+    probabilities is built however large the cardinality.
+    """
+    u = state.random_sample(size)
+    if not skew:
+        drawn = numpy.floor(u * cardinality)
+    elif skew == 1:
+        drawn = numpy.floor(numpy.power(float(cardinality), u)) - 1
+    else:
+        drawn = numpy.floor(numpy.power((cardinality ** (1.0 - skew) - 1) * u + 1, 1.0 / (1.0 - skew))) - 1
+    return numpy.clip(drawn, 0, cardinality - 1).astype('int64')
+
+
+def column_values(column, rows, start, size, seed, name):
+    """
+    Generates the values of a column for the rows 'start' to 'start' + 'size' of a table of 'rows' rows.  Every column
+    of every chunk has its own random state, so adding a column or changing the chunk size of another table never
+    changes the values of a column.
+    """
+    if column.get('key'):
+        return pandas.Series(numpy.arange(start + 1, start + size + 1, dtype='int64'))
+    state = random_state(seed, name, column['name'], start)
+    cardinality = int(column.get('cardinality') or rows)
+    drawn = ranks(state, size, cardinality, column.get('skew', 0.0))
+    if column['type'] == 'integer':
+        low = int(column.get('low', 1))
+        if 'high' in column:
+            drawn = drawn * (int(column['high']) - low) // max(cardinality - 1, 1)
+        values = pandas.Series(drawn + low)
+    elif column['type'] == 'float':
+        low, high = float(column.get('low', 0.0)), float(column.get('high', 1.0))
+        values = pandas.Series(low + (high - low) * drawn / cardinality)
+    else:  # only the distinct values drawn are formatted, then repeated
+        distinct, inverse = numpy.unique(drawn, return_inverse=True)
+        if column['type'] == 'date':
+            low = numpy.datetime64(column.get('low', '2000-01-01'), 'D')
+            if 'high' in column:
+                days = (numpy.datetime64(column['high'], 'D') - low).astype('int64')
+                distinct = distinct * days // max(cardinality - 1, 1)
+            labels = (low + distinct.astype('timedelta64[D]')).astype(str)
+        else:
+            labels = (column['name'] + '_' + pandas.Series(distinct).astype(str).str.zfill(len(str(cardinality - 1)))).values
+        values = pandas.Series(labels.astype(object)[inverse])
+    null_ratio = column.get('null_ratio', 0.0)
+    if null_ratio:
+        values = values.astype(object).where(state.random_sample(size) >= null_ratio, None)
+    return values
+
+
+def generate_chunk(task):
+    """
+    Generates a chunk of rows of a table as a DataFrame.  Runs in a generator process.
+    """
+    name, table_spec, rows, chunk, seed = task
+    start = chunk * CHUNK_ROWS
+    size = min(CHUNK_ROWS, rows - start)
+    columns = [column['name'] for column in table_spec['columns']]
+    return pandas.DataFrame({column['name']: column_values(column, rows, start, size, seed, name)
+                             for column in table_spec['columns']}, columns=columns)
+
+
+def chunk_csv(task):
+    """
+    Generates a chunk of rows of a table formatted as CSV text, the first chunk having the header.
+    """
+    dataframe = generate_chunk(task)
+    return dataframe.to_csv(index=False, header=task[3] == 0, float_format=FLOAT_FORMAT, **{LINE_TERMINATOR: '\n'})
+
+
+def tasks(name, table_spec, scale_factor, seed):
+    rows = table_rows(table_spec, scale_factor)
+    return [(name, table_spec, rows, chunk, seed) for chunk in range((rows + CHUNK_ROWS - 1) // CHUNK_ROWS)]
+
+
+def fingerprint(table_spec, scale_factor, seed):
+    """
+    Returns a hash of everything the CSV file of a table depends on:  its spec, number of rows and seed, and the chunk
+    size and float format.
+    """
+    content = json.dumps({'spec': table_spec, 'rows': table_rows(table_spec, scale_factor), 'seed': seed,
+                          'chunk_rows': CHUNK_ROWS, 'float_format': FLOAT_FORMAT}, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def generated(filepath, file_fingerprint):
+    """
+    Returns whether a CSV file was generated with the same fingerprint and is unchanged since, from the '.json' file
+    written next to it after it was generated.
+    """
+    if not os.path.isfile(filepath) or not os.path.isfile(filepath + '.json'):
+        return False
+    with open(filepath + '.json', 'r') as f:
+        saved = json.load(f)
+    return saved['fingerprint'] == file_fingerprint and saved['size'] == os.path.getsize(filepath) and \
+        saved['mtime'] == os.path.getmtime(filepath)
+
+
+def generate(spec, scale_factor, seed, path, processes=None):
+    """
+    Writes every table of the 'spec' dictionary at 'scale_factor' to a CSV file in 'path', named by the table_name
+    function.  Chunks are generated and formatted in parallel by a pool of 'processes' and written in order, so a table
+    is byte-identical for the same seed whatever the number of processes or the machine.  A file already generated
+    from the same spec and seed is kept as is, so its modification time is unchanged and the keep loaded mode does not
+    load its table again.  Returns the list of files.
+    """
+    os.makedirs(path, exist_ok=True)
+    filepath_list = []
+    pool = multiprocessing.Pool(processes)
+    try:
+        for name, table_spec in sorted(spec.items()):
+            filepath = os.path.join(path, table_name(name, scale_factor) + '.csv')
+            file_fingerprint = fingerprint(table_spec, scale_factor, seed)
+            filepath_list.append(filepath)
+            if generated(filepath, file_fingerprint):
+                logging.info("Using generated " + table_name(name, scale_factor) + ":  " + filepath)
+                continue
+            with Timer() as t, open(filepath, 'w', newline='') as f:
+                for text in pool.imap(chunk_csv, tasks(name, table_spec, scale_factor, seed)):
+                    f.write(text)
+            with open(filepath + '.json', 'w') as f:  # written last, so an interrupted file is generated again
+                json.dump({'fingerprint': file_fingerprint, 'size': os.path.getsize(filepath),
+                           'mtime': os.path.getmtime(filepath)}, f)
+            logging.info("Generated " + str(table_rows(table_spec, scale_factor)) + " rows of " +
+                         table_name(name, scale_factor) + " in " + '{:.1f} sec:  '.format(t.interval) + filepath)
+    finally:
+        pool.close()
+        pool.join()
+    return filepath_list
+
+
+def table_schema(table_spec, rows):
+    """
+    Returns the schema of a synthetic table in the format of schema.infer, so the table is created like a table
+    inferred from a CSV file.  Date columns are stored as strings.
+    """
+    columns = []
+    for column in table_spec['columns']:
+        cardinality = int(column.get('cardinality') or rows)
+        if column['type'] == 'string':
+            kind, length = 'string', len(column['name']) + 1 + len(str(cardinality - 1))
+        elif column['type'] == 'date':
+            kind, length = 'string', DATE_LENGTH
+        elif column['type'] == 'integer' and 'high' in column:
+            kind, length = 'integer', max(len(str(int(column.get('low', 1)))), len(str(int(column['high']))))
+        elif column['type'] == 'integer':
+            kind, length = 'integer', len(str(int(column.get('low', 1)) + max(cardinality, rows)))
+        else:
+            kind, length = 'float', schema.FLOAT_LENGTH
+        columns.append({'header': column['name'], 'column': str.upper(underscore(column['name'])), 'type': kind,
+                        'length': length})
+    return {'rows': rows, 'columns': columns}
+
+
+def insert_chunk(task):
+    """
+    Generates a chunk of rows of a table and inserts it through the fastest bulk path of the database, returning the
+    number of rows and bytes inserted.  Runs in a loader process.
+    """
+    chunk_task, table, columns = task
+    dataframe = generate_chunk(chunk_task)
+    dataframe.columns = columns
+    bulk_load.insert(bulk_load.loader_engine, table, dataframe)
+    return len(dataframe.index), int(dataframe.memory_usage(index=False, deep=True).sum())
+
+
+def load(engine, spec, scale_factor, seed, processes=None, load_manifest=None):
+    """
+    Creates every table of the 'spec' dictionary at 'scale_factor' and inserts the generated rows directly through the
+    bulk_load insert paths, without writing CSV files.  Each loader process generates and inserts its own chunks.  With
+    a manifest.LoadManifest, a table is skipped when it was generated from the same spec and seed and its row count
+    verifies, otherwise it is dropped and generated again and its fingerprint recorded, like create_tables.individual.
+    Returns a DataFrame of the load statistics of every table, in which the 'cached' column flags the skipped tables.
+    """
+    stats_list = []
+    pool = multiprocessing.Pool(processes, initializer=bulk_load.initialize, initargs=(engine.url,))
+    try:
+        for name, table_spec in sorted(spec.items()):
+            rows = table_rows(table_spec, scale_factor)
+            inferred = table_schema(table_spec, rows)
+            table = table_name(name, scale_factor)
+            if load_manifest is not None:
+                table_fingerprint = {'generated': fingerprint(table_spec, scale_factor, seed)}
+                if load_manifest.matches(engine, table, table_fingerprint):
+                    logging.info("Table " + table + " is already generated with " + str(rows) + " rows, skipping")
+                    stats_list.append({'table_name': table, 'rows': rows, 'megabytes': float('nan'), 'seconds': 0.0,
+                                       'rows_per_sec': float('nan'), 'mb_per_sec': float('nan'), 'cached': True})
+                    continue
+                schema.table(table, inferred).drop(engine, checkfirst=True)  # never append to a stale table
+            schema.create(engine, table, inferred)
+            columns = [column['column'] for column in inferred['columns']]
+            loaded_rows = 0
+            megabytes = 0
+            with Timer() as t:
+                for chunk_rows, chunk_bytes in pool.imap_unordered(
+                        insert_chunk, [(task, table, columns) for task in tasks(name, table_spec, scale_factor, seed)]):
+                    loaded_rows += chunk_rows
+                    megabytes += chunk_bytes / (1024 * 1024)
+            stats = {'table_name': table, 'rows': loaded_rows, 'megabytes': megabytes, 'seconds': t.interval,
+                     'rows_per_sec': loaded_rows / t.interval, 'mb_per_sec': megabytes / t.interval, 'cached': False}
+            logging.info("Generated and loaded " + stats['table_name'] + ":  " + str(loaded_rows) + " rows, " +
+                         '{:.1f} MB in {:.1f} sec  ({:.0f} rows/sec)'.format(megabytes, t.interval, stats['rows_per_sec']))
+            if load_manifest is not None:
+                load_manifest.record(table, table_fingerprint, loaded_rows)
+            stats_list.append(stats)
+    finally:
+        pool.close()
+        pool.join()
+    return pandas.DataFrame(stats_list)
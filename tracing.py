@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+import time
+import logging
+import multiprocessing
+from threading import current_thread
+
+
+# Spans of the current process, buffered in memory as tuples until saved.  Appending to a list is atomic, so the
+# threads record their spans without a lock, and nothing is recorded until the start function is called.
+events = []
+enabled = False
+
+
+def start():
+    """
+    Starts recording the spans of this process, discarding the spans inherited from a parent process.
+    """
+    global enabled
+    del events[:]
+    enabled = True
+
+
+def complete(name, started_at, seconds, **args):
+    """
+    Records a span of the current thread that started at the 'started_at' wall clock time and lasted 'seconds', such
+    as a span measured in a worker process.  Spans without a duration are ignored.
+    """
+    if enabled and seconds is not None and seconds == seconds:  # not NaN
+        events.append((name, started_at, seconds, current_thread().name, args))
+
+
+class Span:
+    """
+    Records the time spent in a block of code as a span of the current thread.
+    """
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started_at = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        complete(self.name, self.started_at, time.time() - self.started_at, **self.args)
+        return False
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, **args):
+    """
+    Returns a context manager recording a span of the current thread, or doing nothing when tracing is not started.
+    """
+    return Span(name, args) if enabled else NULL_SPAN
+
+
+def save(filepath, run_id):
+    """
+    Appends the buffered spans of this process to a JSON lines file, one line per span, and empties the buffer.  The
+    spans are written with a single write so the processes of a parallel run can append to the same file.
+    """
+    if not enabled or not events:
+        return
+    process = multiprocessing.current_process().name
+    lines = [json.dumps({'run_id': run_id, 'name': name, 'started_at': started_at, 'seconds': seconds,
+                         'process': process, 'thread': thread, 'args': args}, default=str)
+             for name, started_at, seconds, thread, args in list(events)]
+    del events[:len(lines)]
+    with open(filepath, 'a') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def export(filepath, trace_filepath, run_id):
+    """
+    Exports the spans of a run saved to the JSON lines file to a trace file in the Chrome trace event format, which
+    can be opened in chrome://tracing or https://ui.perfetto.dev.  Every process is a group of tracks named after it and
+    every thread, such as a virtual user, its own track, so the overlapping executions and the idle gaps between them
+    are visible.  Returns the number of spans exported.
+    """
+    spans = []
+    if os.path.isfile(filepath):
+        with open(filepath, 'r') as f:
+            spans = [json.loads(line) for line in f if line.endswith('\n')]  # the last line may be incomplete
+    spans = [line for line in spans if line['run_id'] == run_id]
+    pids = {}
+    tids = {}
+    trace_events = []
+    for line in spans:
+        if line['process'] not in pids:
+            pids[line['process']] = len(pids) + 1
+            trace_events.append({'ph': 'M', 'name': 'process_name', 'pid': pids[line['process']], 'tid': 0,
+                                 'args': {'name': line['process']}})
+        pid = pids[line['process']]
+        if (pid, line['thread']) not in tids:
+            tids[(pid, line['thread'])] = len(tids) + 1
+            trace_events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tids[(pid, line['thread'])],
+                                 'args': {'name': line['thread']}})
+        trace_events.append({'ph': 'X', 'name': line['name'], 'pid': pid, 'tid': tids[(pid, line['thread'])],
+                             'ts': line['started_at'] * 1e6, 'dur': line['seconds'] * 1e6, 'args': line['args']})
+    with open(trace_filepath, 'w') as f:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms', 'otherData': {'run_id': run_id}}, f)
+    logging.info("Exported " + str(len(spans)) + " spans of run " + run_id + " to trace file:  " + trace_filepath)
+    return len(spans)
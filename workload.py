@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+
+import os
+import json
+import random
+import hashlib
+import logging
+import pandas
+import benchmark
+import tracing
+
+
+WORKLOAD_VERSION = 2  # incremented whenever the way queries are compiled changes
+script_dir = os.path.dirname(os.path.abspath(__file__))
+workloads_path = os.path.join(script_dir, 'queries', 'workloads')
+
+
+def fingerprint(queries_dataframe, schemas, families, args):
+    """
+    Returns the workload id, a hash of everything the compiled queries depend on:  the workload version, the seed, the
+    maximum number of rows, the number of iterations, the query templates and timeouts, the columns of every table and
+    the name every table is seeded from, its table family when sweeping.
+    """
+    query_columns = [column for column in ['query_id', 'query_template', 'timeout']
+                     if column in queries_dataframe.columns]
+    content = json.dumps({'version': WORKLOAD_VERSION, 'seed': args['seed'], 'rows': args['rows'],
+                          'iterations': args['iterations'], 'schemas': schemas, 'families': families,
+                          'queries': queries_dataframe[query_columns].astype(str).values.tolist()},
+                         sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]
+
+
+def build(queries_dataframe, tables_dataframe, catalog, engine, database, args):
+    """
+    Expands every query template against every table for every iteration into a concrete sql query, writing the
+    workload to a CSV file in the 'queries/workloads' directory.  The random choices of every query are seeded from
+    the 'seed' argument, the table name, the query id and the iteration, and the columns are sorted by name, so the same
+    seed builds the same queries on every database and in every run.  Tables having a 'table_family' are seeded from
+    their family instead, so every size of a table is queried the same way.  A workload already compiled with the same id is
+    read from its file instead.  Returns the workload DataFrame joined with the 'tables_dataframe' parameter.
+    """
+    schemas = {}
+    for table_name in tables_dataframe['table_name']:
+        datatypes_dataframe = catalog.datatypes(engine, table_name)
+        schemas[table_name] = datatypes_dataframe[['column_name', 'data_type']].astype(str).sort_values('column_name')
+    families = {table_row['table_name']: table_row.get('table_family', table_row['table_name'])
+                for table_index, table_row in tables_dataframe.iterrows()}
+    workload_id = fingerprint(queries_dataframe, {table_name: datatypes_dataframe.values.tolist()
+                                                  for table_name, datatypes_dataframe in schemas.items()}, families, args)
+    filepath = os.path.join(workloads_path, database.replace(' ', '_') + '_' + workload_id + '.csv')
+    if os.path.isfile(filepath):
+        logging.info("Using compiled workload:  " + filepath)
+        return load(filepath, tables_dataframe)
+
+    workload_list = []
+    for iteration in range(1, args['iterations'] + 1):
+        for table_index, table_row in tables_dataframe.iterrows():
+            with tracing.span('build', table_name=table_row['table_name'], iteration=iteration):
+                for query_index, query_row in queries_dataframe.iterrows():
+                    rng = random.Random(str(args['seed']) + ':' + families[table_row['table_name']] + ':' +
+                                        str(query_row['query_id']) + ':' + str(iteration))
+                    try:
+                        query_builder_dict = benchmark.query_builder(table_row['table_name'],
+                                                                     schemas[table_row['table_name']], args['rows'],
+                                                                     rng)
+                        query_executed = query_row['query_template'].format(**query_builder_dict)
+                    except Exception as error:
+                        logging.error("Unable to build query " + str(query_row['query_id']) + " for table " +
+                                      table_row['table_name'] + ":  " + str(error))
+                        continue
+                    workload_row = query_row.to_dict()
+                    workload_row.update({'table_name': table_row['table_name'], 'iteration': iteration,
+                                         'query_executed': query_executed, 'workload_id': workload_id})
+                    workload_list.append(workload_row)
+    workload_dataframe = pandas.DataFrame(workload_list)
+    os.makedirs(workloads_path, exist_ok=True)
+    workload_dataframe.to_csv(filepath, index=False)
+    logging.info("Compiled " + str(len(workload_dataframe.index)) + " queries to workload:  " + filepath)
+    return workload_dataframe.merge(tables_dataframe, on='table_name')
+
+
+def load(filepath, tables_dataframe):
+    """
+    Reads a compiled workload from its CSV file, joined with the current row count and size category of its tables
+    from the 'tables_dataframe' parameter.  Queries against tables missing from the database are dropped.
+    """
+    workload_dataframe = pandas.read_csv(filepath, dtype={'workload_id': str, 'table_name': str, 'query_executed': str})
+    return workload_dataframe.merge(tables_dataframe, on='table_name')